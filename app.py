@@ -1,16 +1,42 @@
 import random
 import json
 import uuid
-from datetime import datetime, timedelta
-from typing import Dict, List, Any, Optional
-from dataclasses import dataclass, asdict
-from enum import Enum
+import hashlib
+from datetime import datetime, timedelta, timezone
+from collections.abc import Mapping
+from typing import Dict, List, Any, Optional, Tuple
 import numpy as np
-from faker import Faker
 import logging
-from flask import Flask, render_template, request, jsonify
+from flask import Flask, Response, render_template, request, jsonify, send_file
 import threading
 import time
+import os
+import re
+
+from models import (
+    FraudPattern, Transaction, PAYMENT_METHODS, FRAUD_PATTERN_CODES, LOCATIONS,
+    payment_methods_for_location, currency_for_location,
+)
+from currency import FxRates, CURRENCY_INDEX, DEFAULT_RATES
+from batch_engine import BatchEngine, OrderedRelease, TransactionBatch, format_ip, format_timestamp, now_us, EPOCH
+from ip_blocks import IpBlocks
+from transaction_store import TransactionStore
+from transaction_index import TransactionQuery, QUERY_FIELDS, amount_bin_edges
+from features import FeatureIndex, FEATURE_DTYPES
+from traffic import TrafficModel
+from serialization import JSON, MSGPACK, encode_report, response_formats
+from report import ReportAggregator
+from exporter import StreamingExporter
+from sharding import run_sharded
+from live_stream import LiveStream, STREAM_FORMATS, encode_stream
+from replay import Replayer
+from jobs import Job, JobManager, QueueFull, JOB_STATES
+from snapshots import SNAPSHOT_REPORT_ROWS
+from checkpoint import Checkpointer, load_checkpoint
+from metrics import METRICS
+from data_pools import DataPools, DeviceFingerprints, MerchantIds, MerchantDirectory, load_or_build_pools
+from user_table import UserTable, UserIds, UserDirectory, load_or_build_users
+from seeding import new_seed, python_stream, TRANSACTIONS, IDS
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -19,510 +45,625 @@ logger = logging.getLogger(__name__)
 app = Flask(__name__)
 app.secret_key = 'your-secret-key-here'
 
-class FraudPattern(Enum):
-    RAPID_FIRE = "rapid_fire"
-    GEOGRAPHIC_HOPPING = "geographic_hopping"
-    DEVICE_SPOOFING = "device_spoofing"
-    AMOUNT_ESCALATION = "amount_escalation"
-    MERCHANT_CYCLING = "merchant_cycling"
-    VELOCITY_ATTACK = "velocity_attack"
-    ACCOUNT_TAKEOVER = "account_takeover"
-    MIXED_PATTERNS = "mixed_patterns"
-
-@dataclass
-class Transaction:
-    transaction_id: str
-    user_id: str
-    amount: float
-    currency: str
-    merchant_id: str
-    merchant_category: str
-    timestamp: str
-    device_fingerprint: str
-    ip_address: str
-    location: Dict[str, Any]
-    payment_method: str
-    is_synthetic: bool = True
-    fraud_pattern: Optional[str] = None
-    risk_score: Optional[float] = None
+# Default simulated start time of seeded runs, so equal seeds give equal timestamps
+SEEDED_START_TIME = datetime(2024, 1, 1)
+
+# Streaming exports are written to a fresh subdirectory of this directory per run
+EXPORT_DIR = os.environ.get('EXPORT_DIR', 'exports')
+
+# Most transactions one /get_report page may carry
+MAX_REPORT_TRANSACTIONS = int(os.environ.get('MAX_REPORT_TRANSACTIONS', 10000))
+
+# Device and merchant pools are cached here as memory-mapped .npy files, keyed by
+# seed and pool sizes, so restarts and worker processes skip rebuilding them
+POOL_CACHE_DIR = os.environ.get('POOL_CACHE_DIR')
+
+# Memory each run's transaction store may hold before spilling sealed segments to SPILL_DIR
+# (default: the system temporary directory); unset keeps every row in memory
+STORE_MEMORY_BUDGET = int(os.environ['STORE_MEMORY_BUDGET_MB']) << 20 if os.environ.get('STORE_MEMORY_BUDGET_MB') else None
+SPILL_DIR = os.environ.get('SPILL_DIR')
+
+# Checkpoints of runs started with "checkpoint" enabled, one subdirectory per checkpoint id
+CHECKPOINT_DIR = os.environ.get('CHECKPOINT_DIR', os.path.join(EXPORT_DIR, 'checkpoints'))
+CHECKPOINT_ID = re.compile(r'[0-9a-f]{12}')
 
 class SyntheticFraudSimulator:
-    def __init__(self):
-        self.faker = Faker()
-        self.transactions: List[Transaction] = []
-        self.users: Dict[str, Dict] = {}
-        self.merchants: Dict[str, Dict] = {}
-        self.device_pool: List[str] = []
-        self.locations: List[Dict] = []
+    def __init__(self, seed: Optional[int] = None, num_devices: int = 10000, num_merchants: int = 1000,
+                 num_cities: Optional[int] = None, pool_cache_dir: Optional[str] = POOL_CACHE_DIR):
+        self.transactions = TransactionStore()
+        self.report = ReportAggregator()
+        self.user_table = UserTable.empty()
+        self.users: Mapping[str, Dict] = {}
+        self.stream = LiveStream()
+        self.compute_features = False
+        self.store_memory_budget = STORE_MEMORY_BUDGET
+        self.feature_index: Optional[FeatureIndex] = None
+        self.num_devices = num_devices
+        self.num_merchants = num_merchants
+        self.locations: List[Dict] = LOCATIONS[:num_cities]
+        self.city_index = {location["city"]: i for i, location in enumerate(self.locations)}
+        self.ip_blocks = IpBlocks(self.locations)
+        self.fx_rates = DEFAULT_RATES
+        self.pool_cache_dir = pool_cache_dir
+        self._pools_lock = threading.Lock()
         self.simulation_running = False
         self.simulation_progress = 0
         
-        self._initialize_data_pools()
-    
-    def _initialize_data_pools(self):
-        """Initialize pools of synthetic data for realistic simulation"""
-        
-        # Generate 10,000 device fingerprints
-        self.device_pool = [
-            self._generate_device_fingerprint() for _ in range(10000)
-        ]
-        
-        # Generate 30 locations
-        self.locations = [
-            {"city": "Lagos", "country": "Nigeria", "lat": 6.5244, "lon": 3.3792, "timezone": "Africa/Lagos"},
-            {"city": "Cairo", "country": "Egypt", "lat": 30.0444, "lon": 31.2357, "timezone": "Africa/Cairo"},
-            {"city": "Kinshasa", "country": "DRC", "lat": -4.4419, "lon": 15.2663, "timezone": "Africa/Kinshasa"},
-            {"city": "Johannesburg", "country": "South Africa", "lat": -26.2041, "lon": 28.0473, "timezone": "Africa/Johannesburg"},
-            {"city": "Nairobi", "country": "Kenya", "lat": -1.2921, "lon": 36.8219, "timezone": "Africa/Nairobi"},
-            {"city": "Casablanca", "country": "Morocco", "lat": 33.5731, "lon": -7.5898, "timezone": "Africa/Casablanca"},
-            {"city": "Addis Ababa", "country": "Ethiopia", "lat": 9.1450, "lon": 40.4897, "timezone": "Africa/Addis_Ababa"},
-            {"city": "Dar es Salaam", "country": "Tanzania", "lat": -6.7924, "lon": 39.2083, "timezone": "Africa/Dar_es_Salaam"},
-            {"city": "Accra", "country": "Ghana", "lat": 5.6037, "lon": -0.1870, "timezone": "Africa/Accra"},
-            {"city": "Abidjan", "country": "Ivory Coast", "lat": 5.3600, "lon": -4.0083, "timezone": "Africa/Abidjan"},
-            {"city": "New York", "country": "US", "lat": 40.7128, "lon": -74.0060, "timezone": "America/New_York"},
-            {"city": "London", "country": "UK", "lat": 51.5074, "lon": -0.1278, "timezone": "Europe/London"},
-            {"city": "Tokyo", "country": "Japan", "lat": 35.6762, "lon": 139.6503, "timezone": "Asia/Tokyo"},
-            {"city": "Sydney", "country": "Australia", "lat": -33.8688, "lon": 151.2093, "timezone": "Australia/Sydney"},
-            {"city": "Berlin", "country": "Germany", "lat": 52.5200, "lon": 13.4050, "timezone": "Europe/Berlin"},
-            {"city": "Singapore", "country": "Singapore", "lat": 1.3521, "lon": 103.8198, "timezone": "Asia/Singapore"},
-            {"city": "Dubai", "country": "UAE", "lat": 25.2048, "lon": 55.2708, "timezone": "Asia/Dubai"},
-            {"city": "São Paulo", "country": "Brazil", "lat": -23.5505, "lon": -46.6333, "timezone": "America/Sao_Paulo"},
-            {"city": "Mumbai", "country": "India", "lat": 19.0760, "lon": 72.8777, "timezone": "Asia/Kolkata"},
-            {"city": "Mexico City", "country": "Mexico", "lat": 19.4326, "lon": -99.1332, "timezone": "America/Mexico_City"},
-            {"city": "Moscow", "country": "Russia", "lat": 55.7558, "lon": 37.6176, "timezone": "Europe/Moscow"},
-            {"city": "Paris", "country": "France", "lat": 48.8566, "lon": 2.3522, "timezone": "Europe/Paris"},
-            {"city": "Bangkok", "country": "Thailand", "lat": 13.7563, "lon": 100.5018, "timezone": "Asia/Bangkok"},
-            {"city": "Seoul", "country": "South Korea", "lat": 37.5665, "lon": 126.9780, "timezone": "Asia/Seoul"},
-            {"city": "Jakarta", "country": "Indonesia", "lat": -6.2088, "lon": 106.8456, "timezone": "Asia/Jakarta"},
-            {"city": "Istanbul", "country": "Turkey", "lat": 41.0082, "lon": 28.9784, "timezone": "Europe/Istanbul"},
-            {"city": "Buenos Aires", "country": "Argentina", "lat": -34.6118, "lon": -58.3960, "timezone": "America/Argentina/Buenos_Aires"},
-            {"city": "Toronto", "country": "Canada", "lat": 43.6532, "lon": -79.3832, "timezone": "America/Toronto"},
-            {"city": "Hong Kong", "country": "Hong Kong", "lat": 22.3193, "lon": 114.1694, "timezone": "Asia/Hong_Kong"},
-            {"city": "Madrid", "country": "Spain", "lat": 40.4168, "lon": -3.7038, "timezone": "Europe/Madrid"},
-        ]
-                
-        # Generate merchant pool
-        merchant_categories = [
-            "grocery", "gas_station", "restaurant", "retail", "online", 
-            "pharmacy", "hotel", "airline", "entertainment", "subscription",
-            "utility", "electronics", "jewelry", "automotive", "healthcare", 
-            "education", "transport", "banking", "insurance", "real_estate", "beauty",
-        ]
-        
-        for i in range(1000):
-            merchant_id = f"merchant_{i:04d}"
-            location = random.choice(self.locations)
-            
-            # Mobile money agents more common in African cities
-            if location["country"] in ["Ghana", "Kenya", "Tanzania", "Uganda", "Rwanda", "Ivory Coast", "Ethiopia", "Nigeria"]:
-                category = random.choice(merchant_categories + ["mobile_money_agent"] * 5)
-            else:
-                category = random.choice(merchant_categories)
-            
-            self.merchants[merchant_id] = {
-                "name": self.faker.company(),
-                "category": category,
-                "risk_level": random.choice(["low", "medium", "high"]),
-                "location": location
-            }
+        self.reseed(seed)
     
-    def _generate_device_fingerprint(self) -> str:
-        """Generate a realistic device fingerprint"""
-        browsers = ["Chrome", "Firefox", "Safari", "Edge", "Opera", "UC Browser", "Samsung Internet"]
-        os_list = ["Windows", "MacOS", "Linux", "iOS", "Android", "KaiOS", "Ubuntu Touch"]
-        
-        return f"{random.choice(browsers)}_{random.choice(os_list)}_{uuid.uuid4().hex[:8]}"
+    def reseed(self, seed: Optional[int] = None):
+        """Derive every random stream from `seed` (a fresh one if None) and drop the data pools
+        
+        Devices, merchants, users, per-row transactions, ids and batch
+        generation each get an independent stream, so the same seed always
+        yields the same pools and the same simulation output. The pools are
+        rebuilt lazily, on first use, from the new seed.
+        """
+        self.seed = new_seed() if seed is None else int(seed)
+        self.seed_sequence = np.random.SeedSequence(self.seed)
+        self.transaction_random = python_stream(self.seed_sequence, TRANSACTIONS)
+        self.id_random = python_stream(self.seed_sequence, IDS)
+        self._pools = None
+        self._merchants = None
+        self._row_engine = None
+    
+    @property
+    def pools(self) -> DataPools:
+        """Device and merchant pools, built (or loaded from the pool cache) on first use"""
+        with self._pools_lock:
+            if self._pools is None:
+                self._pools = load_or_build_pools(self.seed, self.seed_sequence, self.num_devices,
+                                                  self.num_merchants, self.locations, self.pool_cache_dir)
+            return self._pools
+    
+    @property
+    def device_pool(self) -> DeviceFingerprints:
+        return DeviceFingerprints(self.pools.device_codes)
+    
+    @property
+    def merchant_ids(self) -> MerchantIds:
+        return MerchantIds(self.num_merchants)
+    
+    @property
+    def merchants(self) -> MerchantDirectory:
+        if self._merchants is None:
+            self._merchants = MerchantDirectory(self.pools, self.locations, self.seed_sequence)
+        return self._merchants
+    
+    def _random_uuid(self, rng: random.Random) -> uuid.UUID:
+        """Version-4 UUID drawn from one of the seeded streams"""
+        return uuid.UUID(int=rng.getrandbits(128), version=4)
+    
+    def _random_ip(self, location: Dict) -> str:
+        """IPv4 address in `location`'s country, drawn from the per-row transaction stream"""
+        return format_ip(self.ip_blocks.random_address(self.transaction_random, self.city_index[location["city"]]))
     
     def _get_payment_methods_for_location(self, location: Dict) -> List[str]:
         """Get appropriate payment methods based on location"""
-        base_methods = ["credit_card", "debit_card", "digital_wallet"]
-        
-        # Add bank transfer & mobile money for African countries
-        if location["country"] in ["Nigeria", "Kenya", "Ghana", "Tanzania", "Uganda", "Rwanda", "Ivory Coast", "Ethiopia", "South Africa"]:
-            return base_methods + ["mobile_money", "bank_transfer"]
-        
-        return base_methods
-    
-    def _generate_user(self) -> Dict[str, Any]:
-        """Generate a synthetic user profile"""
-        user_id = str(uuid.uuid4())
-        home_location = random.choice(self.locations)
-        
-        user = {
-            "user_id": user_id,
-            "name": self.faker.name(),
-            "email": self.faker.email(),
-            "phone": self.faker.phone_number(),
-            "home_location": home_location,
-            "account_age_days": random.randint(30, 1095),
-            "average_transaction_amount": random.uniform(10, 1000),
-            "preferred_merchants": random.sample(list(self.merchants.keys()), k=random.randint(5, 20)),
-            "risk_profile": random.choice(["low", "medium", "high"]),
-            "devices": random.sample(self.device_pool, k=random.randint(1, 5)),
-            "preferred_payment_methods": self._get_payment_methods_for_location(home_location)
-        }
-        
-        self.users[user_id] = user
-        return user
+        return payment_methods_for_location(location)
+    
+    def _reset_users(self, num_users: int):
+        """Build (or load from the pool cache) the user population of the current seed
+        
+        Users are held as a UserTable of arrays; the per-user dicts of
+        self.users, including generated names and contact details, are only
+        built when a user is looked up.
+        """
+        with METRICS.timed("user_generation") as timer:
+            self.user_table = load_or_build_users(self.seed, self.seed_sequence, num_users, self.num_devices,
+                                                  self.num_merchants, len(self.locations), self.pool_cache_dir)
+            self.users = UserDirectory(self.user_table, self.pools, self.locations, self.seed_sequence)
+            self._row_engine = None
+            timer.rows = num_users
     
     def generate_normal_transaction(self, user_id: str) -> Transaction:
         """Generate a non-fraudulent transaction"""
         user = self.users[user_id]
         
-        merchant_id = random.choice(user["preferred_merchants"])
-        device = random.choice(user["devices"])
+        merchant_id = self.transaction_random.choice(user["preferred_merchants"])
+        device = self.transaction_random.choice(user["devices"])
         
-        amount = np.random.normal(user["average_transaction_amount"], 
-                                user["average_transaction_amount"] * 0.3)
+        amount = self.transaction_random.normalvariate(user["average_transaction_amount"], 
+                                               user["average_transaction_amount"] * 0.3)
         amount = max(1.0, round(amount, 2))
         
+        # Users pay in their home currency; amounts are drawn in the model currency
+        currency = currency_for_location(user["home_location"])
+        native, base = self.fx_rates.price(amount, CURRENCY_INDEX[currency])
+        
         # Location is usually near home location, but can vary
-        if random.random() < 0.8:
+        if self.transaction_random.random() < 0.8:
             location = user["home_location"]
         else:
-            location = random.choice(self.locations)
+            location = self.transaction_random.choice(self.locations)
         
         # Choose appropriate payment method
-        payment_method = random.choice(user["preferred_payment_methods"])
+        payment_method = self.transaction_random.choice(user["preferred_payment_methods"])
         
         return Transaction(
-            transaction_id=str(uuid.uuid4()),
+            transaction_id=str(self._random_uuid(self.id_random)),
             user_id=user_id,
-            amount=amount,
-            currency=random.choice(["USD", "EUR", "GBP", "NGN", "KES", "GHS", "ZAR"]),
+            amount=float(native),
+            currency=currency,
             merchant_id=merchant_id,
             merchant_category=self.merchants[merchant_id]["category"],
-            timestamp=datetime.utcnow().isoformat(),
+            timestamp=format_timestamp(now_us()),
             device_fingerprint=device,
-            ip_address=self.faker.ipv4(),
+            ip_address=self._random_ip(location),
             location=location,
             payment_method=payment_method,
             fraud_pattern=None,
-            risk_score=random.uniform(0.1, 0.3)
+            risk_score=self.transaction_random.uniform(0.1, 0.3),
+            amount_base=float(base)
         )
     
+    @property
+    def row_engine(self) -> BatchEngine:
+        """Engine behind the per-row attack generators, drawing from the transaction streams"""
+        if self._row_engine is None:
+            self._row_engine = BatchEngine(self)
+            self._row_engine._use_streams(TRANSACTIONS)
+        return self._row_engine
+    
+    def generate_attack(self, pattern: str, user_id: str, count: Optional[int] = None) -> List[Transaction]:
+        """One attack of `pattern` on `user_id` starting now, through the pattern's registered kernel
+        
+        `count` fixes the number of rows; by default it is drawn the way
+        run_simulation draws it.
+        """
+        try:
+            user = self.users.ids.index(user_id)
+        except ValueError:
+            raise KeyError(user_id)
+        batch = self.row_engine.attack(pattern, np.array([user]), np.array([now_us()]),
+                                       None if count is None else np.array([count]))
+        return TransactionStore(self.users.ids, self.merchant_ids, self.locations).to_transactions(batch)
+    
     def generate_rapid_fire_attack(self, user_id: str, count: int = 10) -> List[Transaction]:
         """Simulate rapid-fire low-value purchases"""
-        transactions = []
-        user = self.users[user_id]
-        device = random.choice(user["devices"])
-        base_time = datetime.utcnow()
-        
-        for i in range(count):
-            amount = random.uniform(1.0, 15.0)
-            timestamp = base_time + timedelta(seconds=i * random.randint(1, 5))
-            
-            transaction = Transaction(
-                transaction_id=str(uuid.uuid4()),
-                user_id=user_id,
-                amount=amount,
-                currency="USD",
-                merchant_id=random.choice(list(self.merchants.keys())),
-                merchant_category=random.choice(["online", "retail", "grocery"]),
-                timestamp=timestamp.isoformat(),
-                device_fingerprint=device,
-                ip_address=self.faker.ipv4(),
-                location=user["home_location"],
-                payment_method=random.choice(user["preferred_payment_methods"]),
-                fraud_pattern=FraudPattern.RAPID_FIRE.value,
-                risk_score=random.uniform(0.7, 0.9)
-            )
-            transactions.append(transaction)
-        
-        return transactions
+        return self.generate_attack(FraudPattern.RAPID_FIRE.value, user_id, count)
     
     def generate_geographic_hopping(self, user_id: str, count: int = 5) -> List[Transaction]:
         """Simulate impossible travel patterns"""
-        transactions = []
-        user = self.users[user_id]
-        device = random.choice(user["devices"])
-        base_time = datetime.utcnow()
-        
-        locations = random.sample(self.locations, min(count, len(self.locations)))
-        
-        for i, location in enumerate(locations):
-            timestamp = base_time + timedelta(minutes=i * random.randint(5, 30))
-            
-            transaction = Transaction(
-                transaction_id=str(uuid.uuid4()),
-                user_id=user_id,
-                amount=random.uniform(50, 500),
-                currency="USD",
-                merchant_id=random.choice(list(self.merchants.keys())),
-                merchant_category=random.choice(["hotel", "restaurant", "gas_station"]),
-                timestamp=timestamp.isoformat(),
-                device_fingerprint=device,
-                ip_address=self.faker.ipv4(),
-                location=location,
-                payment_method=random.choice(user["preferred_payment_methods"]),
-                fraud_pattern=FraudPattern.GEOGRAPHIC_HOPPING.value,
-                risk_score=random.uniform(0.8, 0.95)
-            )
-            transactions.append(transaction)
-        
-        return transactions
+        return self.generate_attack(FraudPattern.GEOGRAPHIC_HOPPING.value, user_id, count)
     
     def generate_device_spoofing(self, user_id: str, count: int = 8) -> List[Transaction]:
         """Simulate device fingerprint manipulation"""
-        transactions = []
-        user = self.users[user_id]
-        base_time = datetime.utcnow()
-        
-        for i in range(count):
-            device = self._generate_device_fingerprint()
-            timestamp = base_time + timedelta(minutes=i * random.randint(10, 60))
-            
-            transaction = Transaction(
-                transaction_id=str(uuid.uuid4()),
-                user_id=user_id,
-                amount=random.uniform(100, 1000),
-                currency="USD",
-                merchant_id=random.choice(list(self.merchants.keys())),
-                merchant_category=random.choice(["online", "retail", "electronics"]),
-                timestamp=timestamp.isoformat(),
-                device_fingerprint=device,
-                ip_address=self.faker.ipv4(),
-                location=random.choice(self.locations),
-                payment_method=random.choice(user["preferred_payment_methods"]),
-                fraud_pattern=FraudPattern.DEVICE_SPOOFING.value,
-                risk_score=random.uniform(0.6, 0.85)
-            )
-            transactions.append(transaction)
-        
-        return transactions
+        return self.generate_attack(FraudPattern.DEVICE_SPOOFING.value, user_id, count)
     
     def generate_amount_escalation(self, user_id: str, count: int = 6) -> List[Transaction]:
         """Simulate gradual amount escalation to test limits"""
-        transactions = []
-        user = self.users[user_id]
-        device = random.choice(user["devices"])
-        base_time = datetime.utcnow()
-        
-        base_amount = user["average_transaction_amount"]
-        
-        for i in range(count):
-            multiplier = 1.5 ** i
-            amount = base_amount * multiplier
-            timestamp = base_time + timedelta(hours=i * random.randint(1, 6))
-            
-            transaction = Transaction(
-                transaction_id=str(uuid.uuid4()),
-                user_id=user_id,
-                amount=round(amount, 2),
-                currency="USD",
-                merchant_id=random.choice(list(self.merchants.keys())),
-                merchant_category=random.choice(["retail", "electronics", "luxury"]),
-                timestamp=timestamp.isoformat(),
-                device_fingerprint=device,
-                ip_address=self.faker.ipv4(),
-                location=user["home_location"],
-                payment_method=random.choice(user["preferred_payment_methods"]),
-                fraud_pattern=FraudPattern.AMOUNT_ESCALATION.value,
-                risk_score=min(0.95, 0.4 + (i * 0.1))
-            )
-            transactions.append(transaction)
-        
-        return transactions
+        return self.generate_attack(FraudPattern.AMOUNT_ESCALATION.value, user_id, count)
     
     def generate_merchant_cycling(self, user_id: str, count: int = 12) -> List[Transaction]:
         """Simulate cycling through many merchants quickly"""
-        transactions = []
-        user = self.users[user_id]
-        device = random.choice(user["devices"])
-        base_time = datetime.utcnow()
-        
-        # Use different merchants each time
-        merchants = random.sample(list(self.merchants.keys()), min(count, len(self.merchants)))
-        
-        for i, merchant_id in enumerate(merchants):
-            timestamp = base_time + timedelta(minutes=i * random.randint(2, 8))
-            
-            transaction = Transaction(
-                transaction_id=str(uuid.uuid4()),
-                user_id=user_id,
-                amount=random.uniform(20, 200),
-                currency="USD",
-                merchant_id=merchant_id,
-                merchant_category=self.merchants[merchant_id]["category"],
-                timestamp=timestamp.isoformat(),
-                device_fingerprint=device,
-                ip_address=self.faker.ipv4(),
-                location=user["home_location"],
-                payment_method=random.choice(user["preferred_payment_methods"]),
-                fraud_pattern=FraudPattern.MERCHANT_CYCLING.value,
-                risk_score=random.uniform(0.5, 0.8)
-            )
-            transactions.append(transaction)
-        
-        return transactions
+        return self.generate_attack(FraudPattern.MERCHANT_CYCLING.value, user_id, count)
     
     def run_simulation(self, duration_hours: int = 24, transactions_per_hour: int = 100, 
                       fraud_patterns: List[str] = None, fraud_rate: float = 0.15,
-                      progress_callback=None):
-        """Run the main simulation with progress tracking"""
-        logger.info(f"Starting simulation for {duration_hours} hours")
-        
+                      progress_callback=None, batch_size: int = 10000,
+                      exporter: Optional[StreamingExporter] = None, retain: bool = True,
+                      workers: int = 1, shard_by: str = "hours", seed: Optional[int] = None,
+                      start_time: Optional[datetime] = None, features: bool = False,
+                      num_users: Optional[int] = None, traffic: Optional[Dict[str, Any]] = None,
+                      checkpoint_dir: Optional[str] = None, checkpoint_interval: float = 60.0,
+                      store_memory_budget: Optional[int] = STORE_MEMORY_BUDGET,
+                      fx_rates: Optional[Dict[str, Any]] = None):
+        """Run the main simulation with progress tracking
+
+        Each hour is generated in chunks of up to `batch_size` steps by the
+        vectorized BatchEngine; stop requests are honoured between chunks.
+        With an `exporter`, every chunk is streamed to disk as it is generated;
+        pass `retain=False` to keep memory flat by not storing rows in
+        self.transactions as well. Retained rows beyond `store_memory_budget`
+        bytes are spilled to memory-mapped files instead of held in memory
+        (see TransactionStore).
+        
+        With `workers` > 1 the run is split across a process pool by hour range
+        or by user shard (`shard_by`) and merged back in timestamp order; see
+        sharding.run_sharded.
+        
+        Output is fully determined by `seed`, `start_time` (naive times are
+        taken as UTC) and the run parameters: it does not depend on `batch_size`, and hour-sharded runs
+        produce the same rows as single-process ones.
+        
+        With `features`, every row is labelled with velocity and
+        impossible-travel features (see features.FeatureIndex). They are
+        computed over rows in emission order, which is timestamp order for
+        both single-process and sharded runs.
+        
+        `num_users` sets the population size (default one user per ten
+        transactions per hour, at least 50); populations of tens of millions
+        are cheap, see user_table.UserTable.
+        
+        `traffic` shapes the load over simulated time, e.g.
+        {"profile": "realistic", "bursts": [...]} for diurnal, weekday and
+        seasonal curves per city timezone plus burst events; see
+        traffic.TrafficModel.from_dict. Without it every hour has exactly
+        `transactions_per_hour` evenly spaced steps. Either way rows are
+        emitted in timestamp order.
+        
+        With `checkpoint_dir`, the run is checkpointed there every
+        `checkpoint_interval` seconds and when it stops, fails or completes, so
+        resume_simulation can continue it after a restart; see
+        checkpoint.Checkpointer. Only single-process runs are checkpointed.
+        
+        Rows are charged in their user's home currency. Amounts are drawn in
+        currency.MODEL_CURRENCY and converted through `fx_rates`, e.g.
+        {"base": "EUR", "rates": {"NGN": 1650}}, over the default table; see
+        currency.FxRates.from_dict. Every row keeps its amount in the base
+        currency too, which only sets the unit: the same seed draws the same
+        transactions whatever the base.
+        """
+        if num_users is not None and num_users < 1:
+            raise ValueError("num_users must be at least 1")
+        if checkpoint_dir and workers > 1:
+            raise ValueError("Checkpoints are only written by single-process runs (workers=1)")
         self.simulation_running = True
         self.simulation_progress = 0
-        self.transactions = []  # Reset transactions
+        self.compute_features = features
+        self.store_memory_budget = store_memory_budget
+        
+        # Unseeded runs draw a fresh seed, reported by /simulation_status, so
+        # any run can be replayed. Seeded runs also default to a fixed start
+        # time so their output is bit-identical.
+        if start_time is None:
+            start_time = SEEDED_START_TIME if seed is not None else datetime.now(timezone.utc)
+        if start_time.tzinfo is not None:
+            start_time = start_time.astimezone(timezone.utc).replace(tzinfo=None)
+        if seed is None:
+            seed = new_seed()
+        if seed != self.seed:
+            self.reseed(seed)
+        start_us = (start_time - EPOCH) // timedelta(microseconds=1)
+        if num_users is None:
+            num_users = max(50, transactions_per_hour // 10)
+        traffic_model = TrafficModel.from_dict(traffic, self.locations)
+        self._use_fx_rates(FxRates.from_dict(fx_rates))
+        
+        if workers > 1:
+            run_sharded(self, workers, duration_hours, transactions_per_hour, fraud_patterns, fraud_rate,
+                        num_users=num_users, start_us=start_us, batch_size=batch_size, shard_by=shard_by,
+                        exporter=exporter, retain=retain, progress_callback=progress_callback, traffic=traffic_model)
+            self.simulation_running = False
+            self.simulation_progress = 100
+            self.stream.finish()
+            logger.info("Simulation completed")
+            return
+        
+        logger.info(f"Starting simulation for {duration_hours} hours (seed {self.seed})")
         
         # Generate users
-        num_users = max(50, transactions_per_hour // 10)
-        self.users = {}  # Reset users
-        for _ in range(num_users):
-            self._generate_user()
-        
-        user_ids = list(self.users.keys())
+        self._reset_users(num_users)
+        self._reset_output(exporter)
         
-        if fraud_patterns is None:
+        if not fraud_patterns:
             fraud_patterns = [pattern.value for pattern in FraudPattern]
         
-        total_transactions = duration_hours * transactions_per_hour
-        
-        for hour in range(duration_hours):
-            if not self.simulation_running:
-                break
-                
-            logger.info(f"Simulating hour {hour + 1}/{duration_hours}")
-            
-            for transaction_idx in range(transactions_per_hour):
-                if not self.simulation_running:
-                    break
-                    
-                user_id = random.choice(user_ids)
+        # Everything resume_simulation needs to rebuild the run, as saved in its checkpoints
+        run = {
+            "duration_hours": duration_hours,
+            "transactions_per_hour": transactions_per_hour,
+            "fraud_patterns": fraud_patterns,
+            "fraud_rate": fraud_rate,
+            "batch_size": batch_size,
+            "retain": retain,
+            "seed": self.seed,
+            "start_us": start_us,
+            "features": features,
+            "num_users": num_users,
+            "traffic": traffic,
+            "fx_rates": fx_rates,
+            "store_memory_budget": store_memory_budget,
+            "pool_sizes": {"num_devices": self.num_devices, "num_merchants": self.num_merchants,
+                           "num_cities": len(self.locations)},
+        }
+        checkpointer = Checkpointer(checkpoint_dir, checkpoint_interval) if checkpoint_dir else None
+        self._generate(run, traffic_model, exporter, progress_callback, checkpointer)
+    
+    def resume_simulation(self, checkpoint_dir: str, exporter: Optional[StreamingExporter] = None,
+                          progress_callback=None, checkpoint_interval: float = 60.0):
+        """Continue a checkpointed run exactly where its last checkpoint left off
+        
+        Users and pools are rebuilt from the run's seed; report totals,
+        feature history, retained rows and rows still held for ordering come
+        from the checkpoint. Pass the checkpoint's exporter (see
+        checkpoint.Checkpoint.exporter) to continue its export after the
+        files written up to the checkpoint, so every row is exported once.
+        The run keeps checkpointing to `checkpoint_dir`.
+        """
+        checkpoint = load_checkpoint(checkpoint_dir)
+        if checkpoint.complete:
+            raise ValueError("The checkpointed run has already completed")
+        run = checkpoint.run
+        if checkpoint.pool_sizes != {"num_devices": self.num_devices, "num_merchants": self.num_merchants,
+                                     "num_cities": len(self.locations)}:
+            raise ValueError("Pool sizes differ from the checkpointed run's")
+        self.simulation_running = True
+        self.simulation_progress = 0
+        self.compute_features = run["features"]
+        self.store_memory_budget = run["store_memory_budget"]
+        if run["seed"] != self.seed:
+            self.reseed(run["seed"])
+        self._use_fx_rates(FxRates.from_dict(run["fx_rates"]))
+        logger.info(f"Resuming simulation from {checkpoint_dir} after {checkpoint.state['rows']} rows "
+                    f"(seed {self.seed})")
+        
+        self._reset_users(run["num_users"])
+        self._reset_output(exporter)
+        checkpoint.restore(self)
+        self._generate(run, TrafficModel.from_dict(run["traffic"], self.locations), exporter, progress_callback,
+                       Checkpointer(checkpoint_dir, checkpoint_interval, checkpoint),
+                       cursor=checkpoint.cursor, done=checkpoint.done, release=checkpoint.release())
+    
+    def _generate(self, run: Dict[str, Any], traffic_model: Optional[TrafficModel],
+                  exporter: Optional[StreamingExporter], progress_callback=None,
+                  checkpointer: Optional[Checkpointer] = None, cursor=(0, 0), done: int = 0,
+                  release: Optional[OrderedRelease] = None):
+        """Generation loop of single-process runs, from `cursor` with `done` steps already emitted"""
+        engine = BatchEngine(self)
+        release = OrderedRelease() if release is None else release
+        duration_hours = run["duration_hours"]
+        transactions_per_hour = run["transactions_per_hour"]
+        
+        if traffic_model is None:
+            total_transactions = duration_hours * transactions_per_hour
+        else:
+            total_transactions = traffic_model.expected_steps(run["start_us"], range(duration_hours),
+                                                              transactions_per_hour, engine.city_share)
+        
+        current_hour = None
+        # True between chunks, where the emitted rows, the cursor and the reorder buffer agree
+        consistent = False
+        try:
+            for hour, steps, batch in engine.iter_hours(range(duration_hours), transactions_per_hour, run["start_us"],
+                                                        batch_size=run["batch_size"], fraud_rate=run["fraud_rate"],
+                                                        fraud_patterns=run["fraud_patterns"], traffic=traffic_model,
+                                                        release=release, resume_at=cursor):
+                if hour != current_hour:
+                    current_hour = hour
+                    logger.info(f"Simulating hour {hour + 1}/{duration_hours}")
                 
-                if random.random() < fraud_rate:
-                    # Generate fraudulent transaction
-                    if FraudPattern.MIXED_PATTERNS.value in fraud_patterns:
-                        pattern = random.choice([p for p in FraudPattern if p != FraudPattern.MIXED_PATTERNS])
-                    else:
-                        pattern = random.choice([FraudPattern(p) for p in fraud_patterns])
-                    
-                    if pattern == FraudPattern.RAPID_FIRE:
-                        fraud_transactions = self.generate_rapid_fire_attack(user_id, count=random.randint(5, 15))
-                    elif pattern == FraudPattern.GEOGRAPHIC_HOPPING:
-                        fraud_transactions = self.generate_geographic_hopping(user_id, count=random.randint(3, 7))
-                    elif pattern == FraudPattern.DEVICE_SPOOFING:
-                        fraud_transactions = self.generate_device_spoofing(user_id, count=random.randint(4, 10))
-                    elif pattern == FraudPattern.AMOUNT_ESCALATION:
-                        fraud_transactions = self.generate_amount_escalation(user_id, count=random.randint(4, 8))
-                    elif pattern == FraudPattern.MERCHANT_CYCLING:
-                        fraud_transactions = self.generate_merchant_cycling(user_id, count=random.randint(6, 12))
-                    else:
-                        fraud_transactions = self.generate_rapid_fire_attack(user_id, count=random.randint(5, 15))
-                    
-                    self.transactions.extend(fraud_transactions)
-                else:
-                    # Generate normal transaction
-                    transaction = self.generate_normal_transaction(user_id)
-                    self.transactions.append(transaction)
+                self._emit(batch, exporter, run["retain"])
+                done += steps
+                consistent = True
                 
                 # Update progress
-                current_progress = ((hour * transactions_per_hour) + transaction_idx + 1) / total_transactions * 100
-                self.simulation_progress = min(current_progress, 100)
+                self.simulation_progress = min(done / max(total_transactions, 1) * 100, 100)
                 
                 if progress_callback:
                     progress_callback(self.simulation_progress)
                 
-                # Small delay to allow for interruption
-                time.sleep(0.002)
+                if checkpointer and checkpointer.due():
+                    checkpointer.save(self, run, engine.cursor, done, release, exporter)
+                
+                if not self.simulation_running:
+                    break
+                consistent = False
+            
+            # A stopped run is checkpointed where it stopped, so it can be resumed from there
+            complete = engine.cursor[0] >= duration_hours
+            if checkpointer:
+                checkpointer.save(self, run, engine.cursor, done, release, exporter, complete=complete)
+            
+            if exporter:
+                exporter.close(complete=complete)
+        except BaseException:
+            self._abandon(run, engine.cursor, done, release, exporter, checkpointer if consistent else None)
+            raise
+        finally:
+            self.simulation_running = False
+            self.stream.finish()
         
-        self.simulation_running = False
         self.simulation_progress = 100
         logger.info("Simulation completed")
     
-    def generate_report(self) -> Dict[str, Any]:
-        """Generate comprehensive simulation report"""
-        if not self.transactions:
-            return {"error": "No transactions to report"}
-        
-        total_transactions = len(self.transactions)
-        fraudulent_transactions = [t for t in self.transactions if t.fraud_pattern]
-        normal_transactions = [t for t in self.transactions if not t.fraud_pattern]
-        
-        # Pattern analysis
-        pattern_counts = {}
-        pattern_amounts = {}
-        for transaction in fraudulent_transactions:
-            pattern = transaction.fraud_pattern
-            pattern_counts[pattern] = pattern_counts.get(pattern, 0) + 1
-            pattern_amounts[pattern] = pattern_amounts.get(pattern, 0) + transaction.amount
-        
-        # Location analysis
-        location_stats = {}
-        for transaction in self.transactions:
-            location = transaction.location["city"]
-            if location not in location_stats:
-                location_stats[location] = {"total": 0, "fraud": 0, "amount": 0}
-            location_stats[location]["total"] += 1
-            location_stats[location]["amount"] += transaction.amount
-            if transaction.fraud_pattern:
-                location_stats[location]["fraud"] += 1
-        
-        # Payment method analysis
-        payment_method_stats = {}
-        for transaction in self.transactions:
-            method = transaction.payment_method
-            if method not in payment_method_stats:
-                payment_method_stats[method] = {"total": 0, "fraud": 0, "amount": 0}
-            payment_method_stats[method]["total"] += 1
-            payment_method_stats[method]["amount"] += transaction.amount
-            if transaction.fraud_pattern:
-                payment_method_stats[method]["fraud"] += 1
-        
-        # Risk score analysis
-        risk_scores = [t.risk_score for t in self.transactions if t.risk_score]
-        avg_risk_score = sum(risk_scores) / len(risk_scores) if risk_scores else 0
-        
-        total_amount = sum(t.amount for t in self.transactions)
-        fraud_amount = sum(t.amount for t in fraudulent_transactions)
-        
-        return {
-            "summary": {
-                "total_transactions": total_transactions,
-                "fraudulent_transactions": len(fraudulent_transactions),
-                "normal_transactions": len(normal_transactions),
-                "fraud_rate": len(fraudulent_transactions) / total_transactions if total_transactions > 0 else 0,
-                "total_amount": round(total_amount, 2),
-                "fraud_amount": round(fraud_amount, 2),
-                "fraud_amount_percentage": (fraud_amount / total_amount) * 100 if total_amount > 0 else 0,
-                "average_risk_score": round(avg_risk_score, 3),
-                "unique_users": len(self.users),
-                "unique_merchants": len(set(t.merchant_id for t in self.transactions)),
-                "unique_devices": len(set(t.device_fingerprint for t in self.transactions)),
-                "unique_locations": len(set(t.location["city"] for t in self.transactions))
-            },
-            "pattern_analysis": {
-                "counts": pattern_counts,
-                "amounts": {k: round(v, 2) for k, v in pattern_amounts.items()}
-            },
-            "location_analysis": {
-                k: {
-                    "total_transactions": v["total"],
-                    "fraud_transactions": v["fraud"],
-                    "fraud_rate": v["fraud"] / v["total"] if v["total"] > 0 else 0,
-                    "total_amount": round(v["amount"], 2)
-                }
-                for k, v in location_stats.items()
-            },
-            "payment_method_analysis": {
-                k: {
-                    "total_transactions": v["total"],
-                    "fraud_transactions": v["fraud"],
-                    "fraud_rate": v["fraud"] / v["total"] if v["total"] > 0 else 0,
-                    "total_amount": round(v["amount"], 2)
-                }
-                for k, v in payment_method_stats.items()
-            },
-            "transactions": [asdict(t) for t in self.transactions[-100:]]  # Last 100 transactions
-        }
+    def _abandon(self, run: Dict[str, Any], cursor, done: int, release: OrderedRelease,
+                 exporter: Optional[StreamingExporter], checkpointer: Optional[Checkpointer]):
+        """Clean up after a failed run: checkpoint it if it failed between chunks, and drop the unfinished export file"""
+        if checkpointer:
+            try:
+                checkpointer.save(self, run, cursor, done, release, exporter)
+            except Exception:
+                logger.exception("Could not checkpoint the failed run")
+        if exporter:
+            try:
+                exporter.abort()
+            except Exception:
+                logger.exception("Could not drop the unfinished export file")
+    
+    def _use_fx_rates(self, fx_rates: FxRates):
+        self.fx_rates = fx_rates
+        self._row_engine = None
+    
+    def _reset_output(self, exporter: Optional[StreamingExporter] = None):
+        """Start an empty store and report for a run over the current users and pools"""
+        self.feature_index = FeatureIndex(self.locations) if self.compute_features else None
+        self.transactions = TransactionStore(UserIds(self.user_table), self.merchant_ids, self.locations,
+                                             feature_dtypes=FEATURE_DTYPES if self.compute_features else None,
+                                             memory_budget=self.store_memory_budget, spill_dir=SPILL_DIR,
+                                             indexed=True,
+                                             amount_bin_edges=amount_bin_edges(self.fx_rates.model_rate))
+        self.report = ReportAggregator(self.locations, self.num_merchants, self.fx_rates.base)
+        if exporter:
+            exporter.start(self.transactions)
+    
+    def _emit(self, batch: TransactionBatch, exporter: Optional[StreamingExporter] = None, retain: bool = True):
+        """Label a generated batch and hand it to the exporter, the store and the report"""
+        rows = len(batch)
+        if self.feature_index:
+            with METRICS.timed("feature_update") as timer:
+                batch.features = self.feature_index.update(batch)
+                timer.rows = rows
+        if exporter:
+            with METRICS.timed("export_write") as timer:
+                exporter.write(batch)
+                timer.rows = rows
+        if retain:
+            with METRICS.timed("store_append") as timer:
+                self.transactions.append_batch(batch)
+                timer.rows = rows
+        with METRICS.timed("report_update") as timer:
+            self.report.update(batch)
+            timer.rows = rows
+        if self.stream:
+            # Blocks while a live consumer is behind, throttling generation
+            with METRICS.timed("stream_publish") as timer:
+                self.stream.publish(self.transactions, batch, lambda: self.simulation_running)
+                timer.rows = rows
+    
+    def generate_report(self, limit: int = 100) -> Dict[str, Any]:
+        """Generate comprehensive simulation report
+        
+        Served from the running ReportAggregator, so it is cheap to call
+        repeatedly, including while a simulation is running. The last
+        `limit` transactions are included as dicts; the web routes encode
+        them straight from the store instead, see report_page.
+        """
+        report, batch = self.report_page(limit=limit)
+        if batch is not None:
+            columns = self.transactions.decode_columns(batch)
+            names = list(columns)
+            report["transactions"] = [dict(zip(names, row)) for row in zip(*columns.values())]
+        return report
+    
+    def report_page(self, start: Optional[int] = None, limit: int = 100):
+        """The report sections plus retained rows [start, start + limit) as a columnar batch
+        
+        Without `start` the page is the last `limit` rows. The batch is None
+        when there is nothing to report.
+        """
+        if not self.report:
+            return {"error": "No transactions to report"}, None
+        
+        with METRICS.timed("report_build"):
+            report = self.report.to_dict(unique_users=len(self.users))
+            total = len(self.transactions)
+            if start is None:
+                start = max(total - limit, 0)
+            stop = max(min(start + limit, total), start)
+            batch = self.transactions.slice(start, stop)
+            report["page"] = {"start": start, "stop": start + len(batch), "limit": limit, "total": total}
+        return report, batch
     
     def stop_simulation(self):
         """Stop the running simulation"""
         self.simulation_running = False
 
-# Global simulator instance
-simulator = SyntheticFraudSimulator()
+# Simulation jobs; each run gets its own simulator
+jobs = JobManager(
+    SyntheticFraudSimulator,
+    max_workers=int(os.environ.get('MAX_CONCURRENT_JOBS', 2)),
+    max_queued=int(os.environ.get('MAX_QUEUED_JOBS', 8)),
+    memory_budget=int(os.environ.get('JOB_MEMORY_BUDGET_MB', 1024)) << 20,
+    profile_dir=os.path.join(EXPORT_DIR, 'profiles'),
+    # "process" runs every job in a process of its own, see asgi.py
+    isolation=os.environ.get('JOB_ISOLATION', 'thread'),
+    snapshot_interval=float(os.environ.get('SNAPSHOT_INTERVAL_SECONDS', 0.5))
+)
+
+# Current or last load-test replay, see /replay
+replayer: Optional[Replayer] = None
+
+def _job_gauges(value):
+    """Per-job gauge samples for the unfinished jobs"""
+    return lambda: [({"job_id": job.job_id}, value(job)) for job in jobs.list() if not job.finished]
+
+METRICS.gauge("jobs", "Jobs by status",
+              lambda: [({"status": status}, sum(job.status == status for job in jobs.list()))
+                       for status in JOB_STATES])
+METRICS.gauge("job_progress_percent", "Progress of each unfinished job",
+              _job_gauges(lambda job: job.stats["progress"]))
+METRICS.gauge("job_rows_per_second", "Rows generated per second by each unfinished job",
+              _job_gauges(lambda job: job.rows_per_second))
+METRICS.gauge("job_rows", "Rows generated so far by each unfinished job",
+              _job_gauges(lambda job: job.stats["total_transactions"]))
+METRICS.gauge("store_bytes", "Memory held by the transaction stores of all jobs",
+              lambda: [({}, sum(job.nbytes for job in jobs.list()))])
+METRICS.gauge("store_spilled_bytes", "Rows the transaction stores of all jobs have spilled to disk",
+              lambda: [({}, sum(job.stats["spilled_bytes"] for job in jobs.list()))])
+METRICS.gauge("stream_subscribers", "Live stream consumers",
+              lambda: [({}, len(jobs.pending_stream) + sum(len(job.simulator.stream) for job in jobs.list()
+                                                           if job.simulator is not None))])
+METRICS.gauge("stream_queue_depth", "Micro-batches waiting for live stream consumers",
+              lambda: [({}, jobs.pending_stream.queue_depth() +
+                        sum(job.simulator.stream.queue_depth() for job in jobs.list() if job.simulator is not None))])
+METRICS.gauge("replay_requests", "Requests sent by the current replay",
+              lambda: [({}, replayer.requests_sent if replayer else 0)])
+METRICS.gauge("replay_errors", "Failed requests of the current replay",
+              lambda: [({}, sum(replayer.errors.values()) if replayer else 0)])
+
+def _find_job(job_id: Optional[str] = None) -> Optional[Job]:
+    """The job with `job_id`, or the most recent job when no id is given"""
+    return jobs.get(job_id) if job_id else jobs.latest()
+
+def _no_job(job_id: Optional[str] = None):
+    if job_id:
+        return jsonify({"error": f"Unknown job: {job_id}"}), 404
+    return jsonify({"error": "No transactions to report"})
+
+def _in_process(job: Job):
+    """Error for requests needing the rows of a job run in its own process, which never leave it"""
+    return jsonify({"error": f"Job {job.job_id} runs in a separate process; "
+                             "only its status, report and last rows are available, or its export"}), 409
+
+def snapshot_report(job: Job, media_type: str) -> Optional[Tuple[str, bytes]]:
+    """(ETag, body) of the job's default report page from its latest snapshot, if it has one"""
+    snapshot = job.snapshot
+    if snapshot is None or media_type not in snapshot.reports:
+        return None
+    key = f"{job.job_id}:snapshot:{snapshot.taken_at}:{media_type}"
+    return hashlib.sha1(key.encode()).hexdigest()[:20], snapshot.reports[media_type]
+
+def _report_etag(job: Job, start: Optional[int], limit: int, media_type: str) -> str:
+    """Changes whenever the response would: rows added or evicted, the job's state, or the page asked for"""
+    simulator = job.simulator
+    key = f"{job.job_id}:{job.status}:{len(simulator.report)}:{len(simulator.transactions)}:{start}:{limit}:{media_type}"
+    return hashlib.sha1(key.encode()).hexdigest()[:20]
+
+def _report_response(job: Job):
+    """The job's report, paged with ?start= and ?limit=, as JSON or (by Accept header) MessagePack
+    
+    Responses carry an ETag; polling with If-None-Match gets a 304 until
+    the report changes, without the report being rebuilt. The default page
+    (the last rows) comes from the job's latest snapshot once it has one.
+    """
+    try:
+        limit = int(request.args.get('limit', 100))
+        start = request.args.get('start')
+        start = None if start is None else int(start)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if not 0 < limit <= MAX_REPORT_TRANSACTIONS or (start is not None and start < 0):
+        return jsonify({"error": f"limit must be 1-{MAX_REPORT_TRANSACTIONS} and start non-negative"}), 400
+    media_type = request.accept_mimetypes.best_match(response_formats(), default=JSON)
+    if media_type != JSON:
+        media_type = MSGPACK
+    
+    default_page = start is None and limit == SNAPSHOT_REPORT_ROWS
+    snapshot = snapshot_report(job, media_type) if default_page else None
+    if snapshot is not None:
+        etag, body = snapshot
+        if request.if_none_match.contains(etag):
+            response = Response(status=304)
+        else:
+            response = Response(body, mimetype=media_type)
+    elif job.simulator is None:
+        # A job process that has not sent a snapshot yet has nothing to report
+        return _no_job() if default_page else _in_process(job)
+    else:
+        etag = _report_etag(job, start, limit, media_type)
+        if request.if_none_match.contains(etag):
+            response = Response(status=304)
+        else:
+            report, batch = job.simulator.report_page(start, limit)
+            with METRICS.timed("report_serialization") as timer:
+                body = encode_report(report, job.simulator.transactions.encoder, batch, media_type)
+                timer.rows = len(batch) if batch is not None else 0
+            response = Response(body, mimetype=media_type)
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
 
 @app.route('/')
 def index():
@@ -531,66 +672,344 @@ def index():
 
 @app.route('/run_simulation', methods=['POST'])
 def run_simulation():
-    """Start simulation with parameters"""
+    """Queue a simulation job; the response carries its job_id"""
     try:
         data = request.json
-        duration_hours = int(data.get('duration_hours', 1))
-        transactions_per_hour = int(data.get('transactions_per_hour', 100))
-        fraud_patterns = data.get('fraud_patterns', [])
-        fraud_rate = float(data.get('fraud_rate', 0.15))
-        
-        if simulator.simulation_running:
-            return jsonify({"error": "Simulation already running"}), 400
-        
-        # Run simulation in background thread
-        def run_sim():
-            simulator.run_simulation(
-                duration_hours=duration_hours,
-                transactions_per_hour=transactions_per_hour,
-                fraud_patterns=fraud_patterns,
-                fraud_rate=fraud_rate
-            )
+        export = data.get('export')
+        seed = data.get('seed')
+        start_time = data.get('start_time')
+        params = {
+            "duration_hours": int(data.get('duration_hours', 1)),
+            "transactions_per_hour": int(data.get('transactions_per_hour', 100)),
+            "fraud_patterns": data.get('fraud_patterns', []),
+            "fraud_rate": float(data.get('fraud_rate', 0.15)),
+            "batch_size": int(data.get('batch_size', 10000)),
+            "retain": not export or bool(export.get('retain', False)),
+            "workers": int(data.get('workers', 1)),
+            "shard_by": data.get('shard_by', 'hours'),
+            "seed": None if seed is None else int(seed),
+            "start_time": datetime.fromisoformat(start_time) if start_time else None,
+            "features": bool(data.get('features', False)),
+            "num_users": data.get('num_users') and int(data['num_users']),
+            "traffic": data.get('traffic'),
+            "fx_rates": data.get('fx_rates')
+        }
+        if data.get('memory_budget_mb') is not None:
+            params["store_memory_budget"] = int(float(data['memory_budget_mb']) * (1 << 20))
+        
+        # e.g. {"devices": 1000000, "merchants": 50000, "cities": 10}
+        pool_sizes = data.get('pool_sizes') or {}
+        pool_sizes = {
+            "num_devices": int(pool_sizes.get('devices', 10000)),
+            "num_merchants": int(pool_sizes.get('merchants', 1000)),
+            "num_cities": pool_sizes.get('cities') and int(pool_sizes['cities'])
+        }
         
-        thread = threading.Thread(target=run_sim)
-        thread.daemon = True
-        thread.start()
+        # Optional streaming export, e.g. {"format": "parquet", "compression": "zstd"}
+        exporter = None
+        if export:
+            exporter = StreamingExporter(
+                os.path.join(EXPORT_DIR, datetime.now(timezone.utc).strftime('run-%Y%m%dT%H%M%S-%f')),
+                format=export.get('format', 'ndjson'),
+                compression=export.get('compression'),
+                rows_per_file=int(export.get('rows_per_file', 1_000_000)),
+                chunk_rows=int(export.get('chunk_rows', 50_000))
+            )
         
-        return jsonify({"message": "Simulation started", "status": "running"})
+        # Optional periodic checkpoints, e.g. {"interval_seconds": 60}, resumable with /resume_simulation
+        checkpoint = data.get('checkpoint')
+        checkpoint_id = None
+        if checkpoint:
+            checkpoint_id = uuid.uuid4().hex[:12]
+            params["checkpoint_dir"] = os.path.join(CHECKPOINT_DIR, checkpoint_id)
+            if isinstance(checkpoint, dict):
+                params["checkpoint_interval"] = float(checkpoint.get('interval_seconds', 60))
+        
+        job = jobs.submit(params, exporter=exporter, pool_sizes=pool_sizes, profile=bool(data.get('profile', False)))
+        
+        response = {"message": "Simulation queued", "status": job.status, "job_id": job.job_id}
+        if exporter:
+            response["export_manifest"] = exporter.manifest_path
+        if checkpoint_id:
+            response["checkpoint_id"] = checkpoint_id
+        return jsonify(response)
+    
+    except QueueFull as e:
+        return jsonify({"error": str(e)}), 429
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/resume_simulation', methods=['POST'])
+def resume_simulation():
+    """Queue a job continuing a checkpointed run from its last checkpoint
+
+    Takes the {"checkpoint_id": ...} returned by /run_simulation, e.g. after
+    the server restarted or the run was stopped. The resumed run appends to
+    the original export, if any, and keeps checkpointing under the same id.
+    """
+    try:
+        data = request.json
+        checkpoint_id = str(data.get('checkpoint_id', ''))
+        if not CHECKPOINT_ID.fullmatch(checkpoint_id):
+            return jsonify({"error": f"Invalid checkpoint id: {checkpoint_id}"}), 400
+        checkpoint_dir = os.path.join(CHECKPOINT_DIR, checkpoint_id)
+        if any(job.params.get('checkpoint_dir') == checkpoint_dir for job in jobs.list() if not job.finished):
+            return jsonify({"error": "A job is still running from this checkpoint"}), 409
+        
+        checkpoint = load_checkpoint(checkpoint_dir)
+        if checkpoint.complete:
+            return jsonify({"error": "The checkpointed run has already completed"}), 400
+        params = {
+            "checkpoint_dir": checkpoint_dir,
+            "checkpoint_interval": float(data.get('interval_seconds', checkpoint.state['interval_seconds']))
+        }
+        exporter = checkpoint.exporter()
+        job = jobs.submit(params, exporter=exporter, pool_sizes=checkpoint.pool_sizes, resume=True)
+        
+        response = {"message": "Simulation resumed", "status": job.status, "job_id": job.job_id,
+                    "checkpoint_id": checkpoint_id, "resumed_rows": checkpoint.state['rows']}
+        if exporter:
+            response["export_manifest"] = exporter.manifest_path
+        return jsonify(response)
     
+    except FileNotFoundError:
+        return jsonify({"error": f"No checkpoint: {checkpoint_id}"}), 404
+    except QueueFull as e:
+        return jsonify({"error": str(e)}), 429
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+@app.route('/jobs')
+def list_jobs():
+    """Status of every job the manager remembers, oldest first"""
+    return jsonify({"jobs": [job.to_dict() for job in jobs.list()]})
+
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    """Status of one job"""
+    job = _find_job(job_id)
+    if job is None:
+        return _no_job(job_id)
+    return jsonify(job.to_dict())
+
+@app.route('/jobs/<job_id>/report')
+def job_report(job_id):
+    """Report of one job"""
+    job = _find_job(job_id)
+    if job is None:
+        return _no_job(job_id)
+    try:
+        return _report_response(job)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/jobs/<job_id>/profile')
+def job_profile(job_id):
+    """Folded-stack profile of a job run with "profile": true, for flamegraph tools"""
+    job = _find_job(job_id)
+    if job is None:
+        return _no_job(job_id)
+    if not job.profile_path:
+        return jsonify({"error": "No profile for this job"}), 404
+    return send_file(os.path.abspath(job.profile_path), mimetype='text/plain')
+
+@app.route('/jobs/<job_id>/cancel', methods=['POST'])
+def cancel_job(job_id):
+    """Cancel a queued or running job"""
+    job = jobs.cancel(job_id)
+    if job is None:
+        return _no_job(job_id)
+    return jsonify({"message": "Job cancelled", "job_id": job.job_id, "status": job.status})
+
 @app.route('/simulation_status')
 def simulation_status():
-    """Get current simulation status"""
-    return jsonify({
-        "running": simulator.simulation_running,
-        "progress": simulator.simulation_progress,
-        "total_transactions": len(simulator.transactions)
-    })
+    """Get the status of the most recent simulation job"""
+    job = _find_job()
+    if job is None:
+        return jsonify({"running": False, "progress": 0, "seed": None, "total_transactions": 0})
+    return jsonify(job.to_dict())
 
 @app.route('/stop_simulation', methods=['POST'])
 def stop_simulation():
-    """Stop the running simulation"""
-    simulator.stop_simulation()
+    """Stop the most recent simulation job"""
+    job = _find_job()
+    if job:
+        jobs.cancel(job.job_id)
     return jsonify({"message": "Simulation stopped"})
 
 @app.route('/get_report')
 def get_report():
-    """Get simulation report"""
+    """Get the report of the most recent simulation job (see _report_response for paging)"""
+    job = _find_job()
+    if job is None:
+        return _no_job()
     try:
-        report = simulator.generate_report()
-        return jsonify(report)
+        return _report_response(job)
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+@app.route('/transactions')
+def query_transactions():
+    """Stored transactions of a job matching server-side filters, with cursor pagination
+
+    Filter with repeated or comma-separated ?fraud_pattern= ("normal" for
+    non-fraudulent rows), ?payment_method=, ?city=, ?currency= and
+    ?merchant_category=, plus ?min_amount=/?max_amount= (in the run's base
+    currency) and ISO ?start_time=/?end_time= (end exclusive). Rows come in
+    store order, ?limit= at a time; pass the returned next_cursor as
+    ?cursor= for the next page. next_cursor is null once a finished job has no more matches.
+    Queries the most recent job unless ?job_id= is given; JSON or, by
+    Accept header, MessagePack.
+    """
+    job_id = request.args.get('job_id')
+    job = _find_job(job_id)
+    if job is None:
+        return _no_job(job_id)
+    if job.simulator is None:
+        return _in_process(job)
+    try:
+        def values(name):
+            return [v for arg in request.args.getlist(name) for v in arg.split(',') if v]
+        params = {name: values(name) for name in QUERY_FIELDS}
+        params.update({name: request.args.get(name) for name in ('min_amount', 'max_amount', 'start_time', 'end_time')})
+        query = TransactionQuery.from_params(params, job.simulator.locations)
+        cursor = int(request.args.get('cursor', 0))
+        limit = int(request.args.get('limit', 100))
+        if not 0 < limit <= MAX_REPORT_TRANSACTIONS or cursor < 0:
+            raise ValueError(f"limit must be 1-{MAX_REPORT_TRANSACTIONS} and cursor non-negative")
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    media_type = request.accept_mimetypes.best_match(response_formats(), default=JSON)
+    if media_type != JSON:
+        media_type = MSGPACK
+
+    try:
+        store = job.simulator.transactions
+        with METRICS.timed("transaction_query") as timer:
+            batch, next_cursor, more = store.query(query, cursor, limit)
+            timer.rows = len(batch)
+        result = {
+            "job_id": job.job_id,
+            "count": len(batch),
+            "cursor": cursor,
+            "next_cursor": None if job.finished and not more else next_cursor,
+        }
+        with METRICS.timed("report_serialization") as timer:
+            body = encode_report(result, store.encoder, batch, media_type)
+            timer.rows = len(batch)
+        return Response(body, mimetype=media_type)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/stream_transactions')
+def stream_transactions():
+    """Push transactions live as a simulation job generates them
+
+    NDJSON over chunked HTTP by default, or Server-Sent Events with
+    ?format=sse. Filter with repeated or comma-separated ?fraud_pattern=
+    (use "normal" for non-fraudulent rows) and ?payment_method=. A consumer
+    that falls behind throttles the simulation rather than being buffered.
+    Follows ?job_id=, else the most recent job if it has not finished, else
+    the next job to be submitted.
+    """
+    job_id = request.args.get('job_id')
+    job = _find_job(job_id)
+    if job_id and job is None:
+        return _no_job(job_id)
+    if jobs.isolation == 'process':
+        return jsonify({"error": "Live streams are not available when jobs run in separate processes"}), 409
+    stream = job.simulator.stream if job and not job.finished else jobs.pending_stream
+    try:
+        format = request.args.get('format', 'ndjson')
+        if format not in STREAM_FORMATS:
+            raise ValueError(f"Unsupported stream format: {format}")
+        def values(name):
+            return [v for arg in request.args.getlist(name) for v in arg.split(',') if v]
+        subscription = stream.subscribe(
+            fraud_patterns=values('fraud_pattern'),
+            payment_methods=values('payment_method'),
+            batch_rows=int(request.args.get('batch_rows', 500)),
+            max_pending=int(request.args.get('max_pending', 8))
+        )
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    
+    def generate():
+        try:
+            yield from encode_stream(subscription, format)
+        finally:
+            stream.unsubscribe(subscription)
+    
+    mimetype = 'application/x-ndjson' if format == 'ndjson' else 'text/event-stream'
+    return Response(generate(), mimetype=mimetype, headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/replay', methods=['POST'])
+def replay():
+    """Replay a job's stored transactions to an HTTP target at a controlled rate
+
+    {"target_url": ..., "mode": "tps", "tps": 500} sends at an exact rate;
+    {"mode": "timeline", "speedup": 3600} follows the simulated timestamps,
+    compressed by `speedup`. Replays the most recent job unless `job_id` is
+    given. Progress, latency percentiles and error rates are reported by
+    /replay_status.
+    """
+    global replayer
+    try:
+        data = request.json
+        if replayer and replayer.running:
+            return jsonify({"error": "Replay already running"}), 400
+        job = _find_job(data.get('job_id'))
+        store = job.simulator.transactions if job and job.simulator is not None else None
+        if not store:
+            return jsonify({"error": "No transactions to replay"}), 400
+        
+        limit = data.get('limit')
+        replayer = Replayer(
+            data['target_url'],
+            mode=data.get('mode', 'tps'),
+            tps=float(data.get('tps', 100)),
+            speedup=float(data.get('speedup', 60)),
+            concurrency=int(data.get('concurrency', 32)),
+            rows_per_request=int(data.get('rows_per_request', 1)),
+            timeout=float(data.get('timeout', 10)),
+            limit=None if limit is None else int(limit)
+        )
+        chunk_rows = 10000
+        total = len(store)
+        replayer.start(store, (store.slice(i, i + chunk_rows) for i in range(0, total, chunk_rows)))
+        return jsonify({"message": "Replay started", "status": "running", "rows": total, "job_id": job.job_id})
+    
+    except (KeyError, ValueError) as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/replay_status')
+def replay_status():
+    """Progress, latency histogram percentiles and errors of the current replay"""
+    if replayer is None:
+        return jsonify({"running": False})
+    return jsonify(replayer.status())
+
+@app.route('/stop_replay', methods=['POST'])
+def stop_replay():
+    """Stop the running replay"""
+    if replayer:
+        replayer.stop()
+    return jsonify({"message": "Replay stopped"})
+
+@app.route('/metrics')
+def metrics():
+    """Stage timings, throughput, memory and queue depths in Prometheus text format"""
+    return Response(METRICS.render(), mimetype='text/plain; version=0.0.4')
+
 @app.route('/clear_data', methods=['POST'])
 def clear_data():
-    """Clear all simulation data"""
-    simulator.transactions = []
-    simulator.users = {}
-    simulator.simulation_progress = 0
-    return jsonify({"message": "Data cleared"})
+    """Clear the data of every finished job; queued and running jobs are kept"""
+    cleared = jobs.clear()
+    return jsonify({"message": "Data cleared", "jobs_cleared": cleared})
 
 if __name__ == '__main__':
     app.run(debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
@@ -0,0 +1,92 @@
+"""ASGI entry point, for serving many polling dashboards without slowing simulations down:
+
+    uvicorn asgi:app --host 0.0.0.0 --port 5000
+
+Job status and default report pages (/simulation_status, /jobs/<id>,
+/get_report and /jobs/<id>/report) are answered on the event loop from the
+jobs' latest snapshots, with no encoding per request. Every other request
+goes to the Flask app on a pool of WSGI_THREADS threads, as under a
+threaded WSGI server. Jobs run in processes of their own unless
+JOB_ISOLATION says otherwise. Serve with one worker process: that is where
+the jobs are tracked.
+"""
+import os
+import re
+from typing import Dict, List, Any, Optional, Tuple
+from urllib.parse import parse_qs
+
+from a2wsgi import WSGIMiddleware
+from werkzeug.datastructures import MIMEAccept
+from werkzeug.http import parse_accept_header, parse_etags
+
+os.environ.setdefault('JOB_ISOLATION', 'process')
+
+import app as flask_app
+from serialization import JSON, MSGPACK, dumps, response_formats
+from snapshots import SNAPSHOT_REPORT_ROWS
+
+JOB_PATH = re.compile(r'/jobs/([^/]+)(/report)?')
+
+Response = Tuple[int, List[Tuple[bytes, bytes]], bytes]
+
+def _header(scope: Dict[str, Any], name: bytes) -> str:
+    return next((value.decode('latin-1') for key, value in scope['headers'] if key == name), '')
+
+def _status_response(job) -> Response:
+    return 200, [(b'content-type', JSON.encode())], dumps(job.to_dict()).encode()
+
+def _report_response(scope: Dict[str, Any], job) -> Optional[Response]:
+    """The default report page from the job's snapshot, or None to leave the request to Flask"""
+    query = parse_qs(scope['query_string'].decode('latin-1'))
+    if 'start' in query or query.get('limit', [str(SNAPSHOT_REPORT_ROWS)]) != [str(SNAPSHOT_REPORT_ROWS)]:
+        return None
+    accept = parse_accept_header(_header(scope, b'accept'), MIMEAccept)
+    media_type = accept.best_match(response_formats(), default=JSON)
+    if media_type != JSON:
+        media_type = MSGPACK
+    snapshot = flask_app.snapshot_report(job, media_type)
+    if snapshot is None:
+        return None
+    etag, body = snapshot
+    headers = [(b'etag', f'"{etag}"'.encode()), (b'cache-control', b'no-cache')]
+    if parse_etags(_header(scope, b'if-none-match')).contains(etag):
+        return 304, headers, b''
+    return 200, headers + [(b'content-type', media_type.encode())], body
+
+def _from_snapshot(scope: Dict[str, Any]) -> Optional[Response]:
+    """Answer status and default report requests from snapshots; None for anything else"""
+    path = scope['path']
+    if path == '/simulation_status':
+        job = flask_app.jobs.latest()
+        return _status_response(job) if job else None
+    if path == '/get_report':
+        job = flask_app.jobs.latest()
+        return _report_response(scope, job) if job else None
+    match = JOB_PATH.fullmatch(path)
+    if match:
+        job = flask_app.jobs.get(match.group(1))
+        if job is None:
+            return None
+        return _report_response(scope, job) if match.group(2) else _status_response(job)
+    return None
+
+_wsgi = WSGIMiddleware(flask_app.app, workers=int(os.environ.get('WSGI_THREADS', 16)))
+
+async def app(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+    if scope['type'] == 'http' and scope['method'] in ('GET', 'HEAD'):
+        response = _from_snapshot(scope)
+        if response is not None:
+            status, headers, body = response
+            headers.append((b'content-length', str(len(body)).encode()))
+            await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+            await send({'type': 'http.response.body', 'body': b'' if scope['method'] == 'HEAD' else body})
+            return
+    await _wsgi(scope, receive, send)
@@ -0,0 +1,564 @@
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+from dataclasses import dataclass
+import numpy as np
+
+from models import (
+    FraudPattern, BROWSERS, OS_LIST, TRANSACTION_CATEGORIES, FRAUD_PATTERN_CODES,
+    payment_methods_for_location, currency_for_location,
+)
+from currency import CURRENCY_INDEX
+from metrics import METRICS
+from ip_blocks import IpBlocks, IP_LOW, IP_HIGH
+from patterns import PATTERNS
+from seeding import numpy_stream, GENERATION, SCHEDULE, BLOCK_USERS, BLOCK_PATTERNS, BLOCK_IDS, BLOCK_FIELDS
+
+EPOCH = datetime(1970, 1, 1)
+HOUR_US = 3_600_000_000
+
+# Steps per generation block; each block draws from its own seeded streams
+BLOCK_STEPS = 4096
+
+CATEGORY_INDEX = {category: i for i, category in enumerate(TRANSACTION_CATEGORIES)}
+FRAUD_PATTERN_INDEX = {pattern: i for i, pattern in enumerate(FRAUD_PATTERN_CODES)}
+
+def now_us() -> int:
+    """Current UTC time as integer microseconds since the epoch"""
+    return (datetime.now(timezone.utc).replace(tzinfo=None) - EPOCH) // timedelta(microseconds=1)
+
+def parse_device(fingerprint: str) -> int:
+    """Pack a `browser_os_hex8` fingerprint into a single integer code"""
+    browser, os_name, tag = fingerprint.split("_")
+    return (BROWSERS.index(browser) << 35) | (OS_LIST.index(os_name) << 32) | int(tag, 16)
+
+def format_device(code: int) -> str:
+    """Inverse of parse_device"""
+    return f"{BROWSERS[(code >> 35) & 0x7]}_{OS_LIST[(code >> 32) & 0x7]}_{code & 0xFFFFFFFF:08x}"
+
+def format_ip(ip: int) -> str:
+    return f"{ip >> 24}.{(ip >> 16) & 0xFF}.{(ip >> 8) & 0xFF}.{ip & 0xFF}"
+
+def format_timestamp(ts_us: int) -> str:
+    return (EPOCH + timedelta(microseconds=ts_us)).isoformat()
+
+def format_uuid(hi: int, lo: int) -> str:
+    return str(uuid.UUID(int=(hi << 64) | lo))
+
+# Bulk versions of the formatters above, producing identical strings for whole columns
+
+_HEX_DIGITS = np.frombuffer(b"".join(f"{i:02x}".encode() for i in range(256)), dtype=np.uint8).reshape(256, 2)
+_UUID_HEX_POSITIONS = np.array([i for i in range(36) if i not in (8, 13, 18, 23)])
+_OCTET_PAIRS: List[str] = []
+
+def format_uuids(hi: np.ndarray, lo: np.ndarray) -> List[str]:
+    halves = np.empty((len(hi), 2), dtype=">u8")
+    halves[:, 0] = hi
+    halves[:, 1] = lo
+    text = np.full((len(hi), 36), ord("-"), dtype=np.uint8)
+    text[:, _UUID_HEX_POSITIONS] = _HEX_DIGITS[halves.view(np.uint8).reshape(-1, 16)].reshape(-1, 32)
+    return text.view("S36").ravel().astype("U36").tolist()
+
+def format_timestamps(ts_us: np.ndarray) -> List[str]:
+    text = np.datetime_as_string(ts_us.astype("datetime64[us]"), unit="us")
+    # isoformat() leaves out a zero microsecond part
+    whole = ts_us % 1_000_000 == 0
+    text[whole] = text[whole].astype("U19")
+    return text.tolist()
+
+def take_labels(labels: Sequence[str], codes: np.ndarray) -> List[str]:
+    """labels[code] for every code; uses the table's own bulk take() when it has one"""
+    if hasattr(labels, "take"):
+        return labels.take(codes)
+    return [labels[code] for code in codes.tolist()]
+
+def format_ips(ips: np.ndarray) -> List[str]:
+    if not _OCTET_PAIRS:
+        _OCTET_PAIRS.extend(f"{i >> 8}.{i & 0xFF}" for i in range(1 << 16))
+    ips = ips.astype(np.uint32)
+    return [_OCTET_PAIRS[high] + "." + _OCTET_PAIRS[low] for high, low in zip((ips >> 16).tolist(), (ips & 0xFFFF).tolist())]
+
+COLUMN_DTYPES = {
+    "timestamp_us": np.int64,
+    "amount": np.float64,
+    "amount_base": np.float64,
+    "currency": np.int8,
+    "merchant": np.int32,
+    "category": np.int8,
+    "payment_method": np.int8,
+    "city": np.int16,
+    "fraud_pattern": np.int8,
+    "risk_score": np.float64,
+    "user": np.int32,
+    "device": np.uint64,
+    "ip": np.uint32,
+    "id_hi": np.uint64,
+    "id_lo": np.uint64,
+}
+
+@dataclass
+class TransactionBatch:
+    """A chunk of transactions stored as parallel NumPy arrays.
+
+    `amount` is in the row's `currency` and `amount_base` in the base
+    currency of the FX rates it was generated with, both rounded to their
+    currency's minor units.
+
+    String fields are stored as codes: `currency`, `category`, `payment_method`
+    and `fraud_pattern` index the vocabularies in models.py, `merchant`, `city`
+    and `user` index the engine's merchant, location and user tables, `device`
+    is a packed fingerprint (see parse_device) and `id_hi`/`id_lo` hold the
+    128-bit transaction UUID.
+
+    `features` optionally holds per-row labelled feature columns (see
+    features.FEATURE_DTYPES); it is None for batches straight from the engine.
+    """
+    timestamp_us: np.ndarray
+    amount: np.ndarray
+    amount_base: np.ndarray
+    currency: np.ndarray
+    merchant: np.ndarray
+    category: np.ndarray
+    payment_method: np.ndarray
+    city: np.ndarray
+    fraud_pattern: np.ndarray
+    risk_score: np.ndarray
+    user: np.ndarray
+    device: np.ndarray
+    ip: np.ndarray
+    id_hi: np.ndarray
+    id_lo: np.ndarray
+    features: Optional[Dict[str, np.ndarray]] = None
+
+    def __len__(self) -> int:
+        return len(self.amount)
+
+    @property
+    def nbytes(self) -> int:
+        columns = sum(getattr(self, name).nbytes for name in COLUMN_DTYPES)
+        return columns + sum(column.nbytes for column in (self.features or {}).values())
+
+    def take(self, indices) -> "TransactionBatch":
+        """Rows selected by an index array, or a view when given a slice"""
+        features = {name: column[indices] for name, column in self.features.items()} if self.features else None
+        return TransactionBatch(**{name: getattr(self, name)[indices] for name in COLUMN_DTYPES}, features=features)
+
+    @classmethod
+    def allocate(cls, n: int, feature_dtypes: Optional[Dict[str, type]] = None) -> "TransactionBatch":
+        """Uninitialized batch of `n` rows with the canonical column dtypes"""
+        features = {name: np.empty(n, dtype=dtype) for name, dtype in feature_dtypes.items()} if feature_dtypes else None
+        return cls(**{name: np.empty(n, dtype=dtype) for name, dtype in COLUMN_DTYPES.items()}, features=features)
+
+    @classmethod
+    def concat(cls, batches: List["TransactionBatch"]) -> "TransactionBatch":
+        # Features survive only if every part has them
+        features = None
+        if batches and all(b.features for b in batches):
+            features = {name: np.concatenate([b.features[name] for b in batches]) for name in batches[0].features}
+        return cls(**{name: np.concatenate([getattr(b, name) for b in batches]) for name in COLUMN_DTYPES},
+                   features=features)
+
+def random_uuids(rng: np.random.Generator, n: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Random version-4 UUIDs as (high, low) 64-bit halves"""
+    hi = rng.integers(0, np.iinfo(np.uint64).max, n, dtype=np.uint64, endpoint=True)
+    lo = rng.integers(0, np.iinfo(np.uint64).max, n, dtype=np.uint64, endpoint=True)
+    hi = (hi & np.uint64(0xFFFFFFFFFFFF0FFF)) | np.uint64(0x4000)
+    lo = (lo & np.uint64(0x3FFFFFFFFFFFFFFF)) | np.uint64(0x8000000000000000)
+    return hi, lo
+
+def sample_distinct(rng: np.random.Generator, rows: int, width: int, population: int) -> np.ndarray:
+    """`rows` independent samples of `width` distinct values from range(population)"""
+    if population <= 4 * width:
+        return np.argsort(rng.random((rows, population)), axis=1)[:, :width]
+    sample = rng.integers(0, population, (rows, width))
+    # Only redrawn rows can clash again, so each round re-checks just those
+    pending = np.arange(rows)
+    while len(pending):
+        ordered = np.sort(sample[pending], axis=1)
+        pending = pending[(ordered[:, 1:] == ordered[:, :-1]).any(axis=1)]
+        sample[pending] = rng.integers(0, population, (len(pending), width))
+    return sample
+
+def _expand(counts: np.ndarray):
+    """Row -> (instance index, step within instance) for instances of `counts` rows each"""
+    instance = np.repeat(np.arange(len(counts)), counts)
+    starts = np.cumsum(counts) - counts
+    step = np.arange(len(instance)) - starts[instance]
+    return instance, step
+
+class BatchEngine:
+    """Vectorized transaction generator.
+
+    Produces the same distributions as SyntheticFraudSimulator.generate_normal_transaction
+    and the generate_* fraud generators, but draws every field for a chunk of
+    simulation steps at once, reading users straight from the simulator's
+    UserTable and the merchant and device pools.
+    """
+
+    def __init__(self, simulator, user_subset: Optional[np.ndarray] = None,
+                 user_shard: Optional[int] = None):
+        self.seed_sequence = simulator.seed_sequence
+        self.user_shard = user_shard
+        self._use_streams(GENERATION)
+        self.locations = simulator.locations
+        self.ip_blocks = simulator.ip_blocks
+        self.merchant_ids = simulator.merchant_ids
+
+        self.merchant_category = np.asarray(simulator.pools.merchant_category)
+        self.device_codes = simulator.pools.device_codes
+
+        table = simulator.user_table
+        self.num_users = len(table)
+        self.user_home = table.home_city
+        self.user_avg_amount = table.average_amount
+        self.user_merchant_offsets, self.user_merchants = table.merchant_offsets, table.merchants
+        self.user_device_offsets, self.user_devices = table.device_offsets, table.devices
+        self.location_method_count = np.array([len(payment_methods_for_location(location))
+                                               for location in self.locations], dtype=np.int8)
+        # Users pay in the currency of their home location; amounts are drawn in the model currency
+        self.location_currency = np.array([CURRENCY_INDEX[currency_for_location(location)]
+                                           for location in self.locations], dtype=np.int8)
+        self.fx_rates = simulator.fx_rates
+        # Users the generated steps are drawn from (all users unless sharded by user)
+        self.user_pool = None if user_subset is None else np.asarray(user_subset)
+        self._city_users = None
+        # (position in the hours, block) iter_hours generates next, for checkpoints
+        self.cursor = (0, 0)
+
+        # Pattern code -> registered kernel, see patterns.register_pattern
+        self.kernels = {FRAUD_PATTERN_INDEX[name]: kernel for name, kernel in PATTERNS.items()}
+
+    @property
+    def city_share(self) -> np.ndarray:
+        """Share of the drawable users living in each location"""
+        users, _, counts = self._users_by_city()
+        return counts / max(len(users), 1)
+
+    def _users_by_city(self):
+        """(users grouped by home location, index of each location's first user, users per location)"""
+        if self._city_users is None:
+            pool = np.arange(self.num_users) if self.user_pool is None else self.user_pool
+            home = np.asarray(self.user_home)[pool]
+            counts = np.bincount(home, minlength=len(self.locations))
+            self._city_users = (pool[np.argsort(home, kind="stable")], np.cumsum(counts) - counts, counts)
+        return self._city_users
+
+    def _use_streams(self, *key: int):
+        """Point the per-component generators at the streams below `key`"""
+        self.user_rng = numpy_stream(self.seed_sequence, *key, BLOCK_USERS)
+        self.pattern_rng = numpy_stream(self.seed_sequence, *key, BLOCK_PATTERNS)
+        self.id_rng = numpy_stream(self.seed_sequence, *key, BLOCK_IDS)
+        self.rng = numpy_stream(self.seed_sequence, *key, BLOCK_FIELDS)
+
+    # ----- per-field samplers, shared with the pattern kernels -----
+
+    def pick(self, offsets: np.ndarray, values: np.ndarray, users: np.ndarray) -> np.ndarray:
+        """Uniformly pick one entry from each user's list in a CSR table"""
+        start = offsets[users]
+        column = (self.rng.random(len(users)) * (offsets[users + 1] - start)).astype(np.int64)
+        return values[start + column]
+
+    def pick_devices(self, users: np.ndarray) -> np.ndarray:
+        """One of each user's own devices"""
+        return self.device_codes[self.pick(self.user_device_offsets, self.user_devices, users)]
+
+    def payment_methods(self, users: np.ndarray) -> np.ndarray:
+        """One of the payment methods offered in each user's home location"""
+        counts = self.location_method_count[self.user_home[users]]
+        return (self.rng.random(len(users)) * counts).astype(np.int8)
+
+    def home_currencies(self, users: np.ndarray) -> np.ndarray:
+        """Currency code of each user's home location"""
+        return self.location_currency[self.user_home[users]]
+
+    def _price(self, batch: TransactionBatch):
+        """Convert the model-currency amounts the row kernels drew to each row's currency and the base currency"""
+        batch.amount, batch.amount_base = self.fx_rates.price(batch.amount, batch.currency)
+
+    def _ids(self, n: int):
+        return random_uuids(self.id_rng, n)
+
+    def random_devices(self, n: int) -> np.ndarray:
+        """Fresh device fingerprints, unknown to the device pool"""
+        browser = self.rng.integers(0, len(BROWSERS), n, dtype=np.uint64)
+        os_name = self.rng.integers(0, len(OS_LIST), n, dtype=np.uint64)
+        tag = self.rng.integers(0, 1 << 32, n, dtype=np.uint64)
+        return (browser << np.uint64(35)) | (os_name << np.uint64(32)) | tag
+
+    def categories(self, names: List[str], n: int) -> np.ndarray:
+        """Category codes drawn uniformly from `names`"""
+        codes = np.array([CATEGORY_INDEX[name] for name in names], dtype=np.int8)
+        return codes[self.rng.integers(0, len(codes), n)]
+
+    def sample_distinct(self, rows: int, width: int, population: int) -> np.ndarray:
+        return sample_distinct(self.rng, rows, width, population)
+
+    # ----- row kernels -----
+
+    def _normal(self, users: np.ndarray, times: np.ndarray) -> TransactionBatch:
+        """Vectorized generate_normal_transaction"""
+        n = len(users)
+        merchant = self.pick(self.user_merchant_offsets, self.user_merchants, users)
+        avg = self.user_avg_amount[users]
+        amount = np.maximum(1.0, np.round(self.rng.normal(avg, avg * 0.3), 2))
+        # Location is usually the home location, but can vary
+        city = np.where(self.rng.random(n) < 0.8, self.user_home[users],
+                        self.rng.integers(0, len(self.locations), n)).astype(np.int16)
+        id_hi, id_lo = self._ids(n)
+        return TransactionBatch(
+            timestamp_us=times.astype(np.int64),
+            amount=amount,  # in the model currency until priced in generate()
+            amount_base=np.empty(n),
+            currency=self.home_currencies(users),
+            merchant=merchant,
+            category=self.merchant_category[merchant],
+            payment_method=self.payment_methods(users),
+            city=city,
+            fraud_pattern=np.zeros(n, dtype=np.int8),
+            risk_score=self.rng.uniform(0.1, 0.3, n),
+            user=users.astype(np.int32),
+            device=self.pick_devices(users),
+            ip=np.zeros(n, dtype=np.uint32),  # drawn for the final city in generate()
+            id_hi=id_hi,
+            id_lo=id_lo,
+        )
+
+    def attack_rows(self, pattern: FraudPattern, users: np.ndarray, counts: np.ndarray,
+                     times: np.ndarray, interval_us: int, min_steps: int, max_steps: int):
+        """Fields shared by every attack kernel; kernels overwrite what differs.
+
+        Row i of an attack starting at `times[k]` is timestamped
+        `times[k] + i * randint(min_steps, max_steps) * interval_us` and uses one
+        device of the victim for the whole attack. Rows are charged in the
+        victim's home currency; kernels set `amount`, in the model currency.
+        """
+        instance, step = _expand(counts)
+        n = len(instance)
+        row_users = users[instance]
+        id_hi, id_lo = self._ids(n)
+        offsets = step * self.rng.integers(min_steps, max_steps + 1, n) * interval_us
+        batch = TransactionBatch(
+            timestamp_us=times[instance] + offsets.astype(np.int64),
+            amount=np.empty(n),  # in the model currency until priced in generate()
+            amount_base=np.empty(n),
+            currency=self.home_currencies(row_users),
+            merchant=self.rng.integers(0, len(self.merchant_ids), n, dtype=np.int32),
+            category=np.empty(n, dtype=np.int8),
+            payment_method=self.payment_methods(row_users),
+            city=self.user_home[row_users],
+            fraud_pattern=np.full(n, FRAUD_PATTERN_INDEX[pattern.value], dtype=np.int8),
+            risk_score=np.empty(n),
+            user=row_users.astype(np.int32),
+            device=self.pick_devices(users)[instance],
+            ip=np.zeros(n, dtype=np.uint32),  # drawn for the final city in generate()
+            id_hi=id_hi,
+            id_lo=id_lo,
+        )
+        return batch, instance, step
+
+    # ----- chunk generation -----
+
+    def pattern_choices(self, fraud_patterns: Optional[List[str]]) -> np.ndarray:
+        """Pattern codes a fraudulent step may pick from; mixed_patterns (or none) means every registered one"""
+        if not fraud_patterns or FraudPattern.MIXED_PATTERNS.value in fraud_patterns:
+            patterns = [p.value for p in FraudPattern if p.value in PATTERNS]
+        else:
+            patterns = [FraudPattern(p).value for p in fraud_patterns]
+            missing = [p for p in patterns if p not in PATTERNS]
+            if missing:
+                raise ValueError(f"No kernel registered for fraud pattern(s): {', '.join(missing)}")
+        return np.array([FRAUD_PATTERN_INDEX[p] for p in patterns], dtype=np.int8)
+
+    def generate(self, steps: int, fraud_rate: float = 0.15,
+                 fraud_patterns: Optional[List[str]] = None,
+                 start_us: Optional[int] = None, span_us: int = 0,
+                 times: Optional[np.ndarray] = None, cities: Optional[np.ndarray] = None) -> TransactionBatch:
+        """Generate `steps` simulation steps in one go.
+
+        Like one iteration of the run_simulation loop, each step is either a
+        single normal transaction or a whole fraud attack, and the rows of an
+        attack stay contiguous in the returned batch. Steps are spread evenly
+        over `span_us` microseconds of simulated time from `start_us`
+        (default: now), unless explicit step `times` are given; with `cities`
+        each step's user is drawn from the users living in that location.
+        """
+        if times is None:
+            if start_us is None:
+                start_us = now_us()
+            times = start_us + (np.arange(steps, dtype=np.int64) * span_us) // max(steps, 1)
+        if cities is not None:
+            city_users, city_first, city_count = self._users_by_city()
+            if not city_count[cities].all():
+                raise ValueError("Steps were scheduled in a location none of the drawable users lives in")
+            pick = (self.user_rng.random(steps) * city_count[cities]).astype(np.int64)
+            users = city_users[city_first[cities] + pick]
+        elif self.user_pool is None:
+            users = self.user_rng.integers(0, self.num_users, steps)
+        else:
+            users = self.user_pool[self.user_rng.integers(0, len(self.user_pool), steps)]
+        is_fraud = self.pattern_rng.random(steps) < fraud_rate
+        choices = self.pattern_choices(fraud_patterns)
+        patterns = np.zeros(steps, dtype=np.int8)
+        patterns[is_fraud] = choices[self.pattern_rng.integers(0, len(choices), int(is_fraud.sum()))]
+
+        # Decide every attack's length first so each step knows where its rows go
+        lengths = np.ones(steps, dtype=np.int64)
+        groups = []
+        for code in np.unique(patterns[is_fraud]):
+            kernel = self.kernels[int(code)]
+            step_idx = np.flatnonzero(patterns == code)
+            counts = kernel.draw_counts(self, self.pattern_rng, len(step_idx))
+            lengths[step_idx] = counts
+            groups.append((int(code), kernel, step_idx, counts))
+        offsets = np.cumsum(lengths) - lengths
+
+        normal_idx = np.flatnonzero(~is_fraud)
+        with METRICS.timed("normal_transactions") as timer:
+            pieces = [self._normal(users[normal_idx], times[normal_idx])]
+            timer.rows = len(normal_idx)
+        destinations = [offsets[normal_idx]]
+        for code, kernel, step_idx, counts in groups:
+            with METRICS.timed("fraud_pattern", pattern=FRAUD_PATTERN_CODES[code]) as timer:
+                pieces.append(kernel.generate(self, users[step_idx], counts, times[step_idx]))
+                timer.rows = len(pieces[-1])
+            _, step = _expand(counts)
+            destinations.append(np.repeat(offsets[step_idx], counts) + step)
+
+        batch = TransactionBatch.concat(pieces)
+        order = np.empty(len(batch), dtype=np.int64)
+        order[np.concatenate(destinations)] = np.arange(len(batch))
+        batch = batch.take(order)
+        # Kernels may move rows to other cities, so IPs are drawn last, from each row's country
+        batch.ip = self.ip_blocks.sample(self.rng, batch.city)
+        self._price(batch)
+        return batch
+
+    def attack(self, pattern: str, users: np.ndarray, times: np.ndarray,
+               counts: Optional[np.ndarray] = None) -> TransactionBatch:
+        """One attack of `pattern` per user, starting at `times`, through the pattern's kernel
+
+        Attack lengths are drawn like generate() draws them unless `counts`
+        are given.
+        """
+        kernel = PATTERNS[FraudPattern(pattern).value]
+        if counts is None:
+            counts = kernel.draw_counts(self, self.pattern_rng, len(users))
+        counts = kernel.limit(self, np.asarray(counts))
+        batch = kernel.generate(self, np.asarray(users), counts, np.asarray(times, dtype=np.int64))
+        batch.ip = self.ip_blocks.sample(self.rng, batch.city)
+        self._price(batch)
+        return batch
+
+    def iter_hours(self, hours: Iterable[int], steps_per_hour: int, start_us: int, batch_size: int = 10000,
+                   fraud_rate: float = 0.15, fraud_patterns: Optional[List[str]] = None,
+                   traffic=None, release: Optional["OrderedRelease"] = None,
+                   resume_at: Tuple[int, int] = (0, 0)) -> Iterator[Tuple[int, int, TransactionBatch]]:
+        """Yield (hour, steps, batch) chunks covering the given simulated hours, in timestamp order.
+
+        Hour h spans [start_us + h hours, start_us + (h + 1) hours) of simulated
+        time. Its steps are spread evenly over the hour or, with a `traffic`
+        model (see traffic.TrafficModel), scheduled by it from a stream keyed
+        by the hour. Each hour is generated in blocks of BLOCK_STEPS steps,
+        block b of hour h drawing from its own streams keyed by (h, b), so the
+        output is independent of `batch_size` and of how hours are split
+        between processes. Blocks are grouped into chunks of about
+        `batch_size` steps and generated lazily, so callers can stop between
+        chunks.
+
+        Attack rows run ahead of their step's time, so rows are held back in
+        an OrderedRelease until no later step can precede them; each chunk
+        carries the rows released after generating `steps` steps. `hours`
+        must be ascending.
+
+        After each chunk, self.cursor is the (position in `hours`, block) to
+        generate next. A run checkpointed there continues exactly where it
+        stopped when given that cursor as `resume_at` and its `release`
+        buffer back.
+        """
+        shard_key = () if self.user_shard is None else (self.user_shard,)
+        release = OrderedRelease() if release is None else release
+        hours = list(hours)
+        self.cursor = resume_at
+        for position, hour in enumerate(hours):
+            if position < resume_at[0]:
+                continue
+            hour_start = start_us + hour * HOUR_US
+            times = cities = None
+            steps_this_hour = steps_per_hour
+            if traffic is not None:
+                rng = numpy_stream(self.seed_sequence, SCHEDULE, hour, *shard_key)
+                times, cities = traffic.schedule(rng, hour_start, steps_per_hour, self.city_share)
+                steps_this_hour = len(times)
+            # No step of a later hour can start before that hour does
+            next_hour = start_us + hours[position + 1] * HOUR_US if position + 1 < len(hours) else None
+
+            blocks = -(-steps_this_hour // BLOCK_STEPS)
+            pending_steps = 0
+            for block in range(resume_at[1] if position == resume_at[0] else 0, blocks):
+                first = block * BLOCK_STEPS
+                steps = min(BLOCK_STEPS, steps_this_hour - first)
+                self._use_streams(GENERATION, hour, block, *shard_key)
+                if times is None:
+                    batch = self.generate(
+                        steps, fraud_rate=fraud_rate, fraud_patterns=fraud_patterns,
+                        start_us=hour_start + first * HOUR_US // steps_per_hour,
+                        span_us=steps * HOUR_US // steps_per_hour)
+                    next_step = hour_start + (first + steps) * HOUR_US // steps_per_hour
+                else:
+                    batch = self.generate(steps, fraud_rate=fraud_rate, fraud_patterns=fraud_patterns,
+                                          times=times[first:first + steps], cities=cities[first:first + steps])
+                    next_step = int(times[first + steps]) if first + steps < steps_this_hour else None
+                release.add(batch)
+                pending_steps += steps
+                if pending_steps >= batch_size or block == blocks - 1:
+                    watermark = next_step if block < blocks - 1 else next_hour
+                    self.cursor = (position, block + 1) if block < blocks - 1 else (position + 1, 0)
+                    yield hour, pending_steps, release.pop(watermark)
+                    pending_steps = 0
+            if not blocks and next_hour is None:
+                self.cursor = (position + 1, 0)
+                yield hour, 0, release.pop(None)
+
+class OrderedRelease:
+    """Reorder buffer turning generated batches into a timestamp-ordered row stream.
+
+    Added batches are sorted into runs; pop(watermark) takes every buffered
+    row older than `watermark` from the heads of the runs and merges them.
+    Runs are merged on the same doubling policy as features.WindowIndex, so
+    few runs are kept. Rows with equal timestamps come out in the order they
+    were added, which makes the stream identical to a stable sort of all
+    generated rows.
+    """
+
+    def __init__(self):
+        self.runs: List[TransactionBatch] = []
+
+    def __len__(self) -> int:
+        return sum(len(run) for run in self.runs)
+
+    def add(self, batch: TransactionBatch):
+        self.runs.append(batch.take(np.argsort(batch.timestamp_us, kind="stable")))
+        while len(self.runs) > 1 and len(self.runs[-2]) <= 2 * len(self.runs[-1]):
+            self.runs[-2:] = [_merge_runs(self.runs[-2:])]
+
+    def snapshot(self) -> TransactionBatch:
+        """Every buffered row in release order, leaving the buffer as it is"""
+        return _merge_runs(self.runs) if self.runs else TransactionBatch.allocate(0)
+
+    def pop(self, watermark: Optional[int]) -> TransactionBatch:
+        """Rows with timestamp < `watermark` (all rows if None), in timestamp order"""
+        heads, tails = [], []
+        for run in self.runs:
+            split = len(run) if watermark is None else int(np.searchsorted(run.timestamp_us, watermark))
+            heads.append(run.take(slice(0, split)))
+            if split < len(run):
+                tails.append(run.take(slice(split, len(run))))
+        self.runs = tails
+        return _merge_runs(heads) if heads else TransactionBatch.allocate(0)
+
+def _merge_runs(runs: List[TransactionBatch]) -> TransactionBatch:
+    """Merge timestamp-sorted runs, earlier runs first among equal timestamps"""
+    if len(runs) == 1:
+        return runs[0]
+    merged = TransactionBatch.concat(runs)
+    return merged.take(np.argsort(merged.timestamp_us, kind="stable"))
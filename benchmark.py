@@ -0,0 +1,209 @@
+"""Benchmarks for generation throughput, report latency and memory per row.
+
+Runs without the web server:
+
+    python benchmark.py --scales 10000,100000,1000000 --output benchmark.json
+
+Every end-to-end scale runs in a fresh process so its peak RSS is its own.
+Results are written as JSON for comparison across versions.
+"""
+import argparse
+import json
+import logging
+import multiprocessing as mp
+import os
+import platform
+import statistics
+import subprocess
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from typing import Dict, List, Any, Callable, Optional
+
+import numpy as np
+
+from metrics import process_rss_bytes, peak_rss_bytes
+
+SEED = 1234
+
+# Per-row generators and the rows one call produces
+ROW_GENERATORS = {
+    "generate_normal_transaction": lambda sim, user: [sim.generate_normal_transaction(user)],
+    "generate_rapid_fire_attack": lambda sim, user: sim.generate_rapid_fire_attack(user),
+    "generate_geographic_hopping": lambda sim, user: sim.generate_geographic_hopping(user),
+    "generate_device_spoofing": lambda sim, user: sim.generate_device_spoofing(user),
+    "generate_amount_escalation": lambda sim, user: sim.generate_amount_escalation(user),
+    "generate_merchant_cycling": lambda sim, user: sim.generate_merchant_cycling(user),
+    "generate_velocity_attack": lambda sim, user: sim.generate_attack("velocity_attack", user),
+    "generate_account_takeover": lambda sim, user: sim.generate_attack("account_takeover", user),
+}
+
+def _timed(fn: Callable[[], Any], repeat: int) -> Dict[str, float]:
+    """Median and min wall time of `repeat` calls, in milliseconds"""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append((time.perf_counter() - start) * 1000)
+    return {"median_ms": round(statistics.median(times), 3), "min_ms": round(min(times), 3)}
+
+def _simulator():
+    from app import SyntheticFraudSimulator
+    simulator = SyntheticFraudSimulator(seed=SEED)
+    simulator._reset_users(1000)
+    return simulator
+
+def bench_row_generators(min_seconds: float) -> Dict[str, Any]:
+    """Transactions/s of each per-row generator, run for at least `min_seconds`"""
+    simulator = _simulator()
+    user_ids = list(simulator.users)
+    results = {}
+    for name, generate in ROW_GENERATORS.items():
+        rows = calls = 0
+        start = time.perf_counter()
+        while time.perf_counter() - start < min_seconds:
+            rows += len(generate(simulator, user_ids[calls % len(user_ids)]))
+            calls += 1
+        elapsed = time.perf_counter() - start
+        results[name] = {"rows": rows, "calls": calls, "seconds": round(elapsed, 3),
+                         "transactions_per_second": round(rows / elapsed, 1)}
+    return results
+
+def bench_batch_engine(steps: int) -> Dict[str, Any]:
+    """Transactions/s of the vectorized engine: all patterns, a fraud-heavy mix and each registered pattern alone"""
+    from batch_engine import BatchEngine
+    from patterns import PATTERNS
+    simulator = _simulator()
+    engine = BatchEngine(simulator)
+    results = {}
+    cases = {"all_patterns": (0.15, None), "fraud_heavy": (0.9, None)}
+    cases.update({name: (1.0, [name]) for name in PATTERNS})
+    for name, (fraud_rate, patterns) in cases.items():
+        start = time.perf_counter()
+        batch = engine.generate(steps, fraud_rate=fraud_rate, fraud_patterns=patterns)
+        elapsed = time.perf_counter() - start
+        results[name] = {"steps": steps, "rows": len(batch), "seconds": round(elapsed, 4),
+                         "transactions_per_second": round(len(batch) / elapsed, 1)}
+    return results
+
+def bench_scale(steps: int, report_repeat: int, store_memory_budget: Optional[int] = None) -> Dict[str, Any]:
+    """One end-to-end run of `steps` simulation steps; meant to run in its own process
+
+    With `store_memory_budget` the store spills rows beyond it to disk.
+    """
+    from app import SyntheticFraudSimulator
+    from serialization import encode_report
+    logging.disable(logging.INFO)
+
+    simulator = SyntheticFraudSimulator(seed=SEED)
+    simulator.pools  # pool construction is measured separately
+    baseline_rss = process_rss_bytes()
+
+    start = time.perf_counter()
+    simulator.run_simulation(duration_hours=1, transactions_per_hour=steps, seed=SEED,
+                             store_memory_budget=store_memory_budget)
+    elapsed = time.perf_counter() - start
+    rows = len(simulator.transactions)
+    peak_rss = peak_rss_bytes()
+
+    report, batch = simulator.report_page(limit=100)
+    serialize = _timed(lambda: encode_report(report, simulator.transactions.encoder, batch), report_repeat)
+    body_bytes = len(encode_report(report, simulator.transactions.encoder, batch))
+    page, page_batch = simulator.report_page(limit=10_000)
+    serialize_page = _timed(lambda: encode_report(page, simulator.transactions.encoder, page_batch), report_repeat)
+
+    return {
+        "steps": steps,
+        "rows": rows,
+        "run_seconds": round(elapsed, 3),
+        "transactions_per_second": round(rows / elapsed, 1),
+        "generate_report": _timed(simulator.generate_report, report_repeat),
+        "get_report_serialization": serialize,
+        "get_report_bytes": body_bytes,
+        "get_report_serialization_10k_rows": serialize_page,
+        "store_memory_budget": store_memory_budget,
+        "store_bytes": simulator.transactions.nbytes,
+        "store_spilled_bytes": simulator.transactions.spilled_bytes,
+        "baseline_rss_bytes": baseline_rss,
+        "peak_rss_bytes": peak_rss,
+        "peak_rss_bytes_per_million_rows": round((peak_rss - baseline_rss) / rows * 1e6) if rows else None,
+    }
+
+def bench_pools(sizes: List[int]) -> Dict[str, Any]:
+    """Time to build the device and merchant pools at several sizes"""
+    from data_pools import DataPools
+    from models import LOCATIONS
+    results = {}
+    for size in sizes:
+        start = time.perf_counter()
+        DataPools.build(np.random.SeedSequence(SEED), size, size // 10, LOCATIONS)
+        results[str(size)] = {"devices": size, "merchants": size // 10,
+                              "seconds": round(time.perf_counter() - start, 4)}
+    return results
+
+def bench_users(sizes: List[int]) -> Dict[str, Any]:
+    """Time and memory to build the user table at several population sizes"""
+    from user_table import UserTable
+    from models import LOCATIONS
+    results = {}
+    for size in sizes:
+        start = time.perf_counter()
+        table = UserTable.build(np.random.SeedSequence(SEED), size, 1000, 10000, len(LOCATIONS))
+        results[str(size)] = {"users": size, "seconds": round(time.perf_counter() - start, 4),
+                              "bytes_per_user": round(table.nbytes / size, 1)}
+    return results
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        return ""
+
+def run_benchmarks(scales: List[int], min_seconds: float = 1.0, engine_steps: int = 100_000,
+                   report_repeat: int = 5, store_memory_budget: Optional[int] = None) -> Dict[str, Any]:
+    results = {
+        "metadata": {
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "commit": _git_commit(),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "seed": SEED,
+        },
+        "row_generators": bench_row_generators(min_seconds),
+        "batch_engine": bench_batch_engine(engine_steps),
+        "data_pools": bench_pools([10_000, 1_000_000]),
+        "user_table": bench_users([10_000, 1_000_000]),
+        "scales": [],
+    }
+    ctx = mp.get_context("spawn")
+    for steps in scales:
+        with ProcessPoolExecutor(max_workers=1, mp_context=ctx) as pool:
+            results["scales"].append(pool.submit(bench_scale, steps, report_repeat, store_memory_budget).result())
+    return results
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scales", default="10000,100000,1000000",
+                        help="comma-separated simulation steps for the end-to-end runs")
+    parser.add_argument("--min-seconds", type=float, default=1.0,
+                        help="minimum time spent on each per-row generator")
+    parser.add_argument("--engine-steps", type=int, default=100_000)
+    parser.add_argument("--report-repeat", type=int, default=5)
+    parser.add_argument("--store-budget-mb", type=int, default=None,
+                        help="spill the store to disk beyond this many MB in the end-to-end runs")
+    parser.add_argument("--output", default="-", help="JSON output path, - for stdout")
+    args = parser.parse_args()
+
+    logging.disable(logging.INFO)
+    results = run_benchmarks([int(s) for s in args.scales.split(",") if s], args.min_seconds,
+                             args.engine_steps, args.report_repeat,
+                             None if args.store_budget_mb is None else args.store_budget_mb << 20)
+    output = json.dumps(results, indent=2)
+    if args.output == "-":
+        print(output)
+    else:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
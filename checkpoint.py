@@ -0,0 +1,183 @@
+import json
+import logging
+import os
+import shutil
+import time
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Dict, Any, Optional, Tuple
+
+import numpy as np
+
+from batch_engine import TransactionBatch, OrderedRelease, COLUMN_DTYPES
+from exporter import StreamingExporter
+from metrics import METRICS
+
+logger = logging.getLogger(__name__)
+
+# Bump when the checkpoint layout changes, so old checkpoints are refused rather than misread
+CHECKPOINT_VERSION = 4
+
+STATE_FILE = "state.json"
+SEGMENT_DIR = "segments"
+
+def save_batch(path: str, batch: TransactionBatch):
+    """Write a batch's columns, features included, as one uncompressed .npz, atomically"""
+    arrays = {name: getattr(batch, name) for name in COLUMN_DTYPES}
+    arrays.update({f"feature_{name}": column for name, column in (batch.features or {}).items()})
+    _save_npz(path, arrays)
+
+def load_batch(path: str) -> TransactionBatch:
+    with np.load(path) as data:
+        features = {name[len("feature_"):]: data[name] for name in data.files if name.startswith("feature_")}
+        return TransactionBatch(**{name: data[name] for name in COLUMN_DTYPES}, features=features or None)
+
+def _save_npz(path: str, arrays: Dict[str, np.ndarray]):
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        np.savez(f, **arrays)
+    os.replace(tmp, path)
+
+def _segment_path(directory: str, segment: int) -> str:
+    return os.path.join(directory, SEGMENT_DIR, f"segment-{segment:06d}.bin")
+
+def _generation_dir(directory: str, generation: int) -> str:
+    return os.path.join(directory, f"generation-{generation:06d}")
+
+@dataclass
+class Checkpoint:
+    """The last checkpoint written to a directory, see load_checkpoint"""
+    directory: str
+    state: Dict[str, Any]
+
+    @property
+    def run(self) -> Dict[str, Any]:
+        """The run's parameters, as run_simulation resolved them"""
+        return self.state["run"]
+
+    @property
+    def cursor(self) -> Tuple[int, int]:
+        return tuple(self.state["cursor"])
+
+    @property
+    def done(self) -> int:
+        return self.state["done"]
+
+    @property
+    def complete(self) -> bool:
+        return self.state["complete"]
+
+    @property
+    def pool_sizes(self) -> Dict[str, int]:
+        """Simulator constructor arguments giving the run's pools"""
+        return dict(self.run["pool_sizes"])
+
+    def exporter(self) -> Optional[StreamingExporter]:
+        """An exporter continuing after the files written up to this checkpoint, if the run exported"""
+        state = self.state.get("exporter")
+        return StreamingExporter.from_checkpoint(state) if state else None
+
+    def release(self) -> OrderedRelease:
+        """The rows generated but not yet emitted at this checkpoint"""
+        release = OrderedRelease()
+        pending = load_batch(os.path.join(self._generation, "release.npz"))
+        if len(pending):
+            release.add(pending)
+        return release
+
+    def restore(self, simulator):
+        """Put the report totals, feature history and retained rows back into a reset simulator"""
+        with np.load(os.path.join(self._generation, "state.npz")) as data:
+            arrays = {name: data[name] for name in data.files}
+        simulator.report.restore(_prefixed(arrays, "report_"))
+        if simulator.feature_index is not None:
+            simulator.feature_index.restore(_prefixed(arrays, "features_"))
+        for segment in range(self.state["segments"]):
+            simulator.transactions.map_sealed(_segment_path(self.directory, segment))
+        simulator.transactions.append_batch(load_batch(os.path.join(self._generation, "tail.npz")))
+
+    @property
+    def _generation(self) -> str:
+        return _generation_dir(self.directory, self.state["generation"])
+
+def _prefixed(arrays: Dict[str, np.ndarray], prefix: str) -> Dict[str, np.ndarray]:
+    return {name[len(prefix):]: value for name, value in arrays.items() if name.startswith(prefix)}
+
+def load_checkpoint(directory: str) -> Checkpoint:
+    """The last complete checkpoint in `directory`; FileNotFoundError if there is none"""
+    with open(os.path.join(directory, STATE_FILE)) as f:
+        state = json.load(f)
+    if state.get("version") != CHECKPOINT_VERSION:
+        raise ValueError(f"Unsupported checkpoint version: {state.get('version')}")
+    return Checkpoint(directory, state)
+
+class Checkpointer:
+    """Periodically saves a single-process run to `directory` so it can be resumed.
+
+    A checkpoint is taken between chunks, where the engine's cursor, its
+    reorder buffer and everything emitted so far agree. Each one writes the
+    report totals, the feature history, the reorder buffer and the store's
+    open tail segment to a new generation directory, then switches
+    state.json over to it with an atomic rename, so a crash mid-write
+    leaves the previous checkpoint intact. Sealed store segments never
+    change and are written once, to a directory shared by all generations;
+    those the store has spilled are hard-linked to its spill files, and a
+    restored run maps them rather than reading them back into memory.
+    Users and data pools are not saved: they are rebuilt from the run's seed.
+    """
+
+    def __init__(self, directory: str, interval_seconds: float = 60.0, previous: Optional[Checkpoint] = None):
+        self.directory = directory
+        self.interval_seconds = interval_seconds
+        self.generation = previous.state["generation"] if previous else 0
+        self.saved_segments = previous.state["segments"] if previous else 0
+        self._last = time.monotonic()
+        os.makedirs(os.path.join(directory, SEGMENT_DIR), exist_ok=True)
+
+    def due(self) -> bool:
+        return time.monotonic() - self._last >= self.interval_seconds
+
+    def save(self, simulator, run: Dict[str, Any], cursor: Tuple[int, int], done: int, release: OrderedRelease,
+             exporter: Optional[StreamingExporter] = None, complete: bool = False):
+        """Checkpoint a run that has generated up to `cursor` and emitted everything `release` no longer holds"""
+        with METRICS.timed("checkpoint_write") as timer:
+            generation = self.generation + 1
+            path = _generation_dir(self.directory, generation)
+            os.makedirs(path, exist_ok=True)
+
+            store = simulator.transactions
+            sealed = list(store.segments)
+            for segment in range(self.saved_segments, len(sealed)):
+                store.save_segment(segment, _segment_path(self.directory, segment))
+            save_batch(os.path.join(path, "tail.npz"), store.slice(sum(map(len, sealed)), len(store)))
+            save_batch(os.path.join(path, "release.npz"), release.snapshot())
+
+            arrays = {f"report_{name}": value for name, value in simulator.report.state().items()}
+            if simulator.feature_index is not None:
+                arrays.update({f"features_{name}": value for name, value in simulator.feature_index.state().items()})
+            _save_npz(os.path.join(path, "state.npz"), arrays)
+
+            state = {
+                "version": CHECKPOINT_VERSION,
+                "generation": generation,
+                "run": run,
+                "cursor": list(cursor),
+                "done": done,
+                "rows": len(simulator.report),
+                "segments": len(sealed),
+                "exporter": exporter.checkpoint() if exporter else None,
+                "complete": complete,
+                "interval_seconds": self.interval_seconds,
+                "updated_at": datetime.now(timezone.utc).isoformat(),
+            }
+            tmp_path = os.path.join(self.directory, STATE_FILE + ".tmp")
+            with open(tmp_path, "w") as f:
+                json.dump(state, f)
+            os.replace(tmp_path, os.path.join(self.directory, STATE_FILE))
+
+            shutil.rmtree(_generation_dir(self.directory, self.generation), ignore_errors=True)
+            self.generation = generation
+            self.saved_segments = len(sealed)
+            self._last = time.monotonic()
+            timer.rows = len(simulator.report)
+        logger.info(f"Checkpointed {state['rows']} rows to {self.directory} (hour index {cursor[0]}, block {cursor[1]})")
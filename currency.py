@@ -0,0 +1,88 @@
+from dataclasses import dataclass
+from typing import Dict, Any, Optional, Tuple
+
+import numpy as np
+
+from models import CURRENCIES
+
+CURRENCY_INDEX = {currency: i for i, currency in enumerate(CURRENCIES)}
+
+# Currency the generators draw amounts in, whatever a run's base currency
+MODEL_CURRENCY = "USD"
+
+# Units of each currency one US dollar buys; the default table, rebased for other base currencies
+DEFAULT_FX_RATES: Dict[str, float] = {
+    "USD": 1.0, "EUR": 0.92, "GBP": 0.79, "NGN": 1500.0, "KES": 130.0, "GHS": 15.0, "ZAR": 18.5, "EGP": 48.0,
+    "CDF": 2800.0, "MAD": 10.0, "ETB": 57.0, "TZS": 2600.0, "XOF": 605.0, "JPY": 150.0, "AUD": 1.52,
+    "SGD": 1.35, "AED": 3.6725, "BRL": 5.0, "INR": 83.0, "MXN": 17.0, "RUB": 92.0, "THB": 36.0, "KRW": 1350.0,
+    "IDR": 15700.0, "TRY": 32.0, "ARS": 850.0, "CAD": 1.36, "HKD": 7.82,
+}
+
+# Decimal places of currencies not counted in cents
+MINOR_UNITS = {"JPY": 0, "KRW": 0, "XOF": 0}
+
+# Currency code -> minor units per unit, for rounding converted amounts
+_MINOR_SCALE = np.array([10.0 ** MINOR_UNITS.get(currency, 2) for currency in CURRENCIES])
+
+@dataclass(frozen=True)
+class FxRates:
+    """FX rate table between a base currency and every currency of models.CURRENCIES.
+
+    `rates[c]` is how many units of the currency with code c one unit of
+    `base` buys. Conversions take whole columns of amounts and currency
+    codes and look the rates up by code, so converting a batch is a gather
+    and a multiply; results are rounded to the target currency's minor
+    units. Generated amounts are in MODEL_CURRENCY and priced from it into
+    both the row's and the base currency, so the base only sets the unit
+    base amounts are counted in.
+    """
+    base: str
+    rates: np.ndarray
+
+    @classmethod
+    def from_dict(cls, spec: Optional[Dict[str, Any]] = None) -> "FxRates":
+        """Table for a run's FX spec; the default rates, quoted per USD, without one
+
+        e.g. {"base": "EUR", "rates": {"NGN": 1650}}: the default rates are
+        rebased to `base`, then the given ones, quoted per unit of `base`,
+        replace them. The base's own rate, if given, must be 1.
+        """
+        spec = spec or {}
+        base = spec.get("base", "USD")
+        if base not in CURRENCY_INDEX:
+            raise ValueError(f"Unsupported base currency: {base}")
+        rates = np.array([DEFAULT_FX_RATES[currency] for currency in CURRENCIES]) / DEFAULT_FX_RATES[base]
+        for currency, rate in (spec.get("rates") or {}).items():
+            if currency not in CURRENCY_INDEX:
+                raise ValueError(f"Unsupported currency: {currency}")
+            if not float(rate) > 0:
+                raise ValueError(f"FX rates must be positive, got {rate} for {currency}")
+            if currency == base and float(rate) != 1.0:
+                raise ValueError(f"Rates are quoted per {base}, so its own rate must be 1, got {rate}")
+            rates[CURRENCY_INDEX[currency]] = float(rate)
+        rates[CURRENCY_INDEX[base]] = 1.0
+        return cls(base, rates)
+
+    @property
+    def model_rate(self) -> float:
+        """Units of the base currency one MODEL_CURRENCY unit buys"""
+        return 1.0 / self.rates[CURRENCY_INDEX[MODEL_CURRENCY]]
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"base": self.base, "rates": dict(zip(CURRENCIES, self.rates.tolist()))}
+
+    def convert(self, amounts: np.ndarray, source, target) -> np.ndarray:
+        """`amounts` in the currencies with codes `source` converted to those with codes `target`
+
+        Either may be a single code shared by every amount.
+        """
+        scale = _MINOR_SCALE[target]
+        rate = self.rates[target] / self.rates[source]
+        return np.round(np.asarray(amounts, dtype=np.float64) * rate * scale) / scale
+
+    def price(self, amounts: np.ndarray, currencies) -> Tuple[np.ndarray, np.ndarray]:
+        """MODEL_CURRENCY `amounts` as (amounts in the currencies with codes `currencies`, in the base currency)"""
+        model = CURRENCY_INDEX[MODEL_CURRENCY]
+        return self.convert(amounts, model, currencies), self.convert(amounts, model, CURRENCY_INDEX[self.base])
+
+DEFAULT_RATES = FxRates.from_dict()
@@ -0,0 +1,178 @@
+import logging
+import os
+import shutil
+import tempfile
+from collections.abc import Mapping, Sequence
+from dataclasses import dataclass, fields
+from typing import Dict, List, Any, Optional
+
+import numpy as np
+from faker import Faker
+
+from models import (
+    BROWSERS, OS_LIST, MERCHANT_CATEGORIES, TRANSACTION_CATEGORIES, MOBILE_MONEY_AGENT_COUNTRIES,
+    merchant_id, merchant_index,
+)
+from batch_engine import format_device
+from seeding import derive, numpy_stream, DEVICES, MERCHANTS
+
+logger = logging.getLogger(__name__)
+
+# Bump when the pool layout or the way pools are drawn changes, to orphan old caches
+POOL_CACHE_VERSION = 1
+
+RISK_LEVELS = ["low", "medium", "high"]
+MOBILE_MONEY_AGENT = TRANSACTION_CATEGORIES.index("mobile_money_agent")
+
+@dataclass
+class DataPools:
+    """Device and merchant pools as compact arrays.
+
+    `device_codes` holds packed fingerprints (see batch_engine.parse_device);
+    merchant i has category code `merchant_category[i]`, location index
+    `merchant_city[i]` and risk level index `merchant_risk[i]`.
+    """
+    device_codes: np.ndarray
+    merchant_category: np.ndarray
+    merchant_city: np.ndarray
+    merchant_risk: np.ndarray
+
+    @classmethod
+    def build(cls, seed_sequence: np.random.SeedSequence, num_devices: int, num_merchants: int,
+              locations: List[Dict]) -> "DataPools":
+        """Draw the pools from the simulator's device and merchant streams"""
+        rng = numpy_stream(seed_sequence, DEVICES)
+        browser = rng.integers(0, len(BROWSERS), num_devices, dtype=np.uint64)
+        os_name = rng.integers(0, len(OS_LIST), num_devices, dtype=np.uint64)
+        tag = rng.integers(0, 1 << 32, num_devices, dtype=np.uint64)
+        device_codes = (browser << np.uint64(35)) | (os_name << np.uint64(32)) | tag
+
+        rng = numpy_stream(seed_sequence, MERCHANTS)
+        merchant_city = rng.integers(0, len(locations), num_merchants, dtype=np.int16)
+        # Mobile money agents more common in African cities: 5 extra shares of 26
+        agent_city = np.array([loc["country"] in MOBILE_MONEY_AGENT_COUNTRIES for loc in locations])
+        agent_merchant = agent_city[merchant_city]
+        draw = rng.random(num_merchants)
+        choices = np.where(agent_merchant, len(MERCHANT_CATEGORIES) + 5, len(MERCHANT_CATEGORIES))
+        category = (draw * choices).astype(np.int8)
+        category[category >= len(MERCHANT_CATEGORIES)] = MOBILE_MONEY_AGENT
+        merchant_risk = rng.integers(0, len(RISK_LEVELS), num_merchants, dtype=np.int8)
+
+        return cls(device_codes, category, merchant_city, merchant_risk)
+
+    def save(self, path: str):
+        save_arrays(self, path)
+
+    @classmethod
+    def load(cls, path: str) -> "DataPools":
+        return load_arrays(cls, path)
+
+def save_arrays(bundle, path: str):
+    """Write the array fields of a dataclass as .npy files in a new directory `path`, atomically"""
+    parent = os.path.dirname(os.path.abspath(path))
+    os.makedirs(parent, exist_ok=True)
+    tmp = tempfile.mkdtemp(prefix=".pools-", dir=parent)
+    for f in fields(bundle):
+        np.save(os.path.join(tmp, f"{f.name}.npy"), getattr(bundle, f.name))
+    try:
+        os.rename(tmp, path)
+    except OSError:
+        # Another process cached the same arrays first; theirs are identical
+        shutil.rmtree(tmp, ignore_errors=True)
+
+def load_arrays(cls, path: str):
+    """Memory-map arrays written by save_arrays read-only, sharing pages between processes"""
+    return cls(**{f.name: np.load(os.path.join(path, f"{f.name}.npy"), mmap_mode="r") for f in fields(cls)})
+
+def pool_cache_path(cache_dir: str, seed: int, num_devices: int, num_merchants: int, num_cities: int) -> str:
+    return os.path.join(cache_dir, f"pools-v{POOL_CACHE_VERSION}-{seed}-{num_devices}-{num_merchants}-{num_cities}")
+
+def load_or_build_pools(seed: int, seed_sequence: np.random.SeedSequence, num_devices: int, num_merchants: int,
+                        locations: List[Dict], cache_dir: Optional[str] = None) -> DataPools:
+    """Pools for a seed and sizes, from `cache_dir` when it already holds them"""
+    if not cache_dir:
+        return DataPools.build(seed_sequence, num_devices, num_merchants, locations)
+
+    path = pool_cache_path(cache_dir, seed, num_devices, num_merchants, len(locations))
+    if not os.path.isdir(path):
+        logger.info(f"Building data pools into {path}")
+        DataPools.build(seed_sequence, num_devices, num_merchants, locations).save(path)
+    return DataPools.load(path)
+
+class DeviceFingerprints(Sequence):
+    """The device pool as a list of fingerprint strings, formatted on access"""
+
+    def __init__(self, codes: np.ndarray):
+        self.codes = codes
+
+    def __len__(self) -> int:
+        return len(self.codes)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [format_device(int(code)) for code in self.codes[index]]
+        return format_device(int(self.codes[index]))
+
+class MerchantIds(Sequence):
+    """merchant_0000 ... merchant_{n-1}, without materializing the strings"""
+
+    def __init__(self, count: int):
+        self.count = count
+
+    def __len__(self) -> int:
+        return self.count
+
+    def take(self, indices: np.ndarray) -> List[str]:
+        return [f"merchant_{i:04d}" for i in indices.tolist()]
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [merchant_id(i) for i in range(*index.indices(self.count))]
+        if index < 0:
+            index += self.count
+        if not 0 <= index < self.count:
+            raise IndexError("merchant index out of range")
+        return merchant_id(index)
+
+class MerchantDirectory(Mapping):
+    """merchant_id -> merchant dict, built on first access.
+
+    Company names come from a Faker seeded per merchant, so a merchant's name
+    does not depend on which other merchants were looked up before it.
+    """
+
+    def __init__(self, pools: DataPools, locations: List[Dict], seed_sequence: np.random.SeedSequence):
+        self.pools = pools
+        self.locations = locations
+        self.seed_sequence = seed_sequence
+        self.ids = MerchantIds(len(pools.merchant_category))
+        self._faker = Faker()
+        self._cache: Dict[str, Dict[str, Any]] = {}
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def __iter__(self):
+        return iter(self.ids)
+
+    def __contains__(self, key) -> bool:
+        try:
+            return 0 <= merchant_index(key) < len(self.ids) and merchant_id(merchant_index(key)) == key
+        except (TypeError, ValueError):
+            return False
+
+    def __getitem__(self, key: str) -> Dict[str, Any]:
+        merchant = self._cache.get(key)
+        if merchant is None:
+            if key not in self:
+                raise KeyError(key)
+            i = merchant_index(key)
+            self._faker.seed_instance(int(derive(self.seed_sequence, MERCHANTS, i).generate_state(1)[0]))
+            merchant = {
+                "name": self._faker.company(),
+                "category": TRANSACTION_CATEGORIES[self.pools.merchant_category[i]],
+                "risk_level": RISK_LEVELS[self.pools.merchant_risk[i]],
+                "location": self.locations[self.pools.merchant_city[i]]
+            }
+            self._cache[key] = merchant
+        return merchant
@@ -0,0 +1,294 @@
+import csv
+import gzip
+import io
+import json
+import logging
+import os
+from dataclasses import fields
+from datetime import datetime, timezone
+from typing import Dict, List, Any, Optional
+
+import numpy as np
+
+from models import Transaction, FRAUD_PATTERN_CODES
+from batch_engine import TransactionBatch, COLUMN_DTYPES
+
+logger = logging.getLogger(__name__)
+
+EXPORT_FORMATS = ["ndjson", "csv", "parquet"]
+EXPORT_COMPRESSIONS = [None, "gzip", "zstd"]
+
+FILE_EXTENSIONS = {"ndjson": ".ndjson", "csv": ".csv", "parquet": ".parquet"}
+COMPRESSION_EXTENSIONS = {None: "", "gzip": ".gz", "zstd": ".zst"}
+
+# CSV and Parquet rows are flat, so the nested location and features dicts become columns
+LOCATION_FIELDS = ["city", "country", "lat", "lon", "timezone"]
+
+def flatten_columns(columns: Dict[str, list]) -> Dict[str, list]:
+    """Replace the `location` and `features` columns by one column per field"""
+    flat = {}
+    for name, values in columns.items():
+        if name == "location":
+            for field in LOCATION_FIELDS:
+                flat[f"location_{field}"] = [location[field] for location in values]
+        elif name == "features":
+            for field in values[0] if values else ():
+                flat[f"features_{field}"] = [features[field] for features in values]
+        else:
+            flat[name] = values
+    return flat
+
+# Decoded columns holding a stored column's values as they are; other non-location fields are strings
+RAW_COLUMNS = ["amount", "amount_base", "risk_score"]
+
+def parquet_schema(feature_dtypes: Optional[Dict[str, type]] = None):
+    """Arrow schema of flattened rows, in Transaction field order
+
+    Fixed up front rather than inferred from the first chunk, where a column
+    that happens to be all None (fraud_pattern, in a chunk without fraud)
+    would get the null type and clash with later chunks.
+    """
+    import pyarrow as pa
+    columns = []
+    for field in fields(Transaction):
+        if field.name == "location":
+            columns += [(f"location_{name}", pa.float64() if name in ("lat", "lon") else pa.string())
+                        for name in LOCATION_FIELDS]
+        elif field.name == "features":
+            columns += [(f"features_{name}", pa.from_numpy_dtype(np.dtype(dtype)))
+                        for name, dtype in (feature_dtypes or {}).items()]
+        elif field.name == "is_synthetic":
+            columns.append((field.name, pa.bool_()))
+        elif field.name in RAW_COLUMNS:
+            columns.append((field.name, pa.from_numpy_dtype(np.dtype(COLUMN_DTYPES[field.name]))))
+        else:
+            columns.append((field.name, pa.string()))
+    return pa.schema(columns)
+
+class StreamingExporter:
+    """Write simulation output to rotating files as it is generated.
+
+    Rows are written in chunks of at most `chunk_rows`, and a new file is
+    started every `rows_per_file` rows. For NDJSON and CSV every chunk is
+    compressed as its own gzip member / zstd frame, so the byte offsets in the
+    manifest are valid starting points for a decompressor. For Parquet every
+    chunk is one row group. `manifest.json` is rewritten each time a file is
+    closed, so a partial run still describes what is on disk.
+
+    checkpoint() closes the current file and returns the exporter's state;
+    from_checkpoint() rebuilds an exporter continuing after the files it
+    lists.
+    """
+
+    def __init__(self, output_dir: str, format: str = "ndjson", compression: Optional[str] = None,
+                 rows_per_file: int = 1_000_000, chunk_rows: int = 50_000):
+        if format not in EXPORT_FORMATS:
+            raise ValueError(f"Unsupported export format: {format}")
+        if compression not in EXPORT_COMPRESSIONS:
+            raise ValueError(f"Unsupported export compression: {compression}")
+        if format != "parquet" and compression == "zstd":
+            _require("zstandard", "zstd compression")
+        if format == "parquet":
+            _require("pyarrow", "Parquet export")
+
+        self.output_dir = output_dir
+        self.format = format
+        self.compression = compression
+        self.rows_per_file = rows_per_file
+        self.chunk_rows = chunk_rows
+        self.store = None
+        self.files: List[Dict[str, Any]] = []
+        self.total_rows = 0
+        self.fraud_counts = np.zeros(len(FRAUD_PATTERN_CODES), dtype=np.int64)
+        self._counts = np.zeros(len(FRAUD_PATTERN_CODES), dtype=np.int64)
+        self._file = None
+        self._writer = None
+        self._schema = None
+        self._current: Optional[Dict[str, Any]] = None
+
+    @property
+    def manifest_path(self) -> str:
+        return os.path.join(self.output_dir, "manifest.json")
+
+    def start(self, store):
+        """Begin an export decoding rows against `store`'s lookup tables"""
+        os.makedirs(self.output_dir, exist_ok=True)
+        self.store = store
+        self._schema = None
+        # Parts written after the last checkpoint of an interrupted run are redone
+        listed = {file["path"] for file in self.files}
+        for name in os.listdir(self.output_dir):
+            if name.startswith("part-") and name not in listed:
+                os.remove(os.path.join(self.output_dir, name))
+        logger.info(f"Exporting {self.format} to {self.output_dir}")
+
+    def checkpoint(self) -> Dict[str, Any]:
+        """Close the current file and return the state from_checkpoint() continues from"""
+        if self._current is not None:
+            self._close_file()
+        return {
+            "output_dir": self.output_dir,
+            "format": self.format,
+            "compression": self.compression,
+            "rows_per_file": self.rows_per_file,
+            "chunk_rows": self.chunk_rows,
+            "files": self.files,
+            "total_rows": self.total_rows,
+            "fraud_counts": self.fraud_counts.tolist(),
+        }
+
+    @classmethod
+    def from_checkpoint(cls, state: Dict[str, Any]) -> "StreamingExporter":
+        exporter = cls(state["output_dir"], format=state["format"], compression=state["compression"],
+                       rows_per_file=state["rows_per_file"], chunk_rows=state["chunk_rows"])
+        exporter.files = list(state["files"])
+        exporter.total_rows = state["total_rows"]
+        exporter.fraud_counts = np.array(state["fraud_counts"], dtype=np.int64)
+        return exporter
+
+    def write(self, batch: TransactionBatch):
+        """Append a generated batch, rotating files as they fill up"""
+        start = 0
+        while start < len(batch):
+            if self._current is None:
+                self._open_file()
+            room = self.rows_per_file - self._current["rows"]
+            stop = start + min(self.chunk_rows, room, len(batch) - start)
+            self._write_chunk(batch.take(slice(start, stop)))
+            start = stop
+            if self._current["rows"] >= self.rows_per_file:
+                self._close_file()
+
+    def close(self, complete: bool = True) -> Dict[str, Any]:
+        """Finish the current file and write the final manifest
+
+        Runs stopped before their last hour pass `complete=False`, so the
+        manifest does not present a truncated export as the whole run.
+        """
+        if self._current is not None:
+            self._close_file()
+        return self._write_manifest(complete=complete)
+
+    def abort(self):
+        """Drop the file being written, for a failed run
+
+        The manifest is left as the last closed file wrote it, listing the
+        files written so far as an incomplete export.
+        """
+        if self._current is None:
+            return
+        try:
+            if self._writer is not None:
+                self._writer.close()
+            if self._file is not None:
+                self._file.close()
+        finally:
+            self._writer = self._file = None
+            path = os.path.join(self.output_dir, self._current["path"])
+            self._current = None
+            if os.path.exists(path):
+                os.remove(path)
+
+    def _open_file(self):
+        name = f"part-{len(self.files):05d}{FILE_EXTENSIONS[self.format]}"
+        if self.format != "parquet":
+            name += COMPRESSION_EXTENSIONS[self.compression]
+        path = os.path.join(self.output_dir, name)
+        self._current = {
+            "path": name,
+            "row_offset": self.total_rows,
+            "rows": 0,
+            "bytes": 0,
+            "fraud_counts": {},
+            "chunks": [],
+        }
+        self._counts = np.zeros(len(FRAUD_PATTERN_CODES), dtype=np.int64)
+        if self.format != "parquet":
+            self._file = open(path, "wb")
+
+    def _write_chunk(self, batch: TransactionBatch):
+        chunk = {"row_offset": self.total_rows, "rows": len(batch)}
+
+        if self.format == "parquet":
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+            if self._schema is None:
+                self._schema = parquet_schema(self.store.feature_dtypes)
+            table = pa.table(flatten_columns(self.store.decode_columns(batch)), schema=self._schema)
+            if self._writer is None:
+                path = os.path.join(self.output_dir, self._current["path"])
+                self._writer = pq.ParquetWriter(path, self._schema, compression=self.compression or "none")
+            chunk["row_group"] = len(self._current["chunks"])
+            self._writer.write_table(table)
+        else:
+            data = self._encode_text(batch, header=not self._current["chunks"])
+            chunk["byte_offset"] = self._file.tell()
+            self._file.write(self._compress(data))
+
+        counts = np.bincount(batch.fraud_pattern, minlength=len(FRAUD_PATTERN_CODES))
+        self._counts += counts
+        self.fraud_counts += counts
+        self._current["chunks"].append(chunk)
+        self._current["rows"] += len(batch)
+        self.total_rows += len(batch)
+
+    def _encode_text(self, batch: TransactionBatch, header: bool) -> bytes:
+        if self.format == "ndjson":
+            return ("\n".join(self.store.encoder.json_rows(batch)) + "\n").encode("utf-8")
+
+        flat = flatten_columns(self.store.decode_columns(batch))
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        if header:
+            writer.writerow(flat.keys())
+        writer.writerows(zip(*flat.values()))
+        return buffer.getvalue().encode("utf-8")
+
+    def _compress(self, data: bytes) -> bytes:
+        if self.compression == "gzip":
+            return gzip.compress(data, compresslevel=6)
+        if self.compression == "zstd":
+            import zstandard
+            return zstandard.ZstdCompressor().compress(data)
+        return data
+
+    def _close_file(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        path = os.path.join(self.output_dir, self._current["path"])
+        self._current["bytes"] = os.path.getsize(path)
+        self._current["fraud_counts"] = _pattern_counts(self._counts)
+        self.files.append(self._current)
+        self._current = None
+        self._write_manifest(complete=False)
+
+    def _write_manifest(self, complete: bool) -> Dict[str, Any]:
+        manifest = {
+            "format": self.format,
+            "compression": self.compression,
+            "complete": complete,
+            "updated_at": datetime.now(timezone.utc).isoformat(),
+            "total_rows": self.total_rows,
+            "fraud_counts": _pattern_counts(self.fraud_counts),
+            "files": self.files,
+        }
+        # Write-then-rename so readers never see a half-written manifest
+        tmp_path = self.manifest_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(tmp_path, self.manifest_path)
+        return manifest
+
+def _pattern_counts(counts: np.ndarray) -> Dict[str, int]:
+    """Non-zero fraud counts keyed by pattern name (normal rows excluded)"""
+    return {FRAUD_PATTERN_CODES[i]: int(counts[i]) for i in np.flatnonzero(counts[1:]) + 1}
+
+def _require(module: str, feature: str):
+    try:
+        __import__(module)
+    except ImportError:
+        raise RuntimeError(f"{feature} requires the '{module}' package")
@@ -0,0 +1,243 @@
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from batch_engine import TransactionBatch, HOUR_US
+
+# Velocity windows, in microseconds of simulated time
+FEATURE_WINDOWS = {"1m": 60_000_000, "1h": HOUR_US, "24h": 24 * HOUR_US}
+FEATURE_ENTITIES = ["user", "device", "merchant"]
+HORIZON_US = max(FEATURE_WINDOWS.values())
+
+# Faster than an airliner between two transactions' cities is impossible travel
+IMPOSSIBLE_SPEED_KMH = 900.0
+EARTH_RADIUS_KM = 6371.0
+
+FEATURE_DTYPES = {
+    "prev_gap_seconds": np.float64,
+    "travel_km": np.float64,
+    "travel_speed_kmh": np.float64,
+    "impossible_travel": np.bool_,
+}
+for _entity in FEATURE_ENTITIES:
+    for _window in FEATURE_WINDOWS:
+        FEATURE_DTYPES[f"{_entity}_count_{_window}"] = np.int32
+        FEATURE_DTYPES[f"{_entity}_amount_{_window}"] = np.float64
+
+def distance_matrix(locations: Sequence[Dict]) -> np.ndarray:
+    """Great-circle (haversine) distances in km between every pair of locations"""
+    lat = np.radians([location["lat"] for location in locations])
+    lon = np.radians([location["lon"] for location in locations])
+    dlat = lat[:, None] - lat[None, :]
+    dlon = lon[:, None] - lon[None, :]
+    a = np.sin(dlat / 2) ** 2 + np.cos(lat[:, None]) * np.cos(lat[None, :]) * np.sin(dlon / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+class _Run:
+    """Rows sorted by (entity, timestamp), searchable with one packed int64 key.
+
+    An entity's rank among the run's distinct entities times `stride` plus
+    the row's offset from the run's first timestamp gives a key that sorts
+    like (entity, timestamp), so window bounds for many rows are found with
+    two vectorized searchsorted calls.
+    """
+
+    def __init__(self, entity: np.ndarray, timestamp: np.ndarray, amount: np.ndarray, city: np.ndarray):
+        self.entities = np.unique(entity)
+        self.base = int(timestamp.min()) if len(timestamp) else 0
+        self.stride = int(timestamp.max()) - self.base + 1 if len(timestamp) else 1
+        if len(self.entities) * self.stride >= 1 << 62:
+            raise ValueError("Feature index run spans too many entities and too much time")
+        keys = np.searchsorted(self.entities, entity).astype(np.int64) * self.stride + (timestamp - self.base)
+        # Merged runs are concatenations of sorted runs, which a stable sort merges in linear time
+        order = np.argsort(keys, kind="stable")
+        self.keys = keys[order]
+        self.entity = entity[order]
+        self.timestamp = timestamp[order]
+        self.amount = amount[order]
+        self.city = city[order]
+        self.amount_prefix = np.concatenate([[0.0], np.cumsum(self.amount)])
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def _group(self, entity: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        rank = np.searchsorted(self.entities, entity)
+        found = rank < len(self.entities)
+        found[found] = self.entities[rank[found]] == entity[found]
+        return rank.astype(np.int64), found
+
+    def window(self, entity: np.ndarray, low: np.ndarray, high: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Count and amount sum of each entity's rows with low < timestamp <= high"""
+        rank, found = self._group(entity)
+        low_rel = np.clip(low - self.base + 1, 0, self.stride)
+        high_rel = np.clip(high - self.base, -1, self.stride - 1)
+        left = np.searchsorted(self.keys, rank * self.stride + low_rel, side="left")
+        right = np.searchsorted(self.keys, rank * self.stride + high_rel, side="right")
+        right = np.where(found, np.maximum(right, left), left)
+        return right - left, self.amount_prefix[right] - self.amount_prefix[left]
+
+    def previous(self, entity: np.ndarray, before: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Timestamp and city of each entity's last row strictly before `before` (timestamp -1 if none)"""
+        rank, found = self._group(entity)
+        high_rel = np.clip(before - 1 - self.base, -1, self.stride - 1)
+        pos = np.searchsorted(self.keys, rank * self.stride + high_rel, side="right") - 1
+        valid = found & (pos >= 0)
+        valid[valid] = self.keys[pos[valid]] >= rank[valid] * self.stride
+        timestamp = np.where(valid, self.timestamp[np.maximum(pos, 0)], -1)
+        city = np.where(valid, self.city[np.maximum(pos, 0)], -1)
+        return timestamp, city
+
+    def expire(self, cutoff: int) -> "_Run":
+        keep = self.timestamp > cutoff
+        return _Run(self.entity[keep], self.timestamp[keep], self.amount[keep], self.city[keep])
+
+    @staticmethod
+    def merge(runs: List["_Run"], cutoff: int) -> "_Run":
+        """One run holding the rows of `runs` newer than `cutoff`"""
+        merged = _Run(*(np.concatenate([getattr(run, name) for run in runs])
+                        for name in ("entity", "timestamp", "amount", "city")))
+        return merged.expire(cutoff) if len(merged) and merged.timestamp.min() <= cutoff else merged
+
+class WindowIndex:
+    """Time-windowed history of one entity type as a log-structured set of sorted runs.
+
+    Each added batch becomes a run; runs of similar size are merged, so there
+    are O(log n) runs and every query costs O(log n) per run. Rows older
+    than the horizon are dropped when runs merge, bounding memory to about a
+    horizon's worth of rows.
+    """
+
+    def __init__(self, horizon_us: int = HORIZON_US):
+        self.horizon_us = horizon_us
+        self.runs: List[_Run] = []
+
+    def add(self, entity: np.ndarray, timestamp: np.ndarray, amount: np.ndarray, city: np.ndarray,
+            watermark: int):
+        cutoff = watermark - self.horizon_us
+        self.runs = [run for run in self.runs if len(run) and run.timestamp.max() > cutoff]
+        self.runs.append(_Run(entity, timestamp, amount, city))
+        while len(self.runs) > 1 and len(self.runs[-2]) <= 2 * len(self.runs[-1]):
+            self.runs[-2:] = [_Run.merge(self.runs[-2:], cutoff)]
+
+    def window(self, entity: np.ndarray, low: np.ndarray, high: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        counts = np.zeros(len(entity), dtype=np.int64)
+        amounts = np.zeros(len(entity))
+        for run in self.runs:
+            run_counts, run_amounts = run.window(entity, low, high)
+            counts += run_counts
+            amounts += run_amounts
+        return counts, amounts
+
+    def previous(self, entity: np.ndarray, before: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        timestamp = np.full(len(entity), -1, dtype=np.int64)
+        city = np.full(len(entity), -1, dtype=np.int64)
+        for run in self.runs:
+            run_timestamp, run_city = run.previous(entity, before)
+            later = run_timestamp > timestamp
+            timestamp[later] = run_timestamp[later]
+            city[later] = run_city[later]
+        return timestamp, city
+
+    @property
+    def nbytes(self) -> int:
+        return sum(run.keys.nbytes * 5 for run in self.runs)
+
+class FeatureIndex:
+    """Labelled velocity and impossible-travel features for generated rows.
+
+    update() adds a batch to per-user, per-device and per-merchant window
+    indexes and returns, for every row of the batch:
+
+    - `{entity}_count_{window}` / `{entity}_amount_{window}`: transactions
+      and base-currency amount of the same user, device or merchant in the trailing 1m,
+      1h and 24h windows, the row itself included
+    - `prev_gap_seconds`, `travel_km`, `travel_speed_kmh`: time since the
+      user's previous transaction within 24h (-1 if none), great-circle
+      distance between the two cities and the implied speed
+    - `impossible_travel`: that speed exceeds IMPOSSIBLE_SPEED_KMH
+
+    Features count the rows added so far. Callers must therefore feed
+    batches in non-decreasing timestamp order: no row may be older than a
+    row of an earlier batch, and update() refuses a batch that is. Rows
+    within a batch may come in any order. Both the single-process and the
+    sharded runs emit rows in timestamp order.
+    """
+
+    def __init__(self, locations: Sequence[Dict], horizon_us: int = HORIZON_US):
+        self.distances = distance_matrix(locations) if len(locations) else np.zeros((0, 0))
+        self.horizon_us = horizon_us
+        self.indexes = {entity: WindowIndex(horizon_us) for entity in FEATURE_ENTITIES}
+        self.watermark: Optional[int] = None
+        # Newest timestamp indexed so far
+        self.latest: Optional[int] = None
+
+    def update(self, batch: TransactionBatch) -> Dict[str, np.ndarray]:
+        features = {}
+        if not len(batch):
+            return {name: np.empty(0, dtype=dtype) for name, dtype in FEATURE_DTYPES.items()}
+        ts = batch.timestamp_us
+        batch_start = int(ts.min())
+        if self.latest is not None and batch_start < self.latest:
+            raise ValueError(f"Feature batches must arrive in timestamp order: a row at {batch_start} "
+                             f"follows one at {self.latest}")
+        self.latest = int(ts.max()) if self.latest is None else max(self.latest, int(ts.max()))
+        self.watermark = batch_start if self.watermark is None else max(self.watermark, batch_start)
+
+        city = batch.city.astype(np.int64)
+        amount = batch.amount_base
+        for entity in FEATURE_ENTITIES:
+            index = self.indexes[entity]
+            values = getattr(batch, entity)
+            index.add(values, ts, amount, city, self.watermark)
+            # Queries in (entity, timestamp) order make searchsorted walk the runs sequentially
+            order = np.lexsort((ts, values))
+            for window, length in FEATURE_WINDOWS.items():
+                counts, amounts = index.window(values[order], ts[order] - length, ts[order])
+                features[f"{entity}_count_{window}"] = np.empty(len(batch), dtype=np.int32)
+                features[f"{entity}_count_{window}"][order] = counts
+                features[f"{entity}_amount_{window}"] = np.empty(len(batch))
+                features[f"{entity}_amount_{window}"][order] = np.round(amounts, 2)
+
+        # The previous row may sit in this same batch, so look again now it is indexed
+        previous_ts, previous_city = self.indexes["user"].previous(batch.user, ts)
+        # Expired rows linger until their run is merged away
+        has_previous = (previous_ts >= 0) & (previous_ts > ts - self.horizon_us)
+        gap_us = np.where(has_previous, ts - previous_ts, -1)
+        km = np.zeros(len(batch))
+        km[has_previous] = self.distances[previous_city[has_previous], city[has_previous]]
+        hours = np.maximum(gap_us, 1_000_000) / HOUR_US  # at least one second apart
+        speed = np.where(has_previous, km / hours, 0)
+
+        features["prev_gap_seconds"] = np.where(has_previous, gap_us / 1e6, -1.0)
+        features["travel_km"] = np.round(km, 1)
+        features["travel_speed_kmh"] = np.round(speed, 1)
+        features["impossible_travel"] = speed > IMPOSSIBLE_SPEED_KMH
+        return {name: features[name].astype(dtype, copy=False) for name, dtype in FEATURE_DTYPES.items()}
+
+    def state(self) -> Dict[str, np.ndarray]:
+        """The indexed rows as arrays, run by run, for checkpoints"""
+        state = {"watermark": np.array([-1 if self.watermark is None else self.watermark], dtype=np.int64)}
+        for entity, index in self.indexes.items():
+            state[f"{entity}_runs"] = np.array([len(run) for run in index.runs], dtype=np.int64)
+            for name in ("entity", "timestamp", "amount", "city"):
+                parts = [getattr(run, name) for run in index.runs]
+                state[f"{entity}_{name}"] = np.concatenate(parts) if parts else np.empty(0)
+        return state
+
+    def restore(self, state: Dict[str, np.ndarray]):
+        """Continue from rows saved by state(), with the same runs, so features come out identical"""
+        watermark = int(state["watermark"][0])
+        self.watermark = None if watermark < 0 else watermark
+        for entity, index in self.indexes.items():
+            bounds = np.concatenate([[0], np.cumsum(state[f"{entity}_runs"])])
+            columns = [state[f"{entity}_{name}"] for name in ("entity", "timestamp", "amount", "city")]
+            index.runs = [_Run(*(column[start:stop] for column in columns))
+                          for start, stop in zip(bounds[:-1], bounds[1:])]
+        # Rows within the horizon are never dropped, so the newest one is still indexed
+        latest = [int(run.timestamp.max()) for index in self.indexes.values() for run in index.runs if len(run)]
+        self.latest = max(latest) if latest else None
+
+    @property
+    def nbytes(self) -> int:
+        return sum(index.nbytes for index in self.indexes.values())
@@ -0,0 +1,81 @@
+import ipaddress
+import random
+from typing import Dict, List, Sequence
+
+import numpy as np
+
+# Public IPv4 space as produced by Faker.ipv4(): classes A-C, skipping 0.0.0.0/8
+IP_LOW = 0x01000000
+IP_HIGH = 0xE0000000
+
+# Representative address blocks allocated to ISPs in each country. Rows get an
+# IP from the blocks of their location's country; countries not listed draw
+# from the whole public space.
+COUNTRY_IP_BLOCKS: Dict[str, List[str]] = {
+    "Nigeria": ["105.112.0.0/12", "102.88.0.0/13", "197.210.0.0/16"],
+    "Egypt": ["41.32.0.0/12", "197.32.0.0/11"],
+    "DRC": ["41.243.0.0/16", "197.157.192.0/18"],
+    "South Africa": ["41.0.0.0/11", "105.224.0.0/11"],
+    "Kenya": ["41.80.0.0/12", "105.48.0.0/12"],
+    "Morocco": ["105.128.0.0/11", "41.248.0.0/13"],
+    "Ethiopia": ["196.188.0.0/14", "197.156.64.0/18"],
+    "Tanzania": ["41.59.0.0/16", "197.250.0.0/15"],
+    "Ghana": ["154.160.0.0/13", "41.66.192.0/18"],
+    "Ivory Coast": ["160.154.0.0/15", "102.136.0.0/14"],
+    "US": ["3.0.0.0/8", "24.0.0.0/8", "66.0.0.0/8"],
+    "UK": ["2.24.0.0/13", "81.128.0.0/11", "86.128.0.0/10"],
+    "Japan": ["126.0.0.0/8", "133.0.0.0/8", "153.128.0.0/9"],
+    "Australia": ["1.120.0.0/13", "101.160.0.0/11", "49.176.0.0/12"],
+    "Germany": ["79.192.0.0/10", "84.128.0.0/10", "91.0.0.0/10"],
+    "Singapore": ["116.86.0.0/15", "175.156.0.0/14", "42.60.0.0/15"],
+    "UAE": ["94.200.0.0/13", "86.96.0.0/13", "2.48.0.0/14"],
+    "Brazil": ["177.0.0.0/8", "179.208.0.0/12", "191.0.0.0/9"],
+    "India": ["49.32.0.0/11", "106.192.0.0/11", "117.192.0.0/10"],
+    "Mexico": ["187.128.0.0/10", "189.128.0.0/10", "201.96.0.0/11"],
+    "Russia": ["95.24.0.0/13", "178.64.0.0/11", "188.32.0.0/11"],
+    "France": ["2.0.0.0/12", "90.0.0.0/9", "86.192.0.0/10"],
+    "Thailand": ["1.46.0.0/15", "171.96.0.0/11", "49.228.0.0/14"],
+    "South Korea": ["175.192.0.0/10", "211.32.0.0/11", "121.128.0.0/10"],
+    "Indonesia": ["36.64.0.0/11", "114.120.0.0/13", "180.240.0.0/12"],
+    "Turkey": ["78.160.0.0/11", "88.224.0.0/11", "85.96.0.0/12"],
+    "Argentina": ["181.0.0.0/12", "190.16.0.0/12"],
+    "Canada": ["99.224.0.0/11", "142.160.0.0/12", "174.88.0.0/13"],
+    "Hong Kong": ["42.2.0.0/15", "112.118.0.0/15", "219.76.0.0/14"],
+    "Spain": ["79.144.0.0/12", "83.32.0.0/11", "88.0.0.0/11"],
+}
+
+class IpBlocks:
+    """Country-aware IPv4 sampler over the blocks of each location's country.
+
+    The blocks of all locations are laid end to end in one address space,
+    location by location, so drawing an address for many rows is one random
+    offset into each row's location range plus one searchsorted.
+    """
+
+    def __init__(self, locations: Sequence[Dict]):
+        starts, sizes = [], []
+        self.location_first = np.zeros(len(locations), dtype=np.int64)
+        self.location_size = np.zeros(len(locations), dtype=np.int64)
+        for i, location in enumerate(locations):
+            networks = [ipaddress.ip_network(block) for block in COUNTRY_IP_BLOCKS.get(location["country"], [])]
+            blocks = [(int(net.network_address), net.num_addresses) for net in networks] or [(IP_LOW, IP_HIGH - IP_LOW)]
+            self.location_first[i] = sum(sizes)
+            self.location_size[i] = sum(size for _, size in blocks)
+            starts += [start for start, _ in blocks]
+            sizes += [size for _, size in blocks]
+        self.block_start = np.array(starts, dtype=np.int64)
+        self.block_end = np.cumsum(np.array(sizes, dtype=np.int64))
+        self.block_first = self.block_end - sizes
+
+    def sample(self, rng: np.random.Generator, cities: np.ndarray) -> np.ndarray:
+        """One uniformly random address from the blocks of each row's city"""
+        cities = cities.astype(np.int64)
+        position = self.location_first[cities] + (rng.random(len(cities)) * self.location_size[cities]).astype(np.int64)
+        block = np.searchsorted(self.block_end, position, side="right")
+        return (self.block_start[block] + position - self.block_first[block]).astype(np.uint32)
+
+    def random_address(self, rng: random.Random, city: int) -> int:
+        """Scalar sample() for the per-row generators"""
+        position = int(self.location_first[city]) + rng.randrange(int(self.location_size[city]))
+        block = int(np.searchsorted(self.block_end, position, side="right"))
+        return int(self.block_start[block] + position - self.block_first[block])
@@ -0,0 +1,336 @@
+import logging
+import multiprocessing as mp
+import os
+import queue
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Any, Optional
+
+from live_stream import LiveStream
+from profiler import SamplingProfiler
+from snapshots import Snapshot, simulator_stats, take_snapshot
+
+logger = logging.getLogger(__name__)
+
+QUEUED = "queued"
+RUNNING = "running"
+COMPLETED = "completed"
+CANCELLED = "cancelled"
+FAILED = "failed"
+
+JOB_STATES = [QUEUED, RUNNING, COMPLETED, CANCELLED, FAILED]
+FINISHED_STATES = [COMPLETED, CANCELLED, FAILED]
+
+# Where JobManager runs simulations: on its own threads, or each in a process of its own
+ISOLATION_MODES = ["thread", "process"]
+
+class QueueFull(Exception):
+    """Raised by JobManager.submit when no more jobs can be admitted"""
+
+class Job:
+    """One simulation run with its own simulator, store and report
+
+    `params` are run_simulation's arguments, or resume_simulation's when
+    `resume` is set. A job run in a separate process has no simulator in
+    this one; its latest snapshot is all the server sees of it.
+    """
+
+    def __init__(self, simulator, params: Dict[str, Any], exporter=None, profile: bool = False,
+                 resume: bool = False, pool_sizes: Optional[Dict[str, Any]] = None):
+        self.job_id = uuid.uuid4().hex[:12]
+        self.simulator = simulator
+        self.params = params
+        self.pool_sizes = pool_sizes or {}
+        self.exporter = exporter
+        self.profile = profile
+        self.resume = resume
+        self.profile_path: Optional[str] = None
+        self.status = QUEUED
+        self.error: Optional[str] = None
+        self.evicted = False
+        self.cancel_requested = False
+        self.created_at = datetime.now(timezone.utc)
+        self.started_at: Optional[datetime] = None
+        self.finished_at: Optional[datetime] = None
+        self.future = None
+        self.snapshot: Optional[Snapshot] = None
+
+    @property
+    def finished(self) -> bool:
+        return self.status in FINISHED_STATES
+
+    @property
+    def isolation(self) -> str:
+        return "thread" if self.simulator is not None else "process"
+
+    @property
+    def stats(self) -> Dict[str, Any]:
+        """The simulator fields of to_dict(), live or from the latest snapshot"""
+        if self.simulator is not None:
+            return simulator_stats(self.simulator)
+        if self.snapshot is not None:
+            return self.snapshot.stats
+        return {"running": False, "progress": 0, "seed": self.params.get("seed"), "total_transactions": 0,
+                "retained_transactions": 0, "memory_bytes": 0, "spilled_bytes": 0}
+
+    @property
+    def nbytes(self) -> int:
+        """Memory held in this process by the job's retained rows"""
+        return self.simulator.transactions.nbytes if self.simulator is not None else 0
+
+    @property
+    def rows_per_second(self) -> float:
+        if self.started_at is None:
+            return 0.0
+        elapsed = ((self.finished_at or datetime.now(timezone.utc)) - self.started_at).total_seconds()
+        return self.stats["total_transactions"] / elapsed if elapsed > 0 else 0.0
+
+    def to_dict(self) -> Dict[str, Any]:
+        stats = self.stats
+        return {
+            "job_id": self.job_id,
+            "status": self.status,
+            "running": stats["running"],
+            "progress": 100 if self.finished else stats["progress"],
+            "seed": stats["seed"],
+            "total_transactions": stats["total_transactions"],
+            "retained_transactions": stats["retained_transactions"],
+            "rows_per_second": round(self.rows_per_second, 1),
+            "memory_bytes": stats["memory_bytes"],
+            "spilled_bytes": stats["spilled_bytes"],
+            "isolation": self.isolation,
+            "evicted": self.evicted,
+            "error": self.error,
+            "created_at": self.created_at.isoformat(),
+            "started_at": self.started_at.isoformat() if self.started_at else None,
+            "finished_at": self.finished_at.isoformat() if self.finished_at else None,
+            "export_manifest": self.exporter.manifest_path if self.exporter else None,
+            "checkpoint": self.params.get("checkpoint_dir"),
+            "resumed": self.resume,
+            "profile": self.profile_path,
+        }
+
+def _execute(simulator, params: Dict[str, Any], exporter, resume: bool, should_stop: Callable[[], bool],
+             publish: Callable[[Snapshot], None], snapshot_interval: float):
+    """Run a job's simulation, publishing snapshots at most every `snapshot_interval` seconds and once it ends"""
+    last = time.monotonic()
+    def on_progress(progress):
+        nonlocal last
+        # A cancel can land before run_simulation has set simulation_running
+        if should_stop():
+            simulator.stop_simulation()
+        if time.monotonic() - last >= snapshot_interval:
+            publish(take_snapshot(simulator))
+            last = time.monotonic()
+    run = simulator.resume_simulation if resume else simulator.run_simulation
+    try:
+        run(exporter=exporter, progress_callback=on_progress, **params)
+    except Exception:
+        simulator.simulation_running = False
+        simulator.stream.finish()
+        raise
+    finally:
+        publish(take_snapshot(simulator))
+
+def _process_main(simulator_factory: Callable[..., Any], pool_sizes: Dict[str, Any], params: Dict[str, Any],
+                  exporter, resume: bool, profile_path: Optional[str], snapshot_interval: float, niceness: int,
+                  messages, stop):
+    """Entry point of a job run in its own process; snapshots and the outcome go back through `messages`"""
+    if niceness and hasattr(os, "nice"):
+        os.nice(niceness)
+    profiler = SamplingProfiler().start() if profile_path else None
+    error = None
+    try:
+        simulator = simulator_factory(**pool_sizes)
+        _execute(simulator, params, exporter, resume, stop.is_set,
+                 lambda snapshot: messages.put(("snapshot", snapshot)), snapshot_interval)
+    except Exception as e:
+        logger.exception("Job process failed")
+        error = str(e)
+    if profiler:
+        profiler.stop().dump(profile_path)
+    messages.put(("done", error))
+
+class JobManager:
+    """Runs simulation jobs on a bounded thread pool.
+
+    Every job gets a fresh simulator from `simulator_factory`, so concurrent
+    jobs share nothing but the (read-only, cached) data pools. At most
+    `max_workers` jobs run at once and at most `max_queued` wait behind them;
+    submit() raises QueueFull beyond that. Once finished jobs hold more than
+    `memory_budget` bytes of retained rows in memory (rows their stores
+    spilled to disk do not count), the oldest ones have their rows
+    dropped (their reports are kept), and only the newest
+    `max_finished_jobs` finished jobs are remembered at all.
+
+    Running jobs publish a Snapshot of their progress and last report page
+    every `snapshot_interval` seconds and when they end, which status and
+    report requests are answered from. With `isolation="process"` each job
+    runs in a spawned process of its own, so generation never competes with
+    request handling for the GIL; the pool thread only relays its snapshots
+    from a queue, and its rows stay in (and end with) that process. Job
+    processes run `process_niceness` below the server's priority, so
+    requests are answered first when they compete for a CPU.
+
+    Jobs submitted with `profile=True` run under a SamplingProfiler and leave
+    a folded-stack profile in `profile_dir`.
+    """
+
+    def __init__(self, simulator_factory: Callable[..., Any], max_workers: int = 2, max_queued: int = 8,
+                 memory_budget: int = 1 << 30, max_finished_jobs: int = 100, profile_dir: str = "profiles",
+                 isolation: str = "thread", snapshot_interval: float = 0.5, process_niceness: int = 10):
+        if isolation not in ISOLATION_MODES:
+            raise ValueError(f"Unsupported job isolation: {isolation}")
+        self.simulator_factory = simulator_factory
+        self.max_workers = max_workers
+        self.max_queued = max_queued
+        self.memory_budget = memory_budget
+        self.max_finished_jobs = max_finished_jobs
+        self.profile_dir = profile_dir
+        self.isolation = isolation
+        self.snapshot_interval = snapshot_interval
+        self.process_niceness = process_niceness
+        self.jobs: Dict[str, Job] = {}
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="simulation-job")
+        self._lock = threading.Lock()
+        # Live stream subscribers waiting for the next job to be submitted
+        self.pending_stream = LiveStream()
+
+    def submit(self, params: Dict[str, Any], exporter=None, pool_sizes: Optional[Dict[str, Any]] = None,
+               profile: bool = False, resume: bool = False) -> Job:
+        """Queue a run_simulation (or, with `resume`, resume_simulation) call with `params` on a new simulator"""
+        with self._lock:
+            queued = sum(1 for job in self.jobs.values() if job.status == QUEUED)
+            if queued >= self.max_queued:
+                raise QueueFull(f"Job queue is full ({queued} jobs waiting)")
+            simulator = self.simulator_factory(**(pool_sizes or {})) if self.isolation == "thread" else None
+            job = Job(simulator, params, exporter, profile, resume, pool_sizes)
+            if simulator is not None:
+                job.simulator.stream, self.pending_stream = self.pending_stream, LiveStream()
+            self.jobs[job.job_id] = job
+            job.future = self._executor.submit(self._run, job)
+        logger.info(f"Queued job {job.job_id}")
+        return job
+
+    def _run(self, job: Job):
+        with self._lock:
+            if job.status != QUEUED:
+                return
+            job.status = RUNNING
+            job.started_at = datetime.now(timezone.utc)
+        profile_path = os.path.join(self.profile_dir, f"{job.job_id}.folded") if job.profile else None
+        try:
+            if job.simulator is None:
+                self._run_process(job, profile_path)
+            else:
+                profiler = SamplingProfiler().start() if profile_path else None
+                try:
+                    _execute(job.simulator, job.params, job.exporter, job.resume, lambda: job.cancel_requested,
+                             lambda snapshot: setattr(job, "snapshot", snapshot), self.snapshot_interval)
+                finally:
+                    if profiler:
+                        profiler.stop().dump(profile_path)
+            status = CANCELLED if job.cancel_requested else COMPLETED
+        except Exception as e:
+            logger.exception(f"Job {job.job_id} failed")
+            job.error = str(e)
+            status = FAILED
+        if profile_path and os.path.exists(profile_path):
+            job.profile_path = profile_path
+        with self._lock:
+            job.status = status
+            job.finished_at = datetime.now(timezone.utc)
+            self._enforce_budget()
+
+    def _run_process(self, job: Job, profile_path: Optional[str]):
+        """Run a job in a spawned process, relaying its snapshots until it reports back"""
+        ctx = mp.get_context("spawn")
+        messages = ctx.Queue()
+        stop = ctx.Event()
+        process = ctx.Process(target=_process_main, name=f"simulation-job-{job.job_id}",
+                              args=(self.simulator_factory, job.pool_sizes, job.params, job.exporter, job.resume,
+                                    profile_path, self.snapshot_interval, self.process_niceness, messages, stop))
+        process.start()
+        try:
+            while True:
+                if job.cancel_requested:
+                    stop.set()
+                try:
+                    # Messages can still be in flight when the process is seen to exit
+                    kind, value = messages.get(timeout=0.1 if process.is_alive() else 1.0)
+                except queue.Empty:
+                    if process.is_alive():
+                        continue
+                    raise RuntimeError(f"Job process exited with code {process.exitcode}")
+                if kind == "snapshot":
+                    job.snapshot = value
+                elif value is not None:
+                    raise RuntimeError(value)
+                else:
+                    return
+        finally:
+            process.join()
+
+    def get(self, job_id: str) -> Optional[Job]:
+        return self.jobs.get(job_id)
+
+    def latest(self) -> Optional[Job]:
+        """The most recently submitted job"""
+        with self._lock:
+            return next(reversed(self.jobs.values()), None)
+
+    def list(self) -> List[Job]:
+        with self._lock:
+            return list(self.jobs.values())
+
+    def cancel(self, job_id: str) -> Optional[Job]:
+        """Cancel a queued job, or ask a running one to stop after its current batch"""
+        with self._lock:
+            job = self.jobs.get(job_id)
+            if job is None or job.finished:
+                return job
+            job.cancel_requested = True
+            if job.status == QUEUED:
+                job.status = CANCELLED
+                job.finished_at = datetime.now(timezone.utc)
+                job.future.cancel()
+                if job.simulator is not None:
+                    job.simulator.stream.finish()
+                return job
+        # A job process sees the request at its next progress update
+        if job.simulator is not None:
+            job.simulator.stop_simulation()
+        return job
+
+    def clear(self) -> int:
+        """Forget every finished job and its data; queued and running jobs are untouched"""
+        with self._lock:
+            finished = [job_id for job_id, job in self.jobs.items() if job.finished]
+            for job_id in finished:
+                job = self.jobs.pop(job_id)
+                if job.simulator is not None:
+                    job.simulator.transactions.clear()
+        return len(finished)
+
+    def _enforce_budget(self):
+        """Evict the rows of the oldest finished jobs until they fit the memory budget (lock held)"""
+        finished = sorted((job for job in self.jobs.values() if job.finished), key=lambda job: job.finished_at)
+        for job in finished[:max(len(finished) - self.max_finished_jobs, 0)]:
+            del self.jobs[job.job_id]
+            if job.simulator is not None:
+                job.simulator.transactions.clear()
+            finished.remove(job)
+
+        # Running jobs count against the budget too, but only finished ones can give memory back
+        used = sum(job.nbytes for job in self.jobs.values())
+        for job in finished:
+            if used <= self.memory_budget:
+                break
+            if job.nbytes:
+                used -= job.nbytes
+                job.simulator.transactions.clear()
+                job.evicted = True
+                logger.info(f"Evicted transactions of job {job.job_id} to stay within the memory budget")
@@ -0,0 +1,161 @@
+import json
+import queue
+import threading
+from typing import Callable, Iterable, Iterator, List, Optional
+
+import numpy as np
+
+from models import PAYMENT_METHODS, FRAUD_PATTERN_CODES
+from batch_engine import TransactionBatch
+
+STREAM_FORMATS = ["ndjson", "sse"]
+
+# Filter value selecting non-fraudulent rows (fraud_pattern is null for them)
+NORMAL = "normal"
+
+# Seconds between keep-alives on an idle stream; a write to a closed
+# connection is how a disconnected client gets noticed
+HEARTBEAT_SECONDS = 15
+
+def code_mask(names: Optional[Iterable[str]], vocabulary: List[Optional[str]], field: str) -> np.ndarray:
+    """Boolean lookup table over codes, all True when no names are given"""
+    if not names:
+        return np.ones(len(vocabulary), dtype=bool)
+    mask = np.zeros(len(vocabulary), dtype=bool)
+    for name in names:
+        if field == "fraud_pattern" and name == NORMAL:
+            mask[0] = True
+        elif name and name in vocabulary:
+            mask[vocabulary.index(name)] = True
+        else:
+            raise ValueError(f"Unknown {field}: {name}")
+    return mask
+
+class Subscription:
+    """One live stream consumer: a filter plus a bounded queue of micro-batches.
+
+    The queue holds at most `max_pending` micro-batches of up to `batch_rows`
+    rows each. Once it is full, LiveStream.publish blocks the generating
+    thread until the consumer catches up, so a slow client slows the
+    simulation down instead of growing a buffer.
+    """
+
+    def __init__(self, fraud_patterns: Optional[Iterable[str]] = None,
+                 payment_methods: Optional[Iterable[str]] = None,
+                 batch_rows: int = 500, max_pending: int = 8):
+        self.pattern_mask = code_mask(fraud_patterns, FRAUD_PATTERN_CODES, "fraud_pattern")
+        self.method_mask = code_mask(payment_methods, PAYMENT_METHODS, "payment_method")
+        self.filtered = not (self.pattern_mask.all() and self.method_mask.all())
+        self.batch_rows = batch_rows
+        self.queue: queue.Queue = queue.Queue(maxsize=max_pending)
+        self.closed = threading.Event()
+        self.ended = threading.Event()
+        self.rows_sent = 0
+
+    def select(self, batch: TransactionBatch) -> TransactionBatch:
+        """The rows of `batch` passing this subscription's filters"""
+        if not self.filtered:
+            return batch
+        keep = self.pattern_mask[batch.fraud_pattern] & self.method_mask[batch.payment_method]
+        return batch.take(np.flatnonzero(keep))
+
+    def put(self, item, keep_waiting: Callable[[], bool]) -> bool:
+        """Enqueue, blocking while the queue is full; False if the item was dropped"""
+        while not self.closed.is_set():
+            try:
+                self.queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                if not keep_waiting():
+                    return False
+        return False
+
+    def batches(self) -> Iterator:
+        """(store, batch) pairs until the run ends, with None on idle heartbeats"""
+        idle = 0.0
+        while not self.closed.is_set():
+            try:
+                item = self.queue.get(timeout=0.5)
+            except queue.Empty:
+                if self.ended.is_set():
+                    return
+                idle += 0.5
+                if idle >= HEARTBEAT_SECONDS:
+                    idle = 0.0
+                    yield None
+                continue
+            idle = 0.0
+            yield item
+
+class LiveStream:
+    """Fan-out of generated batches to live subscribers with backpressure.
+
+    A subscription receives the rows of the run in progress when it was
+    created, or of the next run to start, and ends when that run finishes.
+    """
+
+    def __init__(self):
+        self._subscribers: List[Subscription] = []
+        self._lock = threading.Lock()
+
+    def __bool__(self) -> bool:
+        return bool(self._subscribers)
+
+    def __len__(self) -> int:
+        return len(self._subscribers)
+
+    def queue_depth(self) -> int:
+        """Micro-batches waiting in subscriber queues"""
+        with self._lock:
+            return sum(subscription.queue.qsize() for subscription in self._subscribers)
+
+    def subscribe(self, **filters) -> Subscription:
+        subscription = Subscription(**filters)
+        with self._lock:
+            self._subscribers.append(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        subscription.closed.set()
+        with self._lock:
+            if subscription in self._subscribers:
+                self._subscribers.remove(subscription)
+
+    def publish(self, store, batch: TransactionBatch, keep_waiting: Callable[[], bool]):
+        """Queue a batch for every subscriber, in micro-batches, blocking on full queues.
+
+        `keep_waiting` is polled while blocked; once it returns False (the
+        simulation was stopped) the remaining rows are dropped for slow
+        subscribers rather than holding the run up.
+        """
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscription in subscribers:
+            rows = subscription.select(batch)
+            for start in range(0, len(rows), subscription.batch_rows):
+                piece = rows.take(slice(start, start + subscription.batch_rows))
+                if not subscription.put((store, piece), keep_waiting):
+                    break
+
+    def finish(self):
+        """End every current subscription after the rows already queued"""
+        with self._lock:
+            subscribers, self._subscribers = self._subscribers, []
+        for subscription in subscribers:
+            subscription.ended.set()
+
+def encode_stream(subscription: Subscription, format: str = "ndjson") -> Iterator[str]:
+    """Response body for a subscription: NDJSON lines or SSE events, one chunk per micro-batch"""
+    for item in subscription.batches():
+        if item is None:
+            yield "\n" if format == "ndjson" else ": keep-alive\n\n"
+            continue
+        store, batch = item
+        rows = store.encoder.json_rows(batch)
+        subscription.rows_sent += len(rows)
+        if format == "ndjson":
+            yield "".join(row + "\n" for row in rows)
+        else:
+            yield f"event: transactions\ndata: [{','.join(rows)}]\n\n"
+    if format == "sse":
+        yield f"event: end\ndata: {json.dumps({'rows': subscription.rows_sent})}\n\n"
@@ -0,0 +1,120 @@
+import os
+import resource
+import sys
+import threading
+import time
+from typing import Callable, Dict, List, Iterable, Optional, Tuple
+
+Labels = Tuple[Tuple[str, str], ...]
+
+def process_rss_bytes() -> int:
+    """Current resident set size of this process (0 where /proc is unavailable)"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        return 0
+
+def peak_rss_bytes() -> int:
+    """Peak resident set size of this process"""
+    # VmHWM is reset by exec, unlike ru_maxrss, which a spawned child inherits
+    # from its parent on Linux
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    # ru_maxrss is in KiB on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+def _format_labels(labels: Labels) -> str:
+    if not labels:
+        return ""
+    def escape(value) -> str:
+        return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    return "{" + ",".join(f'{name}="{escape(value)}"' for name, value in labels) + "}"
+
+def _format_value(value: float) -> str:
+    value = float(value)
+    return str(int(value)) if value.is_integer() else repr(value)
+
+class StageTimer:
+    """Context manager timing one stage; set `rows` inside the block to count output rows"""
+
+    def __init__(self, registry: "MetricsRegistry", stage: str, labels: Labels):
+        self.registry = registry
+        self.stage = stage
+        self.labels = labels
+        self.rows = 0
+
+    def __enter__(self) -> "StageTimer":
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.registry.record_stage(self.stage, self.labels, time.perf_counter() - self.start, self.rows)
+
+class MetricsRegistry:
+    """Counters for timed pipeline stages plus gauges sampled at scrape time.
+
+    Stage timings accumulate into seconds/calls/rows counters labelled by
+    stage (and any extra labels, e.g. the fraud pattern). Gauges are
+    callbacks returning (labels, value) pairs, so they cost nothing between
+    scrapes. render() produces the Prometheus text exposition format.
+    """
+
+    PREFIX = "fraud_sim"
+
+    def __init__(self):
+        self._stages: Dict[Labels, List[float]] = {}
+        self._gauges: List[Tuple[str, str, Callable[[], Iterable[Tuple[Dict[str, str], float]]]]] = []
+        self._lock = threading.Lock()
+
+    def timed(self, stage: str, **labels: str) -> StageTimer:
+        return StageTimer(self, stage, tuple(sorted(labels.items())))
+
+    def record_stage(self, stage: str, labels: Labels, seconds: float, rows: int = 0):
+        key = (("stage", stage),) + labels
+        with self._lock:
+            totals = self._stages.setdefault(key, [0.0, 0, 0])
+            totals[0] += seconds
+            totals[1] += 1
+            totals[2] += rows
+
+    def gauge(self, name: str, help: str, collect: Callable[[], Iterable[Tuple[Dict[str, str], float]]]):
+        """Register a gauge whose samples are produced by `collect` on every scrape"""
+        self._gauges.append((name, help, collect))
+
+    def stage_totals(self, stage: Optional[str] = None) -> Dict[Labels, List[float]]:
+        with self._lock:
+            return {key: list(totals) for key, totals in self._stages.items()
+                    if stage is None or key[0][1] == stage}
+
+    def render(self) -> str:
+        lines = []
+        stages = self.stage_totals()
+        for suffix, index, help in [("stage_seconds_total", 0, "Time spent in each pipeline stage"),
+                                    ("stage_calls_total", 1, "Number of times each stage ran"),
+                                    ("stage_rows_total", 2, "Rows produced or processed by each stage")]:
+            name = f"{self.PREFIX}_{suffix}"
+            lines += [f"# HELP {name} {help}", f"# TYPE {name} counter"]
+            for labels, totals in sorted(stages.items()):
+                lines.append(f"{name}{_format_labels(labels)} {_format_value(totals[index])}")
+
+        for gauge, help, collect in self._gauges:
+            name = f"{self.PREFIX}_{gauge}"
+            lines += [f"# HELP {name} {help}", f"# TYPE {name} gauge"]
+            for labels, value in collect():
+                lines.append(f"{name}{_format_labels(tuple(sorted(labels.items())))} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+# Process-wide registry, like the module loggers
+METRICS = MetricsRegistry()
+
+METRICS.gauge("process_resident_bytes", "Resident set size of the server process",
+              lambda: [({}, process_rss_bytes())])
+METRICS.gauge("process_peak_resident_bytes", "Peak resident set size of the server process",
+              lambda: [({}, peak_rss_bytes())])
@@ -0,0 +1,127 @@
+from typing import Dict, List, Any, Optional
+from dataclasses import dataclass
+from enum import Enum
+
+class FraudPattern(Enum):
+    RAPID_FIRE = "rapid_fire"
+    GEOGRAPHIC_HOPPING = "geographic_hopping"
+    DEVICE_SPOOFING = "device_spoofing"
+    AMOUNT_ESCALATION = "amount_escalation"
+    MERCHANT_CYCLING = "merchant_cycling"
+    VELOCITY_ATTACK = "velocity_attack"
+    ACCOUNT_TAKEOVER = "account_takeover"
+    MIXED_PATTERNS = "mixed_patterns"
+
+@dataclass
+class Transaction:
+    transaction_id: str
+    user_id: str
+    amount: float
+    currency: str
+    merchant_id: str
+    merchant_category: str
+    timestamp: str
+    device_fingerprint: str
+    ip_address: str
+    location: Dict[str, Any]
+    payment_method: str
+    is_synthetic: bool = True
+    fraud_pattern: Optional[str] = None
+    risk_score: Optional[float] = None
+    # `amount` converted to the base currency of the run's FX rates
+    amount_base: Optional[float] = None
+    features: Optional[Dict[str, Any]] = None
+
+# The 30 cities transactions take place in
+LOCATIONS = [
+    {"city": "Lagos", "country": "Nigeria", "lat": 6.5244, "lon": 3.3792, "timezone": "Africa/Lagos"},
+    {"city": "Cairo", "country": "Egypt", "lat": 30.0444, "lon": 31.2357, "timezone": "Africa/Cairo"},
+    {"city": "Kinshasa", "country": "DRC", "lat": -4.4419, "lon": 15.2663, "timezone": "Africa/Kinshasa"},
+    {"city": "Johannesburg", "country": "South Africa", "lat": -26.2041, "lon": 28.0473, "timezone": "Africa/Johannesburg"},
+    {"city": "Nairobi", "country": "Kenya", "lat": -1.2921, "lon": 36.8219, "timezone": "Africa/Nairobi"},
+    {"city": "Casablanca", "country": "Morocco", "lat": 33.5731, "lon": -7.5898, "timezone": "Africa/Casablanca"},
+    {"city": "Addis Ababa", "country": "Ethiopia", "lat": 9.1450, "lon": 40.4897, "timezone": "Africa/Addis_Ababa"},
+    {"city": "Dar es Salaam", "country": "Tanzania", "lat": -6.7924, "lon": 39.2083, "timezone": "Africa/Dar_es_Salaam"},
+    {"city": "Accra", "country": "Ghana", "lat": 5.6037, "lon": -0.1870, "timezone": "Africa/Accra"},
+    {"city": "Abidjan", "country": "Ivory Coast", "lat": 5.3600, "lon": -4.0083, "timezone": "Africa/Abidjan"},
+    {"city": "New York", "country": "US", "lat": 40.7128, "lon": -74.0060, "timezone": "America/New_York"},
+    {"city": "London", "country": "UK", "lat": 51.5074, "lon": -0.1278, "timezone": "Europe/London"},
+    {"city": "Tokyo", "country": "Japan", "lat": 35.6762, "lon": 139.6503, "timezone": "Asia/Tokyo"},
+    {"city": "Sydney", "country": "Australia", "lat": -33.8688, "lon": 151.2093, "timezone": "Australia/Sydney"},
+    {"city": "Berlin", "country": "Germany", "lat": 52.5200, "lon": 13.4050, "timezone": "Europe/Berlin"},
+    {"city": "Singapore", "country": "Singapore", "lat": 1.3521, "lon": 103.8198, "timezone": "Asia/Singapore"},
+    {"city": "Dubai", "country": "UAE", "lat": 25.2048, "lon": 55.2708, "timezone": "Asia/Dubai"},
+    {"city": "São Paulo", "country": "Brazil", "lat": -23.5505, "lon": -46.6333, "timezone": "America/Sao_Paulo"},
+    {"city": "Mumbai", "country": "India", "lat": 19.0760, "lon": 72.8777, "timezone": "Asia/Kolkata"},
+    {"city": "Mexico City", "country": "Mexico", "lat": 19.4326, "lon": -99.1332, "timezone": "America/Mexico_City"},
+    {"city": "Moscow", "country": "Russia", "lat": 55.7558, "lon": 37.6176, "timezone": "Europe/Moscow"},
+    {"city": "Paris", "country": "France", "lat": 48.8566, "lon": 2.3522, "timezone": "Europe/Paris"},
+    {"city": "Bangkok", "country": "Thailand", "lat": 13.7563, "lon": 100.5018, "timezone": "Asia/Bangkok"},
+    {"city": "Seoul", "country": "South Korea", "lat": 37.5665, "lon": 126.9780, "timezone": "Asia/Seoul"},
+    {"city": "Jakarta", "country": "Indonesia", "lat": -6.2088, "lon": 106.8456, "timezone": "Asia/Jakarta"},
+    {"city": "Istanbul", "country": "Turkey", "lat": 41.0082, "lon": 28.9784, "timezone": "Europe/Istanbul"},
+    {"city": "Buenos Aires", "country": "Argentina", "lat": -34.6118, "lon": -58.3960, "timezone": "America/Argentina/Buenos_Aires"},
+    {"city": "Toronto", "country": "Canada", "lat": 43.6532, "lon": -79.3832, "timezone": "America/Toronto"},
+    {"city": "Hong Kong", "country": "Hong Kong", "lat": 22.3193, "lon": 114.1694, "timezone": "Asia/Hong_Kong"},
+    {"city": "Madrid", "country": "Spain", "lat": 40.4168, "lon": -3.7038, "timezone": "Europe/Madrid"},
+]
+
+# Categorical vocabularies shared by the per-row generators and the batch engine.
+# Columnar data stores the index into these lists instead of the string itself.
+CURRENCIES = ["USD", "EUR", "GBP", "NGN", "KES", "GHS", "ZAR", "EGP", "CDF", "MAD", "ETB", "TZS", "XOF",
+              "JPY", "AUD", "SGD", "AED", "BRL", "INR", "MXN", "RUB", "THB", "KRW", "IDR", "TRY", "ARS", "CAD",
+              "HKD"]
+
+# Currency users of each country pay in
+COUNTRY_CURRENCIES = {
+    "Nigeria": "NGN", "Egypt": "EGP", "DRC": "CDF", "South Africa": "ZAR", "Kenya": "KES", "Morocco": "MAD",
+    "Ethiopia": "ETB", "Tanzania": "TZS", "Ghana": "GHS", "Ivory Coast": "XOF", "US": "USD", "UK": "GBP",
+    "Japan": "JPY", "Australia": "AUD", "Germany": "EUR", "Singapore": "SGD", "UAE": "AED", "Brazil": "BRL",
+    "India": "INR", "Mexico": "MXN", "Russia": "RUB", "France": "EUR", "Thailand": "THB", "South Korea": "KRW",
+    "Indonesia": "IDR", "Turkey": "TRY", "Argentina": "ARS", "Canada": "CAD", "Hong Kong": "HKD", "Spain": "EUR",
+}
+
+BROWSERS = ["Chrome", "Firefox", "Safari", "Edge", "Opera", "UC Browser", "Samsung Internet"]
+OS_LIST = ["Windows", "MacOS", "Linux", "iOS", "Android", "KaiOS", "Ubuntu Touch"]
+
+MERCHANT_CATEGORIES = [
+    "grocery", "gas_station", "restaurant", "retail", "online",
+    "pharmacy", "hotel", "airline", "entertainment", "subscription",
+    "utility", "electronics", "jewelry", "automotive", "healthcare",
+    "education", "transport", "banking", "insurance", "real_estate", "beauty",
+]
+
+# Every category a transaction can carry: merchant categories plus the ones only
+# fraud generators emit
+TRANSACTION_CATEGORIES = MERCHANT_CATEGORIES + ["mobile_money_agent", "luxury"]
+
+# Base methods first so a user's method list is always a prefix of this list
+PAYMENT_METHODS = ["credit_card", "debit_card", "digital_wallet", "mobile_money", "bank_transfer"]
+
+MOBILE_MONEY_AGENT_COUNTRIES = ["Ghana", "Kenya", "Tanzania", "Uganda", "Rwanda", "Ivory Coast", "Ethiopia", "Nigeria"]
+MOBILE_MONEY_COUNTRIES = ["Nigeria", "Kenya", "Ghana", "Tanzania", "Uganda", "Rwanda", "Ivory Coast", "Ethiopia", "South Africa"]
+
+def payment_methods_for_location(location: Dict) -> List[str]:
+    """Payment methods offered to users living in `location`"""
+    base_methods = ["credit_card", "debit_card", "digital_wallet"]
+
+    # Add bank transfer & mobile money for African countries
+    if location["country"] in MOBILE_MONEY_COUNTRIES:
+        return base_methods + ["mobile_money", "bank_transfer"]
+
+    return base_methods
+
+def currency_for_location(location: Dict) -> str:
+    """Currency of users living in `location` (USD for countries without one listed)"""
+    return COUNTRY_CURRENCIES.get(location["country"], "USD")
+
+def merchant_id(index: int) -> str:
+    """Id of the merchant at `index` in the merchant pool"""
+    return f"merchant_{index:04d}"
+
+def merchant_index(merchant: str) -> int:
+    """Inverse of merchant_id"""
+    return int(merchant[len("merchant_"):])
+
+# Code 0 means "not fraudulent"; pattern codes start at 1
+FRAUD_PATTERN_CODES = [None] + [pattern.value for pattern in FraudPattern]
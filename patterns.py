@@ -0,0 +1,135 @@
+from dataclasses import dataclass
+from typing import Callable, Dict, Optional
+
+import numpy as np
+
+from models import FraudPattern, PAYMENT_METHODS
+
+@dataclass(frozen=True)
+class PatternKernel:
+    """A fraud pattern generated in bulk.
+
+    `generate(engine, users, counts, times)` returns the rows of len(users)
+    attacks at once: attack k targets user `users[k]`, starts at `times[k]`
+    and has `counts[k]` rows, drawn between `min_rows` and `max_rows`
+    (capped by `row_limit(engine)` when set). Rows are ordered attack by
+    attack, step by step within an attack, as BatchEngine.attack_rows lays
+    them out. Amounts go in `amount`, in currency.MODEL_CURRENCY; the
+    engine converts them to each row's currency and the base currency.
+    Kernels draw only from the engine's streams, so their output is seeded
+    like every other generated field.
+    """
+    name: str
+    generate: Callable
+    min_rows: int
+    max_rows: int
+    row_limit: Optional[Callable] = None
+
+    def draw_counts(self, engine, rng: np.random.Generator, attacks: int) -> np.ndarray:
+        return self.limit(engine, rng.integers(self.min_rows, self.max_rows + 1, attacks))
+
+    def limit(self, engine, counts: np.ndarray) -> np.ndarray:
+        """`counts` capped at the most rows one attack can have with the engine's pools"""
+        return counts if self.row_limit is None else np.minimum(counts, self.row_limit(engine))
+
+# Pattern name -> kernel; BatchEngine picks up every registered pattern
+PATTERNS: Dict[str, PatternKernel] = {}
+
+def register_pattern(pattern: FraudPattern, min_rows: int, max_rows: int, row_limit: Optional[Callable] = None):
+    """Decorator registering the kernel of `pattern`; each pattern has exactly one"""
+    if pattern == FraudPattern.MIXED_PATTERNS:
+        raise ValueError("mixed_patterns draws from the other patterns and has no kernel")
+    if pattern.value in PATTERNS:
+        raise ValueError(f"A kernel is already registered for {pattern.value}")
+
+    def register(generate: Callable) -> Callable:
+        PATTERNS[pattern.value] = PatternKernel(pattern.value, generate, min_rows, max_rows, row_limit)
+        return generate
+    return register
+
+@register_pattern(FraudPattern.RAPID_FIRE, 5, 15)
+def rapid_fire(engine, users, counts, times):
+    """Low-value purchases seconds apart from one of the victim's devices"""
+    batch, _, _ = engine.attack_rows(FraudPattern.RAPID_FIRE, users, counts, times, 1_000_000, 1, 5)
+    n = len(batch)
+    batch.amount = engine.rng.uniform(1.0, 15.0, n)
+    batch.category = engine.categories(["online", "retail", "grocery"], n)
+    batch.risk_score = engine.rng.uniform(0.7, 0.9, n)
+    return batch
+
+@register_pattern(FraudPattern.GEOGRAPHIC_HOPPING, 3, 7, row_limit=lambda engine: len(engine.locations))
+def geographic_hopping(engine, users, counts, times):
+    """Purchases minutes apart in a different city each time"""
+    batch, instance, step = engine.attack_rows(
+        FraudPattern.GEOGRAPHIC_HOPPING, users, counts, times, 60_000_000, 5, 30)
+    n = len(batch)
+    cities = engine.sample_distinct(len(users), int(counts.max()), len(engine.locations))
+    batch.city = cities[instance, step].astype(np.int16)
+    batch.amount = engine.rng.uniform(50, 500, n)
+    batch.category = engine.categories(["hotel", "restaurant", "gas_station"], n)
+    batch.risk_score = engine.rng.uniform(0.8, 0.95, n)
+    return batch
+
+@register_pattern(FraudPattern.DEVICE_SPOOFING, 4, 10)
+def device_spoofing(engine, users, counts, times):
+    """Every purchase from a fresh device in a random city"""
+    batch, _, _ = engine.attack_rows(FraudPattern.DEVICE_SPOOFING, users, counts, times, 60_000_000, 10, 60)
+    n = len(batch)
+    batch.device = engine.random_devices(n)
+    batch.amount = engine.rng.uniform(100, 1000, n)
+    batch.category = engine.categories(["online", "retail", "electronics"], n)
+    batch.city = engine.rng.integers(0, len(engine.locations), n, dtype=np.int16)
+    batch.risk_score = engine.rng.uniform(0.6, 0.85, n)
+    return batch
+
+@register_pattern(FraudPattern.AMOUNT_ESCALATION, 4, 8)
+def amount_escalation(engine, users, counts, times):
+    """Hourly purchases growing 1.5x each time from the user's usual amount"""
+    batch, instance, step = engine.attack_rows(
+        FraudPattern.AMOUNT_ESCALATION, users, counts, times, 3_600_000_000, 1, 6)
+    n = len(batch)
+    batch.amount = np.round(engine.user_avg_amount[users][instance] * 1.5 ** step, 2)
+    batch.category = engine.categories(["retail", "electronics", "luxury"], n)
+    batch.risk_score = np.minimum(0.95, 0.4 + step * 0.1)
+    return batch
+
+@register_pattern(FraudPattern.MERCHANT_CYCLING, 6, 12, row_limit=lambda engine: len(engine.merchant_ids))
+def merchant_cycling(engine, users, counts, times):
+    """Purchases minutes apart at a different merchant each time"""
+    batch, instance, step = engine.attack_rows(
+        FraudPattern.MERCHANT_CYCLING, users, counts, times, 60_000_000, 2, 8)
+    n = len(batch)
+    merchants = engine.sample_distinct(len(users), int(counts.max()), len(engine.merchant_ids))
+    batch.merchant = merchants[instance, step].astype(np.int32)
+    batch.category = engine.merchant_category[batch.merchant]
+    batch.amount = engine.rng.uniform(20, 200, n)
+    batch.risk_score = engine.rng.uniform(0.5, 0.8, n)
+    return batch
+
+@register_pattern(FraudPattern.VELOCITY_ATTACK, 15, 40)
+def velocity_attack(engine, users, counts, times):
+    """Card testing: dozens of small purchases at many merchants within minutes"""
+    batch, _, _ = engine.attack_rows(FraudPattern.VELOCITY_ATTACK, users, counts, times, 1_000_000, 2, 10)
+    n = len(batch)
+    batch.amount = np.round(engine.rng.uniform(5.0, 150.0, n), 2)
+    batch.category = engine.categories(["online", "subscription", "entertainment", "electronics"], n)
+    batch.risk_score = engine.rng.uniform(0.75, 0.92, n)
+    return batch
+
+@register_pattern(FraudPattern.ACCOUNT_TAKEOVER, 3, 8)
+def account_takeover(engine, users, counts, times):
+    """An attacker's device away from home: two small probes, then purchases at 3-8x the usual amount"""
+    batch, instance, step = engine.attack_rows(
+        FraudPattern.ACCOUNT_TAKEOVER, users, counts, times, 60_000_000, 2, 20)
+    n = len(batch)
+    # One attacker device and one city other than the victim's home per takeover
+    batch.device = engine.random_devices(len(users))[instance]
+    shift = engine.rng.integers(1, max(len(engine.locations), 2), len(users))
+    batch.city = ((engine.user_home[users] + shift) % len(engine.locations))[instance].astype(np.int16)
+    usual = engine.user_avg_amount[users][instance]
+    batch.amount = np.round(np.where(step < 2, engine.rng.uniform(1.0, 20.0, n),
+                                     usual * engine.rng.uniform(3.0, 8.0, n)), 2)
+    batch.payment_method = np.full(n, PAYMENT_METHODS.index("digital_wallet"), dtype=np.int8)
+    batch.category = engine.categories(["electronics", "jewelry", "luxury", "online"], n)
+    batch.risk_score = engine.rng.uniform(0.85, 0.98, n)
+    return batch
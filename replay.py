@@ -0,0 +1,353 @@
+import argparse
+import asyncio
+import logging
+import math
+import ssl
+import threading
+import time
+from collections import Counter
+from typing import Dict, Any, Iterator, Optional, Tuple
+from urllib.parse import urlsplit
+
+import numpy as np
+
+from batch_engine import TransactionBatch
+
+logger = logging.getLogger(__name__)
+
+REPLAY_MODES = ["tps", "timeline"]
+
+class LatencyHistogram:
+    """Log-bucketed latency histogram with ~1% relative precision.
+
+    Bucket i covers [GROWTH**i, GROWTH**(i+1)) microseconds, so recording is
+    O(1) and memory is fixed however many samples are taken.
+    """
+
+    GROWTH = 1.01
+    MAX_US = 600_000_000
+
+    def __init__(self):
+        self.counts = np.zeros(self._bucket(self.MAX_US) + 1, dtype=np.int64)
+        self.total = 0
+        self.sum_us = 0.0
+        self.max_us = 0.0
+
+    def _bucket(self, us: float) -> int:
+        return int(math.log(max(us, 1.0)) / math.log(self.GROWTH))
+
+    def record(self, seconds: float):
+        us = min(seconds * 1e6, self.MAX_US)
+        self.counts[self._bucket(us)] += 1
+        self.total += 1
+        self.sum_us += us
+        self.max_us = max(self.max_us, us)
+
+    def percentile(self, q: float) -> float:
+        """Upper edge of the bucket holding the q-th percentile, in milliseconds"""
+        if not self.total:
+            return 0.0
+        rank = max(math.ceil(q / 100 * self.total), 1)
+        bucket = int(np.searchsorted(np.cumsum(self.counts), rank))
+        return min(self.GROWTH ** (bucket + 1), self.max_us) / 1000
+
+    def to_dict(self) -> Dict[str, float]:
+        return {
+            "count": self.total,
+            "mean_ms": round(self.sum_us / self.total / 1000, 3) if self.total else 0.0,
+            "p50_ms": round(self.percentile(50), 3),
+            "p90_ms": round(self.percentile(90), 3),
+            "p99_ms": round(self.percentile(99), 3),
+            "p999_ms": round(self.percentile(99.9), 3),
+            "max_ms": round(self.max_us / 1000, 3),
+        }
+
+class _Connection:
+    """One keep-alive HTTP/1.1 connection, reopened after errors or Connection: close"""
+
+    def __init__(self, host: str, port: int, ssl_context: Optional[ssl.SSLContext]):
+        self.host = host
+        self.port = port
+        self.ssl_context = ssl_context
+        self.reader: Optional[asyncio.StreamReader] = None
+        self.writer: Optional[asyncio.StreamWriter] = None
+
+    async def request(self, head: bytes, body: bytes) -> int:
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port, ssl=self.ssl_context)
+        try:
+            self.writer.write(head + body)
+            await self.writer.drain()
+            status, keep_alive = await self._read_response()
+        except BaseException:
+            self.close()
+            raise
+        if not keep_alive:
+            self.close()
+        return status
+
+    async def _read_response(self) -> Tuple[int, bool]:
+        status_line = await self.reader.readline()
+        if not status_line:
+            raise ConnectionError("connection closed by target")
+        status = int(status_line.split()[1])
+        headers = {}
+        while True:
+            line = await self.reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        if headers.get("transfer-encoding", "").lower() == "chunked":
+            while True:
+                size = int((await self.reader.readline()).split(b";")[0], 16)
+                await self.reader.readexactly(size + 2)
+                if size == 0:
+                    break
+        elif "content-length" in headers:
+            await self.reader.readexactly(int(headers["content-length"]))
+        elif status >= 200 and status not in (204, 304):
+            await self.reader.read()  # body delimited by connection close
+            return status, False
+        return status, headers.get("connection", "").lower() != "close"
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = self.writer = None
+
+class Replayer:
+    """Send stored transactions to an HTTP endpoint at a controlled rate.
+
+    In "tps" mode requests are scheduled exactly 1/`tps` seconds apart; in
+    "timeline" mode each row is sent when its simulated timestamp comes due,
+    with the simulated clock running `speedup` times faster than real time.
+    `concurrency` workers each hold one keep-alive connection, so that is
+    also the connection pool size. Each request carries one transaction as a
+    JSON object, or `rows_per_request` > 1 of them as a JSON array.
+
+    Latency is measured per request; schedule lag (how late requests went
+    out against their schedule) shows when the target or the pool cannot
+    keep up with the requested rate.
+    """
+
+    def __init__(self, target_url: str, mode: str = "tps", tps: float = 100.0, speedup: float = 60.0,
+                 concurrency: int = 32, rows_per_request: int = 1, timeout: float = 10.0,
+                 limit: Optional[int] = None, headers: Optional[Dict[str, str]] = None):
+        if mode not in REPLAY_MODES:
+            raise ValueError(f"Unsupported replay mode: {mode}")
+        url = urlsplit(target_url)
+        if url.scheme not in ("http", "https"):
+            raise ValueError(f"Unsupported target URL: {target_url}")
+        if (tps if mode == "tps" else speedup) <= 0:
+            raise ValueError("Replay rate must be positive")
+        if concurrency < 1 or rows_per_request < 1:
+            raise ValueError("concurrency and rows_per_request must be at least 1")
+
+        self.target_url = target_url
+        self.mode = mode
+        self.tps = tps
+        self.speedup = speedup
+        self.concurrency = concurrency
+        self.rows_per_request = rows_per_request
+        self.timeout = timeout
+        self.limit = limit
+        self.host = url.hostname
+        self.port = url.port or (443 if url.scheme == "https" else 80)
+        self.ssl_context = ssl.create_default_context() if url.scheme == "https" else None
+        path = (url.path or "/") + (f"?{url.query}" if url.query else "")
+        extra = "".join(f"{name}: {value}\r\n" for name, value in (headers or {}).items())
+        self._head = (f"POST {path} HTTP/1.1\r\nHost: {url.netloc}\r\nConnection: keep-alive\r\n"
+                      f"Content-Type: application/json\r\n{extra}Content-Length: ").encode("latin-1")
+
+        self.running = False
+        self.requests_sent = 0
+        self.rows_sent = 0
+        self.errors: Counter = Counter()
+        self.statuses: Counter = Counter()
+        self.latency = LatencyHistogram()
+        self.lag = LatencyHistogram()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+
+    def stop(self):
+        self.running = False
+
+    def status(self) -> Dict[str, Any]:
+        elapsed = ((self.finished_at or time.monotonic()) - self.started_at) if self.started_at else 0.0
+        failed = sum(self.errors.values())
+        return {
+            "running": self.running,
+            "target_url": self.target_url,
+            "mode": self.mode,
+            "target_tps": self.tps if self.mode == "tps" else None,
+            "speedup": self.speedup if self.mode == "timeline" else None,
+            "requests_sent": self.requests_sent,
+            "rows_sent": self.rows_sent,
+            "elapsed_seconds": round(elapsed, 3),
+            "achieved_tps": round(self.requests_sent / elapsed, 2) if elapsed else 0.0,
+            "error_rate": failed / self.requests_sent if self.requests_sent else 0.0,
+            "errors": dict(self.errors),
+            "status_codes": {str(code): count for code, count in self.statuses.items()},
+            "latency": self.latency.to_dict(),
+            "schedule_lag": self.lag.to_dict(),
+        }
+
+    def run(self, store, batches: Iterator[TransactionBatch]):
+        """Replay `batches` (decoded against `store`) to completion; blocks the calling thread"""
+        self.running = True
+        try:
+            asyncio.run(self._run(store, batches))
+        finally:
+            self.running = False
+            self.finished_at = time.monotonic()
+
+    def start(self, store, batches: Iterator[TransactionBatch]) -> threading.Thread:
+        """Replay in a background thread"""
+        self.running = True
+        thread = threading.Thread(target=self.run, args=(store, batches), daemon=True)
+        thread.start()
+        return thread
+
+    async def _run(self, store, batches: Iterator[TransactionBatch]):
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.concurrency * 4)
+        workers = [asyncio.create_task(self._worker(queue)) for _ in range(self.concurrency)]
+        # Set once no worker is left to take requests off the queue
+        exited = asyncio.Event()
+
+        def worker_done(task: asyncio.Task):
+            if not task.cancelled() and task.exception() is not None:
+                logger.error("Replay worker failed", exc_info=task.exception())
+            if all(worker.done() for worker in workers):
+                exited.set()
+
+        for worker in workers:
+            worker.add_done_callback(worker_done)
+        loop = asyncio.get_running_loop()
+        self.started_at = time.monotonic()
+        start = loop.time()
+        sent = 0
+        requests = 0
+        first_us = None
+        try:
+            for batch in batches:
+                if self.limit is not None:
+                    batch = batch.take(slice(0, max(self.limit - sent, 0)))
+                if not len(batch):
+                    break
+                if self.mode == "timeline":
+                    batch = batch.take(np.argsort(batch.timestamp_us, kind="stable"))
+                    if first_us is None:
+                        first_us = int(batch.timestamp_us[0])
+                rows = store.encoder.json_rows(batch)
+                for offset in range(0, len(rows), self.rows_per_request):
+                    if not self.running:
+                        return
+                    if self.mode == "tps":
+                        due = start + requests / self.tps
+                    else:
+                        due = start + (int(batch.timestamp_us[offset]) - first_us) / 1e6 / self.speedup
+                    group = rows[offset:offset + self.rows_per_request]
+                    body = (group[0] if self.rows_per_request == 1 else "[" + ",".join(group) + "]").encode("utf-8")
+                    if not await _enqueue(queue, (due, body, len(group)), exited):
+                        logger.error("Replay stopped: every worker has exited")
+                        return
+                    requests += 1
+                sent += len(batch)
+        finally:
+            for _ in workers:
+                if not await _enqueue(queue, None, exited):
+                    break
+            await asyncio.gather(*workers, return_exceptions=True)
+
+    async def _worker(self, queue: asyncio.Queue):
+        loop = asyncio.get_running_loop()
+        connection = _Connection(self.host, self.port, self.ssl_context)
+        while True:
+            item = await queue.get()
+            if item is None:
+                break
+            due, body, rows = item
+            if not self.running:
+                continue
+            delay = due - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            sent_at = loop.time()
+            self.lag.record(max(sent_at - due, 0.0))
+            try:
+                status = await asyncio.wait_for(
+                    connection.request(self._head + str(len(body)).encode() + b"\r\n\r\n", body), self.timeout)
+                self.statuses[status] += 1
+                if status >= 400:
+                    self.errors[f"http_{status}"] += 1
+            except asyncio.TimeoutError:
+                connection.close()
+                self.errors["timeout"] += 1
+            except Exception as e:
+                # e.g. a refused connection or a malformed response; the connection is reopened
+                connection.close()
+                self.errors[type(e).__name__] += 1
+            self.latency.record(loop.time() - sent_at)
+            self.requests_sent += 1
+            self.rows_sent += rows
+        connection.close()
+
+async def _enqueue(queue: asyncio.Queue, item, exited: asyncio.Event) -> bool:
+    """Put `item` on `queue`, unless `exited` is set first; False if it was not queued"""
+    if exited.is_set():
+        return False
+    try:
+        queue.put_nowait(item)
+        return True
+    except asyncio.QueueFull:
+        pass
+    put = asyncio.ensure_future(queue.put(item))
+    stopped = asyncio.ensure_future(exited.wait())
+    await asyncio.wait([put, stopped], return_when=asyncio.FIRST_COMPLETED)
+    stopped.cancel()
+    if put.done():
+        return True
+    put.cancel()
+    return False
+
+async def _stub_handler(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    try:
+        while True:
+            request_line = await reader.readline()
+            if not request_line:
+                break
+            length = 0
+            while True:
+                line = await reader.readline()
+                if line in (b"\r\n", b"\n", b""):
+                    break
+                name, _, value = line.decode("latin-1").partition(":")
+                if name.strip().lower() == "content-length":
+                    length = int(value)
+            await reader.readexactly(length)
+            writer.write(b"HTTP/1.1 204 No Content\r\nContent-Length: 0\r\n\r\n")
+            await writer.drain()
+    except (ConnectionError, asyncio.IncompleteReadError):
+        pass
+    finally:
+        writer.close()
+
+async def serve_stub(host: str = "127.0.0.1", port: int = 8081) -> asyncio.AbstractServer:
+    """Minimal keep-alive receiver answering every request with 204, for local replay tests"""
+    return await asyncio.start_server(_stub_handler, host, port)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Stub HTTP receiver for replay load tests")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    args = parser.parse_args()
+
+    async def main():
+        server = await serve_stub(args.host, args.port)
+        print(f"Stub receiver listening on http://{args.host}:{args.port}/")
+        async with server:
+            await server.serve_forever()
+
+    asyncio.run(main())
@@ -0,0 +1,248 @@
+import threading
+from typing import Dict, List, Any, Optional, Sequence
+
+import numpy as np
+
+from models import CURRENCIES, PAYMENT_METHODS, FRAUD_PATTERN_CODES
+from batch_engine import TransactionBatch
+
+def _mix64(values: np.ndarray) -> np.ndarray:
+    """splitmix64 finalizer: spreads packed codes evenly over 64 bits"""
+    with np.errstate(over="ignore"):
+        z = values.astype(np.uint64) + np.uint64(0x9E3779B97F4A7C15)
+        z = (z ^ (z >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+        z = (z ^ (z >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+        return z ^ (z >> np.uint64(31))
+
+class HyperLogLog:
+    """Vectorized HyperLogLog cardinality sketch over uint64 values"""
+
+    def __init__(self, precision: int = 14):
+        self.precision = precision
+        self.registers = np.zeros(1 << precision, dtype=np.uint8)
+
+    def add(self, values: np.ndarray):
+        if not len(values):
+            return
+        hashed = _mix64(values)
+        index = (hashed >> np.uint64(64 - self.precision)).astype(np.int64)
+        rest = hashed & np.uint64((1 << (64 - self.precision)) - 1)
+        # Rank = position of the leftmost 1-bit in the remaining 64 - p bits
+        bits = np.zeros(len(rest), dtype=np.int64)
+        nonzero = rest > 0
+        bits[nonzero] = np.floor(np.log2(rest[nonzero].astype(np.float64))).astype(np.int64) + 1
+        # float64 rounding can overshoot just below a power of two
+        overshoot = nonzero & ((rest >> np.maximum(bits - 1, 0).astype(np.uint64)) == 0)
+        bits[overshoot] -= 1
+        rank = (64 - self.precision - bits + 1).astype(np.uint8)
+        np.maximum.at(self.registers, index, rank)
+
+    def count(self) -> int:
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / np.sum(np.exp2(-self.registers.astype(np.float64)))
+        zeros = int(np.count_nonzero(self.registers == 0))
+        if estimate <= 2.5 * m and zeros:
+            estimate = m * np.log(m / zeros)  # linear counting for small cardinalities
+        return int(round(estimate))
+
+class DistinctCounter:
+    """Exact distinct count that degrades to a HyperLogLog past `exact_limit` values"""
+
+    def __init__(self, exact_limit: int = 1_000_000):
+        self.exact_limit = exact_limit
+        self.values = set()
+        self.sketch = None
+
+    def add(self, values: np.ndarray):
+        if self.sketch is not None:
+            self.sketch.add(values)
+            return
+        self.values.update(np.unique(values).tolist())
+        if len(self.values) > self.exact_limit:
+            self.sketch = HyperLogLog()
+            self.sketch.add(np.fromiter(self.values, dtype=np.uint64, count=len(self.values)))
+            self.values = set()
+
+    def count(self) -> int:
+        return self.sketch.count() if self.sketch is not None else len(self.values)
+
+    def state(self) -> Dict[str, np.ndarray]:
+        if self.sketch is not None:
+            return {"registers": self.sketch.registers}
+        return {"values": np.fromiter(self.values, dtype=np.uint64, count=len(self.values))}
+
+    def restore(self, state: Dict[str, np.ndarray]):
+        if "registers" in state:
+            self.sketch = HyperLogLog()
+            self.sketch.registers = np.array(state["registers"], dtype=np.uint8)
+            self.values = set()
+        else:
+            self.sketch = None
+            self.values = set(state["values"].tolist())
+
+class ReportAggregator:
+    """Running totals behind generate_report.
+
+    update() folds each generated batch into per-code tallies with a few
+    bincounts, so building a report costs the same however many rows a run
+    has produced, and can be done while the run is still going. Amounts are
+    totalled in `base_currency`, and per currency in that currency too, as
+    int64 counts of whole cents: every amount is rounded to at most two
+    decimals, so the totals are exact and do not depend on how rows were
+    batched.
+    """
+
+    def __init__(self, locations: Sequence[Dict] = (), num_merchants: int = 0, base_currency: str = "USD"):
+        self.locations = locations
+        self.base_currency = base_currency
+        self._lock = threading.Lock()
+        num_patterns = len(FRAUD_PATTERN_CODES)
+        num_locations = len(locations)
+        num_methods = len(PAYMENT_METHODS)
+        num_currencies = len(CURRENCIES)
+        self.total = 0
+        self.pattern_counts = np.zeros(num_patterns, dtype=np.int64)
+        self.pattern_amounts = np.zeros(num_patterns, dtype=np.int64)
+        self.location_counts = np.zeros(num_locations, dtype=np.int64)
+        self.location_fraud = np.zeros(num_locations, dtype=np.int64)
+        self.location_amounts = np.zeros(num_locations, dtype=np.int64)
+        self.method_counts = np.zeros(num_methods, dtype=np.int64)
+        self.method_fraud = np.zeros(num_methods, dtype=np.int64)
+        self.method_amounts = np.zeros(num_methods, dtype=np.int64)
+        self.currency_counts = np.zeros(num_currencies, dtype=np.int64)
+        self.currency_fraud = np.zeros(num_currencies, dtype=np.int64)
+        self.currency_amounts = np.zeros(num_currencies, dtype=np.int64)
+        self.currency_base_amounts = np.zeros(num_currencies, dtype=np.int64)
+        self.risk_sum = 0.0
+        self.risk_count = 0
+        self.seen_merchants = np.zeros(num_merchants, dtype=bool)
+        self.devices = DistinctCounter()
+
+    def __len__(self) -> int:
+        return self.total
+
+    def update(self, batch: TransactionBatch):
+        num_patterns = len(self.pattern_counts)
+        num_locations = len(self.location_counts)
+        num_methods = len(self.method_counts)
+        num_currencies = len(self.currency_counts)
+        fraud = batch.fraud_pattern > 0
+        base = _cents(batch.amount_base)
+        risk_scores = batch.risk_score[batch.risk_score > 0]
+        with self._lock:
+            self.total += len(batch)
+            self.pattern_counts += np.bincount(batch.fraud_pattern, minlength=num_patterns)
+            self.pattern_amounts += _cent_sums(batch.fraud_pattern, base, num_patterns)
+            self.location_counts += np.bincount(batch.city, minlength=num_locations)
+            self.location_fraud += np.bincount(batch.city[fraud], minlength=num_locations)
+            self.location_amounts += _cent_sums(batch.city, base, num_locations)
+            self.method_counts += np.bincount(batch.payment_method, minlength=num_methods)
+            self.method_fraud += np.bincount(batch.payment_method[fraud], minlength=num_methods)
+            self.method_amounts += _cent_sums(batch.payment_method, base, num_methods)
+            self.currency_counts += np.bincount(batch.currency, minlength=num_currencies)
+            self.currency_fraud += np.bincount(batch.currency[fraud], minlength=num_currencies)
+            self.currency_amounts += _cent_sums(batch.currency, _cents(batch.amount), num_currencies)
+            self.currency_base_amounts += _cent_sums(batch.currency, base, num_currencies)
+            self.risk_sum += float(risk_scores.sum())
+            self.risk_count += len(risk_scores)
+            self.seen_merchants[batch.merchant] = True
+            self.devices.add(batch.device)
+
+    # Running totals saved by state(), besides the distinct device counter
+    COUNTERS = ["pattern_counts", "pattern_amounts", "location_counts", "location_fraud", "location_amounts",
+                "method_counts", "method_fraud", "method_amounts", "currency_counts", "currency_fraud",
+                "currency_amounts", "currency_base_amounts", "seen_merchants"]
+
+    def state(self) -> Dict[str, np.ndarray]:
+        """Every running total as arrays, for checkpoints"""
+        with self._lock:
+            state = {name: getattr(self, name).copy() for name in self.COUNTERS}
+            state["totals"] = np.array([self.total, self.risk_count], dtype=np.int64)
+            state["risk_sum"] = np.array([self.risk_sum])
+            state.update({f"devices_{key}": value for key, value in self.devices.state().items()})
+        return state
+
+    def restore(self, state: Dict[str, np.ndarray]):
+        """Continue from totals saved by state()"""
+        with self._lock:
+            for name in self.COUNTERS:
+                getattr(self, name)[...] = state[name]
+            self.total, self.risk_count = (int(value) for value in state["totals"])
+            self.risk_sum = float(state["risk_sum"][0])
+            self.devices.restore({key[len("devices_"):]: value for key, value in state.items()
+                                  if key.startswith("devices_")})
+
+    def to_dict(self, unique_users: int) -> Dict[str, Any]:
+        """The report sections of generate_report (everything but the transactions)"""
+        with self._lock:
+            total_transactions = self.total
+            fraudulent_transactions = int(self.pattern_counts[1:].sum())
+            avg_risk_score = self.risk_sum / self.risk_count if self.risk_count else 0
+            total_amount = int(self.pattern_amounts.sum()) / 100
+            fraud_amount = int(self.pattern_amounts[1:].sum()) / 100
+            patterns = np.flatnonzero(self.pattern_counts[1:]) + 1
+
+            return {
+                "summary": {
+                    "total_transactions": total_transactions,
+                    "fraudulent_transactions": fraudulent_transactions,
+                    "normal_transactions": total_transactions - fraudulent_transactions,
+                    "fraud_rate": fraudulent_transactions / total_transactions if total_transactions > 0 else 0,
+                    "base_currency": self.base_currency,
+                    "total_amount": round(total_amount, 2),
+                    "fraud_amount": round(fraud_amount, 2),
+                    "fraud_amount_percentage": (fraud_amount / total_amount) * 100 if total_amount > 0 else 0,
+                    "average_risk_score": round(avg_risk_score, 3),
+                    "unique_users": unique_users,
+                    "unique_merchants": int(self.seen_merchants.sum()),
+                    "unique_devices": self.devices.count(),
+                    "unique_locations": int(np.count_nonzero(self.location_counts))
+                },
+                "pattern_analysis": {
+                    "counts": {FRAUD_PATTERN_CODES[i]: int(self.pattern_counts[i]) for i in patterns},
+                    "amounts": {FRAUD_PATTERN_CODES[i]: round(int(self.pattern_amounts[i]) / 100, 2) for i in patterns}
+                },
+                "location_analysis": _breakdown([location["city"] for location in self.locations],
+                                                self.location_counts, self.location_fraud, self.location_amounts),
+                "payment_method_analysis": _breakdown(PAYMENT_METHODS, self.method_counts,
+                                                      self.method_fraud, self.method_amounts),
+                "currency_analysis": _breakdown(CURRENCIES, self.currency_counts, self.currency_fraud,
+                                                self.currency_amounts, self.currency_base_amounts),
+            }
+
+def _breakdown(names: List[str], counts: np.ndarray, fraud: np.ndarray, amounts: np.ndarray,
+               base_amounts: Optional[np.ndarray] = None) -> Dict[str, Any]:
+    """Per-name tallies of amounts in cents; with `base_amounts`, `amounts` are in each name's own currency"""
+    breakdown = {
+        names[i]: {
+            "total_transactions": int(counts[i]),
+            "fraud_transactions": int(fraud[i]),
+            "fraud_rate": float(fraud[i] / counts[i]),
+            "total_amount": round(int(amounts[i]) / 100, 2)
+        }
+        for i in np.flatnonzero(counts)
+    }
+    if base_amounts is not None:
+        for i in np.flatnonzero(counts):
+            breakdown[names[i]]["total_amount_base"] = round(int(base_amounts[i]) / 100, 2)
+    return breakdown
+
+# Bits of the low half of a cent amount in _cent_sums
+_CENT_SPLIT = 20
+
+def _cents(amounts: np.ndarray) -> np.ndarray:
+    """Amounts as int64 whole numbers of cents"""
+    return np.round(amounts * 100).astype(np.int64)
+
+def _cent_sums(codes: np.ndarray, cents: np.ndarray, minlength: int) -> np.ndarray:
+    """Exact int64 sums of `cents` per code
+
+    bincount only sums in float64, which holds every integer below 2**53,
+    so the low _CENT_SPLIT bits and the rest of every amount are summed
+    separately: the first stays exact for batches under 2**33 rows, the
+    second for batches totalling under 2**73 cents.
+    """
+    low = np.bincount(codes, weights=cents & ((1 << _CENT_SPLIT) - 1), minlength=minlength)
+    high = np.bincount(codes, weights=cents >> _CENT_SPLIT, minlength=minlength)
+    return (high.astype(np.int64) << _CENT_SPLIT) + low.astype(np.int64)
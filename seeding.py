@@ -0,0 +1,38 @@
+import random
+import secrets
+
+import numpy as np
+
+# Spawn keys of the independent streams derived from a simulator's seed. Each
+# stream is addressed by its key rather than spawned in order, so adding a
+# stream or generating in a different order never shifts the others.
+DEVICES = 0
+MERCHANTS = 1
+USERS = 2
+TRANSACTIONS = 3
+IDS = 4
+GENERATION = 5
+SCHEDULE = 6
+
+# Components of one generation block, below (GENERATION, hour, block[, user shard])
+BLOCK_USERS = 0
+BLOCK_PATTERNS = 1
+BLOCK_IDS = 2
+BLOCK_FIELDS = 3
+
+def new_seed() -> int:
+    """A fresh random seed, small enough to survive a round trip through JavaScript"""
+    return secrets.randbits(53)
+
+def derive(root: np.random.SeedSequence, *key: int) -> np.random.SeedSequence:
+    """The child sequence of `root` at `key`; the same key always gives the same child"""
+    return np.random.SeedSequence(root.entropy, spawn_key=tuple(root.spawn_key) + key)
+
+def numpy_stream(root: np.random.SeedSequence, *key: int) -> np.random.Generator:
+    """Counter-based (Philox) NumPy generator for the stream at `key`"""
+    return np.random.Generator(np.random.Philox(derive(root, *key)))
+
+def python_stream(root: np.random.SeedSequence, *key: int) -> random.Random:
+    """random.Random for the stream at `key`, for the per-row code paths"""
+    state = derive(root, *key).generate_state(4, np.uint32)
+    return random.Random(int.from_bytes(state.tobytes(), "little"))
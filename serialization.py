@@ -0,0 +1,131 @@
+import json
+from typing import Dict, List, Any, Optional
+
+import numpy as np
+
+from models import CURRENCIES, TRANSACTION_CATEGORIES, PAYMENT_METHODS, FRAUD_PATTERN_CODES
+from batch_engine import (
+    TransactionBatch, format_device, format_ips, format_timestamps, format_uuids, take_labels,
+)
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+JSON = "application/json"
+MSGPACK = "application/msgpack"
+
+def response_formats() -> List[str]:
+    """Media types report responses can be encoded as, JSON first"""
+    return [JSON] + ([MSGPACK, "application/x-msgpack"] if msgpack else [])
+
+def dumps(value: Any) -> str:
+    """Compact JSON, through orjson when it is installed"""
+    if orjson is not None:
+        return orjson.dumps(value, option=orjson.OPT_NON_STR_KEYS).decode()
+    return json.dumps(value, separators=(",", ":"))
+
+# JSON fragments of the fixed vocabularies, looked up by code instead of encoded per row
+_CURRENCY_JSON = [json.dumps(value) for value in CURRENCIES]
+_CATEGORY_JSON = [json.dumps(value) for value in TRANSACTION_CATEGORIES]
+_PAYMENT_METHOD_JSON = [json.dumps(value) for value in PAYMENT_METHODS]
+_FRAUD_PATTERN_JSON = [json.dumps(value) for value in FRAUD_PATTERN_CODES]
+_BOOL_JSON = ["false", "true"]
+
+class TransactionEncoder:
+    """Encodes rows of a TransactionStore straight from its columns.
+
+    Every field is turned into a list of JSON fragments column by column -
+    vocabulary codes and cities through pre-encoded lookup tables, ids and
+    timestamps through the bulk formatters - and the fragments are spliced
+    into one row template, so no Transaction or dict is built per row.
+    Strings from the formatters and id tables contain nothing JSON needs to
+    escape.
+    """
+
+    def __init__(self, store):
+        self.store = store
+        self.location_json = [json.dumps(location) for location in store.locations]
+
+    def _template(self, feature_names: List[str]) -> str:
+        fields = ['"transaction_id":"%s"', '"user_id":"%s"', '"amount":%r', '"currency":%s', '"merchant_id":"%s"',
+                  '"merchant_category":%s', '"timestamp":"%s"', '"device_fingerprint":"%s"', '"ip_address":"%s"',
+                  '"location":%s', '"payment_method":%s', '"is_synthetic":true', '"fraud_pattern":%s',
+                  '"risk_score":%r', '"amount_base":%r']
+        if feature_names:
+            fields.append('"features":{' + ",".join(f'"{name}":%s' for name in feature_names) + "}")
+        return "{" + ",".join(fields) + "}"
+
+    def _fragments(self, batch: TransactionBatch) -> List[list]:
+        store = self.store
+        columns = [
+            format_uuids(batch.id_hi, batch.id_lo),
+            take_labels(store.user_ids, batch.user),
+            batch.amount.tolist(),
+            [_CURRENCY_JSON[code] for code in batch.currency.tolist()],
+            take_labels(store.merchant_ids, batch.merchant),
+            [_CATEGORY_JSON[code] for code in batch.category.tolist()],
+            format_timestamps(batch.timestamp_us),
+            [format_device(device) for device in batch.device.tolist()],
+            format_ips(batch.ip),
+            [self.location_json[city] for city in batch.city.tolist()],
+            [_PAYMENT_METHOD_JSON[code] for code in batch.payment_method.tolist()],
+            [_FRAUD_PATTERN_JSON[code] for code in batch.fraud_pattern.tolist()],
+            batch.risk_score.tolist(),
+            batch.amount_base.tolist(),
+        ]
+        for column in (batch.features or {}).values():
+            if column.dtype == np.bool_:
+                columns.append([_BOOL_JSON[value] for value in column.tolist()])
+            else:
+                columns.append(column.tolist())
+        return columns
+
+    def json_rows(self, batch: TransactionBatch) -> List[str]:
+        """One JSON object per row"""
+        if not len(batch):
+            return []
+        template = self._template(list(batch.features or ()))
+        return [template % row for row in zip(*self._fragments(batch))]
+
+    def json_array(self, batch: TransactionBatch) -> str:
+        return "[" + ",".join(self.json_rows(batch)) + "]"
+
+    def msgpack_rows(self, batch: TransactionBatch) -> bytes:
+        """The rows as a packed msgpack array of maps"""
+        columns = self.store.decode_columns(batch)
+        names = list(columns)
+        packer = msgpack.Packer()
+        keys = [packer.pack(name) for name in names]
+        header = packer.pack_map_header(len(names))
+        parts = [packer.pack_array_header(len(batch))]
+        for row in zip(*columns.values()):
+            parts.append(header)
+            for key, value in zip(keys, row):
+                parts.append(key)
+                parts.append(packer.pack(value))
+        return b"".join(parts)
+
+def encode_report(report: Dict[str, Any], encoder: Optional[TransactionEncoder], batch: Optional[TransactionBatch],
+                  media_type: str = JSON) -> bytes:
+    """Encode a report whose `transactions` are the rows of `batch`, encoded from the store's columns"""
+    if media_type != JSON:
+        if msgpack is None:
+            raise RuntimeError("MessagePack responses require the 'msgpack' package")
+        if batch is None:
+            return msgpack.packb(report)
+        packer = msgpack.Packer()
+        head = packer.pack_map_header(len(report) + 1) + b"".join(
+            packer.pack(key) + packer.pack(value) for key, value in report.items())
+        return head + packer.pack("transactions") + encoder.msgpack_rows(batch)
+
+    body = dumps(report)
+    if batch is None:
+        return body.encode()
+    separator = "," if len(report) else ""
+    return (body[:-1] + separator + '"transactions":' + encoder.json_array(batch) + "}").encode()
@@ -0,0 +1,212 @@
+import logging
+import multiprocessing as mp
+import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Any, Iterator, Optional
+
+import numpy as np
+
+from models import FraudPattern
+from batch_engine import BatchEngine, TransactionBatch, COLUMN_DTYPES
+
+logger = logging.getLogger(__name__)
+
+SHARD_MODES = ["hours", "users"]
+
+# Share of simulation_progress given to generation; the rest covers the merge
+GENERATION_PROGRESS_SHARE = 90
+
+# Set in each worker process by _init_worker
+_progress = None
+_stop = None
+
+def _init_worker(progress, stop):
+    global _progress, _stop
+    _progress = progress
+    _stop = stop
+
+def plan_shards(workers: int, duration_hours: int, transactions_per_hour: int,
+                shard_by: str = "hours") -> List[Dict[str, Any]]:
+    """Split a run into per-worker specs.
+
+    "hours" gives each worker a contiguous range of simulated hours over all
+    users; "users" gives each worker every hour, a slice of the per-hour
+    volume and a disjoint set of users (user index modulo worker count).
+    """
+    if shard_by not in SHARD_MODES:
+        raise ValueError(f"Unsupported shard mode: {shard_by}")
+
+    shards = []
+    if shard_by == "hours":
+        for hours in np.array_split(np.arange(duration_hours), min(workers, duration_hours)):
+            shards.append({"hours": hours.tolist(), "steps_per_hour": transactions_per_hour, "user_shard": None})
+    else:
+        for w in range(workers):
+            steps = transactions_per_hour // workers + (w < transactions_per_hour % workers)
+            if steps:
+                shards.append({"hours": list(range(duration_hours)), "steps_per_hour": steps, "user_shard": w})
+    for index, shard in enumerate(shards):
+        shard["index"] = index
+        shard["user_shards"] = workers
+    return shards
+
+def build_simulator(simulator_cls, seed: int, num_users: int, pool_sizes: Dict[str, Any]):
+    """A simulator whose data pools and users depend only on `seed` and the pool sizes"""
+    simulator = simulator_cls(seed=seed, **pool_sizes)
+    simulator._reset_users(num_users)
+    return simulator
+
+def simulate_shard(spec: Dict[str, Any]) -> Dict[str, Any]:
+    """Worker entry point: generate one shard and save it (in timestamp order, as iter_hours yields it)"""
+    simulator = build_simulator(spec["simulator_cls"], spec["seed"], spec["num_users"], spec["pool_sizes"])
+    simulator.fx_rates = spec["fx_rates"]
+    user_subset = None
+    if spec["user_shard"] is not None:
+        user_subset = np.arange(spec["user_shard"], spec["num_users"], spec["user_shards"])
+    engine = BatchEngine(simulator, user_subset=user_subset, user_shard=spec["user_shard"])
+
+    # Columns are appended to their files as chunks are generated, so a worker
+    # holds one chunk at a time however many rows its shard has
+    os.makedirs(spec["path"], exist_ok=True)
+    files = {name: open(os.path.join(spec["path"], f"{name}.bin"), "wb") for name in COLUMN_DTYPES}
+    rows = 0
+    done = 0
+    try:
+        for _, steps, batch in engine.iter_hours(spec["hours"], spec["steps_per_hour"], spec["start_us"],
+                                                 batch_size=spec["batch_size"], fraud_rate=spec["fraud_rate"],
+                                                 fraud_patterns=spec["fraud_patterns"], traffic=spec["traffic"]):
+            for name, dtype in COLUMN_DTYPES.items():
+                getattr(batch, name).astype(dtype, copy=False).tofile(files[name])
+            rows += len(batch)
+            done += steps
+            _progress[spec["index"]] = done
+            if _stop.is_set():
+                break
+    finally:
+        for f in files.values():
+            f.close()
+
+    return {"index": spec["index"], "path": spec["path"], "rows": rows,
+            "complete": engine.cursor[0] >= len(spec["hours"])}
+
+def load_shard(path: str, rows: int) -> TransactionBatch:
+    """Memory-map a shard of `rows` rows saved by simulate_shard"""
+    if not rows:
+        return TransactionBatch.allocate(0)
+    return TransactionBatch(**{
+        name: np.memmap(os.path.join(path, f"{name}.bin"), dtype=dtype, mode="r", shape=(rows,))
+        for name, dtype in COLUMN_DTYPES.items()
+    })
+
+def merge_shards(shards: List[TransactionBatch], chunk_rows: int = 65536) -> Iterator[TransactionBatch]:
+    """K-way merge of timestamp-sorted shards into timestamp-ordered chunks.
+
+    Each round looks at the next `chunk_rows` rows of every shard and emits all
+    rows up to the smallest last timestamp among windows that do not reach the
+    end of their shard. Ties are broken by shard order, then row order, so the
+    output depends only on the shards themselves.
+    """
+    cursors = [0] * len(shards)
+    while True:
+        active = [i for i, shard in enumerate(shards) if cursors[i] < len(shard)]
+        if not active:
+            return
+        ends = {i: min(cursors[i] + chunk_rows, len(shards[i])) for i in active}
+        bounded = [shards[i].timestamp_us[ends[i] - 1] for i in active if ends[i] < len(shards[i])]
+        watermark = min(bounded) if bounded else None
+
+        pieces = []
+        for i in active:
+            stop = ends[i]
+            if watermark is not None:
+                window = shards[i].timestamp_us[cursors[i]:ends[i]]
+                stop = cursors[i] + int(np.searchsorted(window, watermark, side="right"))
+            if stop > cursors[i]:
+                pieces.append(shards[i].take(slice(cursors[i], stop)))
+                cursors[i] = stop
+        batch = TransactionBatch.concat(pieces)
+        yield batch.take(np.argsort(batch.timestamp_us, kind="stable"))
+
+def run_sharded(simulator, workers: int, duration_hours: int, transactions_per_hour: int,
+                fraud_patterns: Optional[List[str]], fraud_rate: float, num_users: int, start_us: int,
+                batch_size: int = 10000, shard_by: str = "hours", exporter=None, retain: bool = True,
+                progress_callback=None, traffic=None):
+    """Run a simulation across a process pool and merge the shards into `simulator`.
+
+    Every worker rebuilds the same data pools and users from the simulator's
+    seed, or memory-maps the pools from the shared pool cache if one is set.
+    Generation streams are keyed by simulated hour and block, so the merged
+    output does not depend on process scheduling, and hour-sharded runs
+    contain exactly the rows of a single-process run.
+    """
+    logger.info(f"Starting sharded simulation for {duration_hours} hours on {workers} workers "
+                f"(shard by {shard_by}, seed {simulator.seed})")
+
+    if not fraud_patterns:
+        fraud_patterns = [pattern.value for pattern in FraudPattern]
+
+    # Fill the pool cache once up front rather than in every worker. Pools and
+    # users are a function of the seed, so the parent's match the workers'.
+    simulator.pools
+    simulator._reset_users(num_users)
+    if traffic is None:
+        total_steps = duration_hours * transactions_per_hour
+    else:
+        # Weighted by where users live, as single-process runs count their steps
+        total_steps = max(traffic.expected_steps(start_us, range(duration_hours), transactions_per_hour,
+                                                 BatchEngine(simulator).city_share), 1)
+    
+    ctx = mp.get_context("spawn")
+    progress = ctx.Array("q", workers, lock=False)
+    stop = ctx.Event()
+
+    with tempfile.TemporaryDirectory(prefix="fraud-sim-shards-") as tmp:
+        specs = plan_shards(workers, duration_hours, transactions_per_hour, shard_by)
+        for spec in specs:
+            spec.update({
+                "simulator_cls": type(simulator),
+                "seed": simulator.seed,
+                "num_users": num_users,
+                "pool_sizes": {
+                    "num_devices": simulator.num_devices,
+                    "num_merchants": simulator.num_merchants,
+                    "num_cities": len(simulator.locations),
+                    "pool_cache_dir": simulator.pool_cache_dir,
+                },
+                "start_us": start_us,
+                "batch_size": batch_size,
+                "fraud_rate": fraud_rate,
+                "fraud_patterns": fraud_patterns,
+                "traffic": traffic,
+                "fx_rates": simulator.fx_rates,
+                "path": os.path.join(tmp, f"shard-{spec['index']:04d}"),
+            })
+
+        with ProcessPoolExecutor(max_workers=len(specs), mp_context=ctx,
+                                 initializer=_init_worker, initargs=(progress, stop)) as pool:
+            futures = [pool.submit(simulate_shard, spec) for spec in specs]
+            while not all(future.done() for future in futures):
+                if not simulator.simulation_running:
+                    stop.set()
+                simulator.simulation_progress = sum(progress) / total_steps * GENERATION_PROGRESS_SHARE
+                if progress_callback:
+                    progress_callback(simulator.simulation_progress)
+                time.sleep(0.1)
+            results = sorted((future.result() for future in futures), key=lambda r: r["index"])
+
+        simulator._reset_output(exporter)
+
+        total_rows = max(sum(result["rows"] for result in results), 1)
+        merged_rows = 0
+        for batch in merge_shards([load_shard(result["path"], result["rows"]) for result in results]):
+            simulator._emit(batch, exporter, retain)
+            merged_rows += len(batch)
+            simulator.simulation_progress = (GENERATION_PROGRESS_SHARE +
+                                             merged_rows / total_rows * (100 - GENERATION_PROGRESS_SHARE))
+            if progress_callback:
+                progress_callback(simulator.simulation_progress)
+
+    if exporter:
+        exporter.close(complete=all(result["complete"] for result in results))
@@ -0,0 +1,50 @@
+import time
+from dataclasses import dataclass, field
+from typing import Dict, Any
+
+from metrics import METRICS
+from serialization import encode_report, response_formats
+
+# Rows in a snapshot's report page: the last ones, as /get_report returns them without ?start= or ?limit=
+SNAPSHOT_REPORT_ROWS = 100
+
+@dataclass(frozen=True)
+class Snapshot:
+    """A job's progress and default report page at one moment, encoded ahead of any request.
+
+    Built on the thread or process generating the job, so polling clients
+    are answered from it without touching the simulator. Picklable, to be
+    sent from a job process to the server.
+    """
+    # Simulator fields of Job.to_dict
+    stats: Dict[str, Any]
+    # Media type -> encoded report with the last SNAPSHOT_REPORT_ROWS rows
+    reports: Dict[str, bytes] = field(default_factory=dict)
+    taken_at: float = field(default_factory=time.time)
+
+    @property
+    def rows(self) -> int:
+        return self.stats["total_transactions"]
+
+def simulator_stats(simulator) -> Dict[str, Any]:
+    """The simulator fields of a job's status"""
+    store = simulator.transactions
+    return {
+        "running": simulator.simulation_running,
+        "progress": simulator.simulation_progress,
+        "seed": simulator.seed,
+        "total_transactions": len(simulator.report),
+        "retained_transactions": len(store),
+        "memory_bytes": store.nbytes,
+        "spilled_bytes": store.spilled_bytes,
+    }
+
+def take_snapshot(simulator) -> Snapshot:
+    """Snapshot a simulator, encoding its default report page in every supported format"""
+    with METRICS.timed("snapshot_build") as timer:
+        report, batch = simulator.report_page(limit=SNAPSHOT_REPORT_ROWS)
+        encoder = simulator.transactions.encoder
+        reports = {media_type: encode_report(report, encoder, batch, media_type)
+                   for media_type in response_formats()[:2]}
+        timer.rows = len(batch) if batch is not None else 0
+    return Snapshot(simulator_stats(simulator), reports)
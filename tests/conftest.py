@@ -0,0 +1,59 @@
+import hashlib
+import logging
+import time
+
+import numpy as np
+import pytest
+
+from app import SyntheticFraudSimulator
+from batch_engine import COLUMN_DTYPES, TransactionBatch
+from jobs import FINISHED_STATES
+
+logging.disable(logging.INFO)
+
+SEED = 20240101
+
+def stored_rows(simulator: SyntheticFraudSimulator) -> TransactionBatch:
+    """Every row a run retained, in store order"""
+    return simulator.transactions.slice(0, len(simulator.transactions))
+
+def digest(batch: TransactionBatch) -> str:
+    """Hash of every column (and feature) of a batch, for comparing runs"""
+    h = hashlib.sha256()
+    for name in COLUMN_DTYPES:
+        h.update(np.ascontiguousarray(getattr(batch, name)).tobytes())
+    for name, column in sorted((batch.features or {}).items()):
+        h.update(name.encode())
+        h.update(np.ascontiguousarray(column).tobytes())
+    return h.hexdigest()
+
+def simulate(**kwargs) -> SyntheticFraudSimulator:
+    """A finished seeded run, small unless told otherwise"""
+    params = {"duration_hours": 2, "transactions_per_hour": 2000, "seed": SEED, "num_users": 300}
+    params.update(kwargs)
+    simulator = SyntheticFraudSimulator(seed=params["seed"])
+    simulator.run_simulation(**params)
+    return simulator
+
+@pytest.fixture
+def simulator() -> SyntheticFraudSimulator:
+    """A seeded simulator with a small user population, before any run"""
+    simulator = SyntheticFraudSimulator(seed=SEED)
+    simulator._reset_users(300)
+    return simulator
+
+@pytest.fixture
+def client():
+    """Flask test client of the app"""
+    from app import app
+    return app.test_client()
+
+def wait_for_job(client, job_id: str, timeout: float = 60) -> dict:
+    """Poll /jobs/<job_id> until the job finishes; its final status"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        status = client.get(f"/jobs/{job_id}").get_json()
+        if status["status"] in FINISHED_STATES:
+            return status
+        time.sleep(0.05)
+    raise TimeoutError(f"Job {job_id} did not finish")
@@ -0,0 +1,98 @@
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+import pytest
+
+from batch_engine import BatchEngine, COLUMN_DTYPES, EPOCH, FRAUD_PATTERN_INDEX, HOUR_US, format_timestamps, now_us
+from models import FraudPattern, PAYMENT_METHODS
+from patterns import PATTERNS, register_pattern, velocity_attack
+from conftest import digest, simulate, stored_rows
+
+def test_columns_have_canonical_dtypes(simulator):
+    batch = BatchEngine(simulator).generate(500, start_us=0, span_us=HOUR_US)
+    for name, dtype in COLUMN_DTYPES.items():
+        assert getattr(batch, name).dtype == dtype, name
+
+def test_normal_steps_are_one_row_each(simulator):
+    engine = BatchEngine(simulator)
+    batch = engine.generate(1000, fraud_rate=0.0, start_us=0, span_us=HOUR_US)
+    assert len(batch) == 1000
+    assert not batch.fraud_pattern.any()
+    assert (batch.timestamp_us >= 0).all() and (batch.timestamp_us < HOUR_US).all()
+    table = simulator.user_table
+    for user, merchant in zip(batch.user[:50], batch.merchant[:50]):
+        assert merchant in table.merchants[table.merchant_offsets[user]:table.merchant_offsets[user + 1]]
+
+def test_fraud_steps_are_whole_attacks(simulator):
+    engine = BatchEngine(simulator)
+    batch = engine.generate(200, fraud_rate=1.0, fraud_patterns=["rapid_fire"], start_us=0, span_us=HOUR_US)
+    assert (batch.fraud_pattern == FRAUD_PATTERN_INDEX["rapid_fire"]).all()
+    # Rapid-fire attacks have 5-15 rows, contiguous and all of one user
+    assert 5 * 200 <= len(batch) <= 15 * 200
+    starts = np.flatnonzero(np.diff(batch.user, prepend=-1) != 0)
+    assert len(starts) <= 200
+    assert np.diff(np.append(starts, len(batch))).min() >= 5
+
+def test_run_retains_and_reports_every_row():
+    simulator = simulate(duration_hours=1, transactions_per_hour=1500)
+    rows = stored_rows(simulator)
+    assert simulator.simulation_progress == 100 and not simulator.simulation_running
+    assert len(rows) == len(simulator.report) >= 1500
+    assert np.all(np.diff(rows.timestamp_us) >= 0)
+
+def test_per_row_transactions_use_the_batch_timestamp_format(simulator):
+    user_id = simulator.users.ids[0]
+    normal = simulator.generate_normal_transaction(user_id)
+    attack = simulator.generate_attack("rapid_fire", user_id, count=5)
+    for row in [normal] + attack:
+        ts_us = (datetime.fromisoformat(row.timestamp) - EPOCH) // timedelta(microseconds=1)
+        assert abs(ts_us - now_us()) < 60_000_000
+        assert row.timestamp == format_timestamps(np.array([ts_us]))[0]
+
+def test_aware_start_times_are_taken_as_utc():
+    naive = simulate(duration_hours=1, start_time=datetime(2024, 1, 1, 12))
+    aware = simulate(duration_hours=1, start_time=datetime(2024, 1, 1, 14, tzinfo=timezone(timedelta(hours=2))))
+    assert digest(stored_rows(naive)) == digest(stored_rows(aware))
+
+def _attacks(simulator, pattern: str, attacks: int = 200):
+    """(batch, start time and step of every row) of one `pattern` attack on each of `attacks` users"""
+    engine = BatchEngine(simulator)
+    starts = np.arange(attacks, dtype=np.int64) * HOUR_US
+    batch = engine.attack(pattern, np.arange(attacks), starts)
+    assert (batch.fraud_pattern == FRAUD_PATTERN_INDEX[pattern]).all()
+    counts = np.bincount(batch.user, minlength=attacks)
+    step = np.arange(len(batch)) - np.repeat(np.cumsum(counts) - counts, counts)
+    return batch, counts, starts[batch.user], step
+
+def _assert_spacing(ts, start, step, interval_us, low, high):
+    # Row i of an attack is i * randint(low, high) intervals after its start
+    offset = ts - start
+    assert (offset[step == 0] == 0).all()
+    later = step > 0
+    assert (offset[later] % (step[later] * interval_us) == 0).all()
+    multiple = offset[later] // (step[later] * interval_us)
+    assert multiple.min() >= low and multiple.max() <= high
+
+def test_velocity_attacks(simulator):
+    batch, counts, start, step = _attacks(simulator, "velocity_attack")
+    assert counts.min() >= 15 and counts.max() <= 40
+    _assert_spacing(batch.timestamp_us, start, step, 1_000_000, 2, 10)
+    assert (batch.risk_score >= 0.75).all()
+
+def test_account_takeovers(simulator):
+    batch, counts, start, step = _attacks(simulator, "account_takeover")
+    assert counts.min() >= 3 and counts.max() <= 8
+    _assert_spacing(batch.timestamp_us, start, step, 60_000_000, 2, 20)
+    # One attacker device and one foreign city per takeover, paid by digital wallet
+    firsts = np.flatnonzero(step == 0)
+    assert (batch.device == np.repeat(batch.device[firsts], counts)).all()
+    assert (batch.city == np.repeat(batch.city[firsts], counts)).all()
+    assert (batch.city != simulator.user_table.home_city[batch.user]).all()
+    assert (batch.payment_method == PAYMENT_METHODS.index("digital_wallet")).all()
+
+def test_register_pattern_rejects_a_second_kernel():
+    with pytest.raises(ValueError):
+        register_pattern(FraudPattern.VELOCITY_ATTACK, 1, 2)
+    with pytest.raises(ValueError):
+        register_pattern(FraudPattern.MIXED_PATTERNS, 1, 2)
+    assert PATTERNS["velocity_attack"].generate is velocity_attack
@@ -0,0 +1,108 @@
+import glob
+import gzip
+import json
+import os
+from functools import partial
+
+import pytest
+
+import app
+from app import SyntheticFraudSimulator
+from checkpoint import load_checkpoint
+from exporter import StreamingExporter
+from transaction_store import TransactionStore
+from conftest import SEED, digest, simulate, stored_rows
+
+PARAMS = {"duration_hours": 4, "transactions_per_hour": 3000, "seed": SEED, "num_users": 300, "batch_size": 700,
+          "fraud_rate": 0.3, "features": True, "traffic": {"profile": "realistic"}}
+
+class Crash(Exception):
+    pass
+
+def crash_after(calls: int):
+    """Progress callback raising on its `calls`-th call"""
+    seen = []
+    def callback(progress):
+        seen.append(progress)
+        if len(seen) == calls:
+            raise Crash()
+    return callback
+
+def exporter(directory: str) -> StreamingExporter:
+    return StreamingExporter(directory, compression="gzip", rows_per_file=2000, chunk_rows=500)
+
+def exported(directory: str):
+    rows = []
+    for path in sorted(glob.glob(os.path.join(directory, "part-*"))):
+        rows += gzip.open(path).read().decode().splitlines()
+    return rows
+
+def report(simulator: SyntheticFraudSimulator) -> str:
+    return json.dumps(simulator.report.to_dict(len(simulator.users)), sort_keys=True)
+
+@pytest.mark.parametrize("calls", [2, 3])
+def test_resumed_run_equals_uninterrupted_run(tmp_path, calls):
+    reference = simulate(exporter=exporter(str(tmp_path / "reference")), **PARAMS)
+
+    simulator = SyntheticFraudSimulator(seed=SEED)
+    with pytest.raises(Crash):
+        simulator.run_simulation(exporter=exporter(str(tmp_path / "run")), checkpoint_dir=str(tmp_path / "state"),
+                                 checkpoint_interval=0, progress_callback=crash_after(calls), **PARAMS)
+    checkpoint = load_checkpoint(str(tmp_path / "state"))
+    assert not checkpoint.complete
+
+    resumed = SyntheticFraudSimulator(**checkpoint.pool_sizes)
+    resumed.resume_simulation(str(tmp_path / "state"), exporter=checkpoint.exporter(), checkpoint_interval=0)
+    assert load_checkpoint(str(tmp_path / "state")).complete
+    assert digest(stored_rows(resumed)) == digest(stored_rows(reference))
+    assert report(resumed) == report(reference)
+    assert exported(str(tmp_path / "run")) == exported(str(tmp_path / "reference"))
+
+def test_failed_run_is_checkpointed_where_it_failed(tmp_path):
+    reference = simulate(exporter=exporter(str(tmp_path / "reference")), **PARAMS)
+
+    # No periodic checkpoint is due, so only the failure leaves one
+    simulator = SyntheticFraudSimulator(seed=SEED)
+    subscription = simulator.stream.subscribe(max_pending=1000)
+    with pytest.raises(Crash):
+        simulator.run_simulation(exporter=exporter(str(tmp_path / "run")), checkpoint_dir=str(tmp_path / "state"),
+                                 checkpoint_interval=3600, progress_callback=crash_after(3), **PARAMS)
+    assert not simulator.simulation_running
+    assert subscription.ended.is_set()
+    checkpoint = load_checkpoint(str(tmp_path / "state"))
+    assert not checkpoint.complete and checkpoint.state["rows"] == len(simulator.report)
+    with open(tmp_path / "run" / "manifest.json") as f:
+        manifest = json.load(f)
+    assert not manifest["complete"]
+    parts = sorted(os.path.basename(path) for path in glob.glob(str(tmp_path / "run" / "part-*")))
+    assert [file["path"] for file in manifest["files"]] == parts
+
+    resumed = SyntheticFraudSimulator(**checkpoint.pool_sizes)
+    resumed.resume_simulation(str(tmp_path / "state"), exporter=checkpoint.exporter(), checkpoint_interval=0)
+    assert digest(stored_rows(resumed)) == digest(stored_rows(reference))
+    assert exported(str(tmp_path / "run")) == exported(str(tmp_path / "reference"))
+
+def test_spilled_segments_are_linked_and_mapped_back(tmp_path, monkeypatch):
+    monkeypatch.setattr(app, "TransactionStore", partial(TransactionStore, segment_rows=1024))
+    monkeypatch.setattr(app, "SPILL_DIR", str(tmp_path / "spill"))
+    params = dict(PARAMS, store_memory_budget=0)
+    reference = simulate(**params)
+
+    simulator = SyntheticFraudSimulator(seed=SEED)
+    with pytest.raises(Crash):
+        simulator.run_simulation(checkpoint_dir=str(tmp_path / "state"), checkpoint_interval=0,
+                                 progress_callback=crash_after(3), **params)
+    store = simulator.transactions
+    saved = load_checkpoint(str(tmp_path / "state")).state["segments"]
+    assert 0 < saved <= store.spilled
+    paths = sorted(glob.glob(str(tmp_path / "state" / "segments" / "*")))
+    assert len(paths) == saved
+    for path, spill_file in zip(paths, store.segment_files):
+        assert os.path.samefile(path, spill_file)
+
+    resumed = SyntheticFraudSimulator(seed=SEED)
+    resumed.store_memory_budget = 0
+    resumed.resume_simulation(str(tmp_path / "state"), checkpoint_interval=0)
+    assert resumed.transactions.segment_files[:saved] == paths
+    assert resumed.transactions.spilled == len(resumed.transactions.segments)
+    assert digest(stored_rows(resumed)) == digest(stored_rows(reference))
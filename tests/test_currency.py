@@ -0,0 +1,76 @@
+import numpy as np
+import pytest
+
+from batch_engine import COLUMN_DTYPES
+from currency import CURRENCY_INDEX, DEFAULT_RATES, MODEL_CURRENCY, FxRates
+from models import CURRENCIES, currency_for_location
+from transaction_index import TransactionQuery
+from conftest import simulate, stored_rows
+
+USD, EUR, JPY, NGN = (CURRENCY_INDEX[code] for code in ("USD", "EUR", "JPY", "NGN"))
+
+def test_prices_round_to_each_currency_minor_units():
+    native, base = DEFAULT_RATES.price(np.array([10.0, 1.234, 1.234, 0.006]), np.array([NGN, JPY, EUR, USD]))
+    assert native.tolist() == [15000.0, 185.0, 1.14, 0.01]
+    assert base.tolist() == [10.0, 1.23, 1.23, 0.01]
+
+def test_base_currency_only_changes_the_unit_of_base_amounts():
+    eur = FxRates.from_dict({"base": "EUR"})
+    native, base = eur.price(np.array([10.0, 10.0]), np.array([NGN, USD]))
+    assert native.tolist() == [15000.0, 10.0]
+    assert base.tolist() == [9.2, 9.2]
+    assert eur.convert(np.array([9.2]), EUR, USD).tolist() == [10.0]
+    with pytest.raises(ValueError):
+        FxRates.from_dict({"base": "XYZ"})
+
+def test_base_rate_must_be_one():
+    assert FxRates.from_dict({"base": "EUR", "rates": {"EUR": 1, "NGN": 1650}}).rates[EUR] == 1.0
+    with pytest.raises(ValueError, match="must be 1"):
+        FxRates.from_dict({"base": "EUR", "rates": {"EUR": 1.1}})
+    with pytest.raises(ValueError, match="must be 1"):
+        FxRates.from_dict({"rates": {"USD": 0.5}})
+
+@pytest.fixture(scope="module")
+def runs():
+    return {base: simulate(fraud_rate=0.3, fx_rates={"base": base}) for base in (MODEL_CURRENCY, "EUR", "JPY")}
+
+def test_rows_are_the_same_whatever_the_base(runs):
+    usd = stored_rows(runs[MODEL_CURRENCY])
+    for base in ("EUR", "JPY"):
+        rows = stored_rows(runs[base])
+        for name in COLUMN_DTYPES:
+            if name != "amount_base":
+                assert np.array_equal(getattr(rows, name), getattr(usd, name)), name
+        # Base amounts are priced from the unrounded model amounts, so allow one minor unit
+        expected = DEFAULT_RATES.convert(usd.amount_base, USD, CURRENCY_INDEX[base])
+        assert np.abs(rows.amount_base - expected).max() <= (1 if base == "JPY" else 0.01) + 1e-9
+        assert rows.amount_base.dtype == np.float64
+
+def test_rows_are_charged_in_the_home_currency(runs):
+    simulator = runs["EUR"]
+    rows = stored_rows(simulator)
+    home = simulator.user_table.home_city[rows.user]
+    expected = [CURRENCY_INDEX[currency_for_location(simulator.locations[city])] for city in home.tolist()]
+    assert rows.currency.tolist() == expected
+
+def test_report_totals_match_the_rows(runs):
+    simulator = runs["EUR"]
+    rows = stored_rows(simulator)
+    report = simulator.generate_report(limit=0)
+    cents = lambda amounts: round(int(np.round(amounts * 100).astype(np.int64).sum()) / 100, 2)
+    assert report["summary"]["base_currency"] == "EUR"
+    assert report["summary"]["total_amount"] == cents(rows.amount_base)
+    for code in np.unique(rows.currency).tolist():
+        mine = rows.currency == code
+        totals = report["currency_analysis"][CURRENCIES[code]]
+        assert totals["total_transactions"] == int(mine.sum())
+        assert totals["total_amount"] == cents(rows.amount[mine])
+        assert totals["total_amount_base"] == cents(rows.amount_base[mine])
+
+def test_amount_bounds_match_stored_base_amounts_exactly(runs):
+    simulator = runs[MODEL_CURRENCY]
+    rows = stored_rows(simulator)
+    amount = float(rows.amount_base[len(rows) // 2])
+    query = TransactionQuery.from_params({"min_amount": amount, "max_amount": amount}, simulator.locations)
+    found, _, _ = simulator.transactions.query(query, limit=len(rows))
+    assert len(found) == int((rows.amount_base == amount).sum()) > 0
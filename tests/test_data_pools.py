@@ -0,0 +1,36 @@
+import os
+from dataclasses import fields
+
+import numpy as np
+
+from data_pools import DataPools, load_or_build_pools, pool_cache_path, save_arrays
+from models import LOCATIONS
+from conftest import SEED
+
+def _pools(cache_dir=None) -> DataPools:
+    return load_or_build_pools(SEED, np.random.SeedSequence(SEED), 2000, 300, LOCATIONS, cache_dir)
+
+def _assert_equal(a: DataPools, b: DataPools):
+    for f in fields(DataPools):
+        assert np.array_equal(getattr(a, f.name), getattr(b, f.name)), f.name
+
+def test_cached_pools_equal_built_ones(tmp_path, monkeypatch):
+    built = _pools()
+    cached = _pools(str(tmp_path))
+    _assert_equal(cached, built)
+    assert isinstance(cached.device_codes, np.memmap) and not cached.device_codes.flags.writeable
+
+    # Later loads map the cache rather than drawing the pools again
+    def rebuild(*args, **kwargs):
+        raise AssertionError("pools rebuilt despite the cache")
+    monkeypatch.setattr(DataPools, "build", rebuild)
+    _assert_equal(_pools(str(tmp_path)), built)
+
+def test_save_arrays_keeps_the_first_copy_and_discards_its_own(tmp_path):
+    path = pool_cache_path(str(tmp_path), SEED, 2000, 300, len(LOCATIONS))
+    first = _pools()
+    save_arrays(first, path)
+    second = DataPools(*(np.zeros_like(getattr(first, f.name)) for f in fields(DataPools)))
+    save_arrays(second, path)
+    _assert_equal(DataPools.load(path), first)
+    assert os.listdir(str(tmp_path)) == [os.path.basename(path)]
@@ -0,0 +1,102 @@
+import csv
+import gzip
+import io
+import json
+import os
+
+import numpy as np
+import pytest
+
+from app import SyntheticFraudSimulator
+from exporter import StreamingExporter, EXPORT_FORMATS, EXPORT_COMPRESSIONS
+from conftest import SEED, simulate, stored_rows
+
+def _read_rows(output_dir: str, format: str, compression):
+    """(transaction ids, fraud patterns) of every exported row, in file order"""
+    manifest = json.load(open(os.path.join(output_dir, "manifest.json")))
+    assert manifest["complete"]
+    ids, patterns = [], []
+    for file in manifest["files"]:
+        path = os.path.join(output_dir, file["path"])
+        if format == "parquet":
+            import pyarrow.parquet as pq
+            table = pq.read_table(path)
+            ids += table.column("transaction_id").to_pylist()
+            patterns += table.column("fraud_pattern").to_pylist()
+            continue
+        with open(path, "rb") as f:
+            data = f.read()
+        if compression == "gzip":
+            data = gzip.decompress(data)
+        elif compression == "zstd":
+            import zstandard
+            data = zstandard.ZstdDecompressor().stream_reader(io.BytesIO(data), read_across_frames=True).read()
+        text = data.decode("utf-8")
+        if format == "ndjson":
+            rows = [json.loads(line) for line in text.splitlines()]
+        else:
+            rows = list(csv.DictReader(io.StringIO(text)))
+        ids += [row["transaction_id"] for row in rows]
+        patterns += [row["fraud_pattern"] or None for row in rows]
+    return manifest, ids, patterns
+
+@pytest.mark.parametrize("format", EXPORT_FORMATS)
+@pytest.mark.parametrize("compression", EXPORT_COMPRESSIONS)
+def test_export_round_trip(tmp_path, format, compression):
+    if format == "parquet":
+        pytest.importorskip("pyarrow")
+    elif compression == "zstd":
+        pytest.importorskip("zstandard")
+    exporter = StreamingExporter(str(tmp_path), format=format, compression=compression,
+                                 rows_per_file=1500, chunk_rows=400)
+    simulator = simulate(duration_hours=1, transactions_per_hour=1000, exporter=exporter, retain=True)
+    rows = stored_rows(simulator)
+    decoded = simulator.transactions.decode_columns(rows)
+    manifest, ids, patterns = _read_rows(str(tmp_path), format, compression)
+    assert manifest["total_rows"] == len(rows) == len(ids)
+    assert len(manifest["files"]) == -(-len(rows) // 1500)
+    assert ids == decoded["transaction_id"]
+    assert patterns == decoded["fraud_pattern"]
+
+def test_parquet_schema_survives_fraud_free_first_chunk(tmp_path):
+    pytest.importorskip("pyarrow")
+    import pyarrow.parquet as pq
+    exporter = StreamingExporter(str(tmp_path), format="parquet", chunk_rows=7)
+    simulator = simulate(duration_hours=1, transactions_per_hour=300, fraud_rate=0.02, features=True,
+                         exporter=exporter, retain=True)
+    fraud = stored_rows(simulator).fraud_pattern
+    # The first chunk has no fraud, so its fraud_pattern column is all None; later ones do
+    assert not fraud[:7].any() and fraud[7:].any()
+    table = pq.read_table(os.path.join(str(tmp_path), "part-00000.parquet"))
+    assert table.num_rows == len(fraud)
+    assert str(table.schema.field("fraud_pattern").type) == "string"
+    assert np.array_equal(np.array([p is not None for p in table.column("fraud_pattern").to_pylist()]), fraud > 0)
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_stopped_export_is_not_marked_complete(tmp_path, workers):
+    simulator = SyntheticFraudSimulator(seed=SEED)
+
+    def stop(progress):
+        simulator.simulation_running = False
+
+    exporter = StreamingExporter(str(tmp_path), rows_per_file=500, chunk_rows=100)
+    simulator.run_simulation(duration_hours=4, transactions_per_hour=3000, seed=SEED, num_users=300,
+                             batch_size=1000, workers=workers, exporter=exporter, progress_callback=stop)
+    manifest = json.load(open(os.path.join(str(tmp_path), "manifest.json")))
+    assert not manifest["complete"]
+    assert 0 < manifest["total_rows"] < 4 * 3000
+
+def test_failed_export_drops_its_unfinished_file(tmp_path):
+    simulator = SyntheticFraudSimulator(seed=SEED)
+
+    def fail(progress):
+        raise RuntimeError("failed")
+
+    exporter = StreamingExporter(str(tmp_path), rows_per_file=5000, chunk_rows=100)
+    with pytest.raises(RuntimeError):
+        simulator.run_simulation(duration_hours=4, transactions_per_hour=3000, seed=SEED, num_users=300,
+                                 batch_size=3000, exporter=exporter, progress_callback=fail)
+    manifest = json.load(open(os.path.join(str(tmp_path), "manifest.json")))
+    assert not manifest["complete"]
+    parts = sorted(name for name in os.listdir(str(tmp_path)) if name.startswith("part-"))
+    assert [file["path"] for file in manifest["files"]] == parts
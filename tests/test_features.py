@@ -0,0 +1,51 @@
+import numpy as np
+import pytest
+
+from features import FeatureIndex, FEATURE_WINDOWS, FEATURE_ENTITIES, HORIZON_US, IMPOSSIBLE_SPEED_KMH, distance_matrix
+from conftest import simulate, stored_rows
+
+@pytest.fixture(scope="module")
+def run():
+    simulator = simulate(duration_hours=3, transactions_per_hour=600, num_users=60, features=True, batch_size=200)
+    return simulator, stored_rows(simulator)
+
+def test_velocity_features_match_brute_force(run):
+    _, rows = run
+    ts = rows.timestamp_us
+    amount = rows.amount_base.astype(np.float64)
+    for entity in FEATURE_ENTITIES:
+        values = getattr(rows, entity)
+        for window, length in FEATURE_WINDOWS.items():
+            counts = rows.features[f"{entity}_count_{window}"]
+            amounts = rows.features[f"{entity}_amount_{window}"]
+            for i in range(0, len(rows), 7):
+                inside = (values == values[i]) & (ts > ts[i] - length) & (ts <= ts[i])
+                assert counts[i] == inside.sum(), (entity, window, i)
+                assert amounts[i] == pytest.approx(amount[inside].sum(), abs=0.011), (entity, window, i)
+
+def test_travel_features_match_brute_force(run):
+    simulator, rows = run
+    distances = distance_matrix(simulator.locations)
+    ts, user, city = rows.timestamp_us, rows.user, rows.city
+    for i in range(len(rows)):
+        earlier = (user == user[i]) & (ts < ts[i]) & (ts > ts[i] - HORIZON_US)
+        if not earlier.any():
+            assert rows.features["prev_gap_seconds"][i] == -1.0
+            assert not rows.features["impossible_travel"][i]
+            continue
+        previous = ts[earlier].max()
+        cities = np.unique(city[earlier & (ts == previous)])
+        assert rows.features["prev_gap_seconds"][i] == (ts[i] - previous) / 1e6
+        if len(cities) > 1:
+            continue  # tied previous rows in different cities
+        km = distances[cities[0], city[i]]
+        assert rows.features["travel_km"][i] == pytest.approx(round(km, 1))
+        speed = km / (max(ts[i] - previous, 1_000_000) / 3.6e9)
+        assert rows.features["impossible_travel"][i] == (speed > IMPOSSIBLE_SPEED_KMH)
+
+def test_out_of_order_batches_are_refused(run):
+    simulator, rows = run
+    index = FeatureIndex(simulator.locations)
+    index.update(rows.take(slice(100, 200)))
+    with pytest.raises(ValueError, match="timestamp order"):
+        index.update(rows.take(slice(0, 100)))
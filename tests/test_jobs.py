@@ -0,0 +1,61 @@
+import os
+import time
+
+import pytest
+
+from app import SyntheticFraudSimulator
+from jobs import CANCELLED, COMPLETED, FAILED, RUNNING, JobManager
+from conftest import SEED, wait_for_job
+
+def _wait(job, timeout: float = 60):
+    deadline = time.monotonic() + timeout
+    while not job.finished and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert job.finished
+    return job
+
+def _exit_without_reporting(**pool_sizes):
+    """Simulator factory whose job process dies before it can report back"""
+    os._exit(3)
+
+def test_submit_poll_and_fetch_the_report(client):
+    job_id = client.post("/run_simulation", json={"duration_hours": 1, "transactions_per_hour": 1000,
+                                                  "seed": SEED, "num_users": 300}).get_json()["job_id"]
+    status = wait_for_job(client, job_id)
+    assert status["status"] == "completed" and status["progress"] == 100 and status["seed"] == SEED
+    report = client.get(f"/jobs/{job_id}/report").get_json()
+    assert report["summary"]["total_transactions"] == status["total_transactions"] >= 1000
+    assert client.get("/jobs/nope").status_code == 404
+
+def test_cancel_stops_a_running_job():
+    manager = JobManager(SyntheticFraudSimulator, max_workers=1)
+    job = manager.submit({"duration_hours": 48, "transactions_per_hour": 20000, "seed": SEED, "num_users": 300,
+                          "batch_size": 1000})
+    queued = manager.submit({"duration_hours": 1, "seed": SEED})
+    deadline = time.monotonic() + 30
+    while not (job.status == RUNNING and job.stats["total_transactions"]) and time.monotonic() < deadline:
+        time.sleep(0.02)
+    manager.cancel(queued.job_id)
+    manager.cancel(job.job_id)
+    assert _wait(job).status == CANCELLED and _wait(queued).status == CANCELLED
+    assert 0 < job.stats["total_transactions"] < 48 * 20000
+    assert not job.simulator.simulation_running and queued.started_at is None
+
+def test_finished_jobs_past_the_budget_give_their_rows_back():
+    manager = JobManager(SyntheticFraudSimulator, max_workers=1, memory_budget=0, max_finished_jobs=1)
+    first = _wait(manager.submit({"duration_hours": 1, "transactions_per_hour": 500, "seed": SEED}))
+    second = _wait(manager.submit({"duration_hours": 1, "transactions_per_hour": 500, "seed": SEED}))
+    time.sleep(0.1)
+    assert manager.get(first.job_id) is None and first.simulator.transactions.nbytes == 0
+    assert second.evicted and second.simulator.transactions.nbytes == 0
+    assert second.simulator.report.total == second.stats["total_transactions"] > 0
+
+@pytest.mark.parametrize("factory, error", [
+    (SyntheticFraudSimulator, "num_users must be at least 1"),
+    (_exit_without_reporting, "Job process exited with code 3"),
+])
+def test_failed_job_processes_fail_their_jobs(factory, error):
+    manager = JobManager(factory, isolation="process", process_niceness=0)
+    job = _wait(manager.submit({"duration_hours": 1, "num_users": 0}))
+    assert job.status == FAILED and job.error == error
+    assert job.to_dict()["isolation"] == "process"
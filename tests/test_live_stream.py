@@ -0,0 +1,58 @@
+import json
+import threading
+import time
+
+import numpy as np
+
+import live_stream
+from batch_engine import BatchEngine, HOUR_US
+from live_stream import LiveStream
+from conftest import SEED, stored_rows, wait_for_job
+
+def test_publish_blocks_on_a_full_queue_until_the_consumer_catches_up(simulator):
+    batch = BatchEngine(simulator).generate(100, fraud_rate=0.0, start_us=0, span_us=HOUR_US)
+    stream = LiveStream()
+    subscription = stream.subscribe(batch_rows=10, max_pending=2)
+    publisher = threading.Thread(target=stream.publish, args=(None, batch, lambda: True))
+    publisher.start()
+    time.sleep(0.3)
+    assert publisher.is_alive() and subscription.queue.qsize() == 2
+
+    received = []
+    consumer = subscription.batches()
+    while len(received) < len(batch):
+        received.extend(next(consumer)[1].id_lo.tolist())
+    publisher.join(timeout=5)
+    assert not publisher.is_alive()
+    assert received == batch.id_lo.tolist()
+
+    stream.finish()
+    assert list(consumer) == [] and not stream
+
+def test_stopped_runs_drop_rows_for_slow_subscribers(simulator):
+    batch = BatchEngine(simulator).generate(100, fraud_rate=0.0, start_us=0, span_us=HOUR_US)
+    stream = LiveStream()
+    subscription = stream.subscribe(batch_rows=10, max_pending=2)
+    stream.publish(None, batch, lambda: False)
+    assert subscription.queue.qsize() == 2
+
+def test_sse_stream_follows_the_next_job_and_ends_with_it(client, monkeypatch):
+    # The test client waits for the first chunk, which an idle stream sends as a heartbeat
+    monkeypatch.setattr(live_stream, "HEARTBEAT_SECONDS", 0.5)
+    response = client.get("/stream_transactions?format=sse&fraud_pattern=normal&batch_rows=100&max_pending=2")
+    assert response.mimetype == "text/event-stream"
+    job_id = client.post("/run_simulation", json={"duration_hours": 1, "transactions_per_hour": 2000,
+                                                  "seed": SEED, "num_users": 300}).get_json()["job_id"]
+    events = response.get_data(as_text=True).split("\n\n")
+    assert events[0] == ": keep-alive"
+    events = [event for event in events if event and event != ": keep-alive"]
+    assert wait_for_job(client, job_id)["status"] == "completed"
+
+    rows = [row for event in events[:-1] for row in json.loads(event.split("data: ", 1)[1])]
+    assert all(event.startswith("event: transactions") for event in events[:-1])
+    assert all(row["fraud_pattern"] is None for row in rows)
+    assert events[-1] == f'event: end\ndata: {{"rows": {len(rows)}}}'
+
+    from app import jobs
+    stored = stored_rows(jobs.get(job_id).simulator)
+    assert len(rows) == int((stored.fraud_pattern == 0).sum()) > 0
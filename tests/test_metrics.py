@@ -0,0 +1,49 @@
+import re
+
+from metrics import MetricsRegistry
+from conftest import SEED, wait_for_job
+
+SAMPLE = re.compile(r'^(fraud_sim_[a-z_]+)(\{[a-z_]+="(?:[^"\\]|\\.)*"(?:,[a-z_]+="(?:[^"\\]|\\.)*")*\})? -?[0-9][0-9.e+-]*$')
+
+def _samples(text: str):
+    """(metric name, labels text, value) of every sample, checking each follows its HELP and TYPE lines"""
+    assert text.endswith("\n")
+    declared = {}
+    samples = []
+    for line in text.splitlines():
+        if line.startswith("# HELP "):
+            declared[line.split()[2]] = None
+        elif line.startswith("# TYPE "):
+            _, _, name, kind = line.split()
+            assert name in declared and kind in ("counter", "gauge")
+            declared[name] = kind
+        else:
+            match = SAMPLE.match(line)
+            assert match, line
+            assert declared.get(match.group(1)), line
+            samples.append((match.group(1), match.group(2) or "", float(line.rsplit(" ", 1)[1])))
+    return samples
+
+def test_registry_renders_escaped_labels_and_integral_values():
+    registry = MetricsRegistry()
+    registry.record_stage("load", (("path", 'a "b"\\c\n'),), 1.5, rows=10)
+    registry.gauge("depth", "Queue depth", lambda: [({"queue": "x"}, 3.0)])
+    lines = registry.render().splitlines()
+    assert 'fraud_sim_stage_seconds_total{stage="load",path="a \\"b\\"\\\\c\\n"} 1.5' in lines
+    assert 'fraud_sim_stage_rows_total{stage="load",path="a \\"b\\"\\\\c\\n"} 10' in lines
+    assert 'fraud_sim_depth{queue="x"} 3' in lines
+    _samples(registry.render())
+
+def test_metrics_endpoint_serves_the_exposition_format(client):
+    job_id = client.post("/run_simulation", json={"duration_hours": 1, "transactions_per_hour": 1000,
+                                                  "seed": SEED, "num_users": 300}).get_json()["job_id"]
+    wait_for_job(client, job_id)
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["Content-Type"].startswith("text/plain; version=0.0.4")
+    samples = _samples(response.get_data(as_text=True))
+    calls = {labels: value for name, labels, value in samples if name == "fraud_sim_stage_calls_total"}
+    for stage in ("normal_transactions", "store_append", "report_update"):
+        assert calls[f'{{stage="{stage}"}}'] >= 1
+    names = {name for name, _, _ in samples}
+    assert {"fraud_sim_jobs", "fraud_sim_process_resident_bytes", "fraud_sim_store_bytes"} <= names
@@ -0,0 +1,103 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+import app as flask_app
+from replay import Replayer, serve_stub
+from conftest import simulate
+
+@pytest.fixture(scope="module")
+def rows():
+    simulator = simulate(duration_hours=1, transactions_per_hour=200)
+    store = simulator.transactions
+    return store, store.slice(0, len(store))
+
+class _Server:
+    """A receiver on its own event loop thread, answering with `handler` or the 204 stub"""
+
+    def __init__(self, handler=None):
+        self.loop = asyncio.new_event_loop()
+        ready = threading.Event()
+
+        async def start():
+            if handler is None:
+                self.server = await serve_stub("127.0.0.1", 0)
+            else:
+                self.server = await asyncio.start_server(handler, "127.0.0.1", 0)
+            self.port = self.server.sockets[0].getsockname()[1]
+            ready.set()
+
+        threading.Thread(target=self.loop.run_forever, daemon=True).start()
+        asyncio.run_coroutine_threadsafe(start(), self.loop)
+        ready.wait(5)
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.port}/ingest"
+
+    def close(self):
+        self.loop.call_soon_threadsafe(self.server.close)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+
+def _replay(replayer: Replayer, store, batch, timeout: float = 30.0):
+    thread = replayer.start(store, iter([batch]))
+    thread.join(timeout)
+    assert not thread.is_alive(), "replay did not finish"
+
+def test_replays_every_row(rows):
+    store, batch = rows
+    server = _Server()
+    try:
+        replayer = Replayer(server.url, tps=5000, concurrency=4, rows_per_request=3)
+        _replay(replayer, store, batch)
+    finally:
+        server.close()
+    status = replayer.status()
+    assert status["rows_sent"] == len(batch)
+    assert status["requests_sent"] == -(-len(batch) // 3)
+    assert status["status_codes"] == {"204": status["requests_sent"]} and not status["errors"]
+
+def test_malformed_responses_count_as_errors(rows):
+    store, batch = rows
+
+    async def garbage(reader, writer):
+        await reader.read(1)
+        writer.write(b"garbage\r\n\r\n")
+        await writer.drain()
+        writer.close()
+
+    server = _Server(garbage)
+    try:
+        replayer = Replayer(server.url, tps=5000, concurrency=2, limit=20)
+        _replay(replayer, store, batch)
+    finally:
+        server.close()
+    assert replayer.requests_sent == 20
+    assert sum(replayer.errors.values()) == 20
+
+def test_replay_ends_when_every_worker_exits(rows, monkeypatch):
+    store, batch = rows
+
+    async def dead_worker(self, queue):
+        raise RuntimeError("worker crashed")
+
+    monkeypatch.setattr(Replayer, "_worker", dead_worker)
+    replayer = Replayer("http://127.0.0.1:9/", tps=5000, concurrency=2)
+    _replay(replayer, store, batch, timeout=10)
+    assert not replayer.running
+
+@pytest.mark.parametrize("field", ["concurrency", "rows_per_request"])
+def test_replay_route_rejects_non_positive_sizes(field):
+    client = flask_app.app.test_client()
+    response = client.post('/run_simulation', json={"duration_hours": 1, "transactions_per_hour": 50, "seed": 1})
+    job_id = response.get_json()["job_id"]
+    deadline = time.monotonic() + 30
+    while client.get(f'/jobs/{job_id}').get_json()["status"] not in ("completed", "failed"):
+        assert time.monotonic() < deadline
+        time.sleep(0.05)
+    response = client.post('/replay', json={"target_url": "http://127.0.0.1:9/", "job_id": job_id, field: 0})
+    assert response.status_code == 400
+    assert "at least 1" in response.get_json()["error"]
+    assert flask_app.replayer is None or not flask_app.replayer.running
@@ -0,0 +1,91 @@
+import json
+
+import numpy as np
+import pytest
+
+from batch_engine import COLUMN_DTYPES, TransactionBatch
+from models import FRAUD_PATTERN_CODES
+from report import DistinctCounter, HyperLogLog, ReportAggregator
+from conftest import simulate, stored_rows
+
+def test_distinct_counter_is_exact_below_its_limit():
+    rng = np.random.default_rng(1)
+    counter = DistinctCounter(exact_limit=5000)
+    values = rng.integers(0, 1 << 63, 4000, dtype=np.uint64)
+    for chunk in np.array_split(np.concatenate([values, values[::3]]), 7):
+        counter.add(chunk)
+    assert counter.sketch is None and counter.count() == 4000
+
+@pytest.mark.parametrize("distinct", [20_000, 300_000])
+def test_distinct_counter_estimates_within_a_few_percent_past_its_limit(distinct):
+    rng = np.random.default_rng(distinct)
+    counter = DistinctCounter(exact_limit=10_000)
+    values = rng.integers(0, 1 << 63, distinct, dtype=np.uint64)
+    for chunk in np.array_split(np.concatenate([values, values[:5000]]), 13):
+        counter.add(chunk)
+    assert counter.sketch is not None
+    assert abs(counter.count() - distinct) / distinct < 0.03
+
+def test_hyperloglog_counts_small_sets_by_linear_counting():
+    sketch = HyperLogLog()
+    sketch.add(np.arange(100, dtype=np.uint64))
+    assert abs(sketch.count() - 100) <= 2
+
+@pytest.mark.parametrize("distinct", [500, 50_000])
+def test_distinct_counter_state_round_trips(distinct):
+    counter = DistinctCounter(exact_limit=1000)
+    counter.add(np.arange(distinct, dtype=np.uint64))
+    restored = DistinctCounter(exact_limit=1000)
+    restored.restore(counter.state())
+    assert restored.count() == counter.count()
+    more = np.arange(distinct, distinct + 700, dtype=np.uint64)
+    counter.add(more)
+    restored.add(more)
+    assert restored.count() == counter.count()
+
+def _report(aggregator: ReportAggregator) -> str:
+    return json.dumps(aggregator.to_dict(0), sort_keys=True)
+
+def test_report_totals_match_the_rows_whatever_the_batching():
+    simulator = simulate(fraud_rate=0.3, batch_size=600)
+    rows = stored_rows(simulator)
+    report = simulator.report.to_dict(0)
+    summary = report["summary"]
+    assert summary["total_transactions"] == len(rows)
+    assert summary["fraudulent_transactions"] == int((rows.fraud_pattern > 0).sum())
+    assert summary["total_amount"] == round(int(np.round(rows.amount_base * 100).astype(np.int64).sum()) / 100, 2)
+    assert summary["unique_merchants"] == len(np.unique(rows.merchant))
+    assert summary["unique_devices"] == len(np.unique(rows.device))
+    assert summary["average_risk_score"] == round(float(rows.risk_score.mean()), 3)
+    counts = np.bincount(rows.fraud_pattern, minlength=len(FRAUD_PATTERN_CODES))
+    assert report["pattern_analysis"]["counts"] == {FRAUD_PATTERN_CODES[i]: int(counts[i])
+                                                    for i in np.flatnonzero(counts[1:]) + 1}
+    for city, totals in report["location_analysis"].items():
+        mine = np.array([simulator.locations[c]["city"] == city for c in rows.city.tolist()])
+        assert totals["total_transactions"] == int(mine.sum())
+        assert totals["fraud_transactions"] == int((rows.fraud_pattern[mine] > 0).sum())
+
+    # Fed the same rows in other chunks, or resumed from a saved state, the report is the same
+    args = (simulator.locations, simulator.num_merchants, simulator.fx_rates.base)
+    for chunks in (1, 17):
+        aggregator = ReportAggregator(*args)
+        for part in np.array_split(np.arange(len(rows)), chunks):
+            aggregator.update(rows.take(part))
+        assert _report(aggregator) == _report(simulator.report)
+    half = len(rows) // 2
+    first = ReportAggregator(*args)
+    first.update(rows.take(slice(0, half)))
+    resumed = ReportAggregator(*args)
+    resumed.restore(first.state())
+    resumed.update(rows.take(slice(half, len(rows))))
+    assert _report(resumed) == _report(simulator.report)
+
+def test_amounts_are_totalled_exactly_past_float64_precision():
+    # 10**16 + 1 cents is not a float64, so a float tally would lose the last cent
+    batch = TransactionBatch(**{name: np.zeros(3, dtype) for name, dtype in COLUMN_DTYPES.items()})
+    batch.amount_base[:] = batch.amount[:] = [1e14, 0.01, 0.01]
+    aggregator = ReportAggregator([{"city": "Lagos"}], num_merchants=1)
+    aggregator.update(batch.take(slice(0, 2)))
+    assert aggregator.pattern_amounts[0] == aggregator.currency_amounts[0] == 10**16 + 1
+    aggregator.update(batch.take(slice(2, 3)))
+    assert aggregator.method_amounts.sum() == aggregator.currency_base_amounts.sum() == 10**16 + 2
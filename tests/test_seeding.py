@@ -0,0 +1,16 @@
+from conftest import SEED, digest, simulate, stored_rows
+
+def test_same_seed_same_rows():
+    assert digest(stored_rows(simulate())) == digest(stored_rows(simulate()))
+
+def test_rows_do_not_depend_on_batch_size():
+    expected = digest(stored_rows(simulate(batch_size=10000)))
+    for batch_size in (1, 777):
+        assert digest(stored_rows(simulate(batch_size=batch_size))) == expected
+
+def test_features_do_not_depend_on_batch_size():
+    assert (digest(stored_rows(simulate(features=True, batch_size=333))) ==
+            digest(stored_rows(simulate(features=True))))
+
+def test_other_seed_other_rows():
+    assert digest(stored_rows(simulate(seed=SEED + 1))) != digest(stored_rows(simulate()))
@@ -0,0 +1,47 @@
+import dataclasses
+import json
+
+import pytest
+
+import serialization
+from serialization import JSON, MSGPACK
+from conftest import SEED, stored_rows, wait_for_job
+
+@pytest.fixture
+def job_id(client):
+    job_id = client.post("/run_simulation", json={"duration_hours": 1, "transactions_per_hour": 1000,
+                                                  "seed": SEED, "num_users": 300, "features": True}).get_json()["job_id"]
+    wait_for_job(client, job_id)
+    return job_id
+
+def test_encoded_rows_match_the_decoded_transactions(job_id):
+    from app import jobs
+    store = jobs.get(job_id).simulator.transactions
+    batch = stored_rows(jobs.get(job_id).simulator).take(slice(0, 300))
+    expected = [dataclasses.asdict(transaction) for transaction in store.to_transactions(batch)]
+    assert [json.loads(row) for row in store.encoder.json_rows(batch)] == json.loads(json.dumps(expected))
+
+@pytest.mark.parametrize("query", ["", "?start=10&limit=25"])
+def test_unchanged_reports_answer_if_none_match_with_304(client, job_id, query):
+    url = f"/jobs/{job_id}/report{query}"
+    first = client.get(url)
+    assert first.status_code == 200 and first.headers["ETag"] and first.mimetype == JSON
+    again = client.get(url, headers={"If-None-Match": first.headers["ETag"]})
+    assert again.status_code == 304 and not again.data
+    assert again.headers["ETag"] == first.headers["ETag"]
+    assert client.get(url, headers={"If-None-Match": '"stale"'}).status_code == 200
+
+def test_msgpack_is_negotiated_by_accept_header(client, job_id):
+    msgpack = pytest.importorskip("msgpack")
+    url = f"/jobs/{job_id}/report?start=0&limit=20"
+    as_json = client.get(url).get_json()
+    response = client.get(url, headers={"Accept": "application/msgpack"})
+    assert response.mimetype == MSGPACK
+    assert response.headers["ETag"] != client.get(url).headers["ETag"]
+    assert msgpack.unpackb(response.data) == as_json
+
+def test_json_is_served_when_msgpack_is_unavailable(client, job_id, monkeypatch):
+    monkeypatch.setattr(serialization, "msgpack", None)
+    response = client.get(f"/jobs/{job_id}/report?limit=5", headers={"Accept": "application/msgpack"})
+    assert response.status_code == 200 and response.mimetype == JSON
+    assert len(response.get_json()["transactions"]) == 5
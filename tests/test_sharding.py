@@ -0,0 +1,65 @@
+import multiprocessing as mp
+import tracemalloc
+
+import numpy as np
+
+import sharding
+from app import SyntheticFraudSimulator
+from batch_engine import COLUMN_DTYPES
+from currency import DEFAULT_RATES
+from traffic import TrafficModel
+from conftest import SEED, digest, simulate, stored_rows
+
+def test_hour_shards_match_single_process():
+    single = simulate()
+    sharded = simulate(workers=2, shard_by="hours")
+    assert digest(stored_rows(sharded)) == digest(stored_rows(single))
+    assert sharded.generate_report(limit=0)["summary"] == single.generate_report(limit=0)["summary"]
+
+def test_user_shards_are_deterministic():
+    first = simulate(workers=2, shard_by="users")
+    second = simulate(workers=2, shard_by="users")
+    rows = stored_rows(first)
+    assert digest(rows) == digest(stored_rows(second))
+    assert np.all(np.diff(rows.timestamp_us) >= 0)
+
+def test_sharded_progress_weights_cities_like_single_process(monkeypatch):
+    shares = []
+    expected_steps = TrafficModel.expected_steps
+
+    def recording(self, start_us, hours, steps_per_hour, city_share=None):
+        shares.append(city_share)
+        return expected_steps(self, start_us, hours, steps_per_hour, city_share)
+
+    monkeypatch.setattr(TrafficModel, "expected_steps", recording)
+    traffic = {"profile": "realistic"}
+    simulate(traffic=traffic)
+    simulate(traffic=traffic, workers=2)
+    assert len(shares) == 2 and shares[1] is not None
+    assert np.array_equal(shares[0], shares[1])
+
+def _shard_spec(hours: int, path: str):
+    """A spec of one hour shard, as run_sharded fills them in"""
+    spec = sharding.plan_shards(1, hours, 10000)[0]
+    spec.update({"index": 0, "simulator_cls": SyntheticFraudSimulator, "seed": SEED, "num_users": 300,
+                 "pool_sizes": {"num_devices": 10000, "num_merchants": 1000, "num_cities": None},
+                 "start_us": 0, "batch_size": 2000, "fraud_rate": 0.15, "fraud_patterns": None,
+                 "traffic": None, "fx_rates": DEFAULT_RATES, "path": path})
+    return spec
+
+def test_shard_workers_hold_one_chunk_at_a_time(tmp_path, monkeypatch):
+    monkeypatch.setattr(sharding, "_progress", mp.Array("q", 1, lock=False))
+    monkeypatch.setattr(sharding, "_stop", mp.Event())
+    peaks, rows = [], []
+    for hours in (1, 6):
+        tracemalloc.start()
+        result = sharding.simulate_shard(_shard_spec(hours, str(tmp_path / f"shard-{hours}")))
+        peaks.append(tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+        rows.append(result["rows"])
+        shard = sharding.load_shard(result["path"], result["rows"])
+        assert len(shard) == result["rows"] and np.all(np.diff(shard.timestamp_us) >= 0)
+    shard_bytes = rows[1] * sum(np.dtype(dtype).itemsize for dtype in COLUMN_DTYPES.values())
+    # Six times the rows, but the peak stays that of generating one chunk
+    assert rows[1] > 5 * rows[0]
+    assert peaks[1] - peaks[0] < shard_bytes / 4
@@ -0,0 +1,41 @@
+from metrics import METRICS
+from serialization import JSON
+from snapshots import take_snapshot
+from conftest import SEED, wait_for_job
+
+def _serializations() -> int:
+    """Reports encoded for requests so far"""
+    return sum(totals[1] for totals in METRICS.stage_totals("report_serialization").values())
+
+def test_report_polls_reuse_the_snapshot(client, monkeypatch):
+    from app import jobs
+    job_id = client.post("/run_simulation", json={"duration_hours": 1, "transactions_per_hour": 1000,
+                                                  "seed": SEED, "num_users": 300}).get_json()["job_id"]
+    wait_for_job(client, job_id)
+    job = jobs.get(job_id)
+    url = f"/jobs/{job_id}/report"
+    on_demand = job.simulator.report_page
+
+    # Default pages come from the snapshot: polls neither rebuild the report nor encode it
+    def rebuilt(*args, **kwargs):
+        raise AssertionError("report page rebuilt")
+    monkeypatch.setattr(job.simulator, "report_page", rebuilt)
+    encoded = _serializations()
+    first = client.get(url)
+    again = client.get(url)
+    assert first.status_code == again.status_code == 200
+    assert first.data == again.data == job.snapshot.reports[JSON]
+    assert first.headers["ETag"] == again.headers["ETag"]
+    assert client.get(url, headers={"If-None-Match": first.headers["ETag"]}).status_code == 304
+    assert _serializations() == encoded
+
+    # A new snapshot gets a new ETag
+    monkeypatch.setattr(job.simulator, "report_page", on_demand)
+    job.snapshot = take_snapshot(job.simulator)
+    fresh = client.get(url, headers={"If-None-Match": first.headers["ETag"]})
+    assert fresh.status_code == 200 and fresh.headers["ETag"] != first.headers["ETag"]
+
+    # and says what building the page on demand would
+    snapshot, job.snapshot = job.snapshot, None
+    assert client.get(url).get_json() == fresh.get_json()
+    job.snapshot = snapshot
@@ -0,0 +1,48 @@
+import numpy as np
+import pytest
+
+from batch_engine import BatchEngine, HOUR_US
+from models import LOCATIONS
+from traffic import TrafficModel
+from conftest import simulate, stored_rows
+
+class _HighDraws:
+    """Generator whose uniform draws all sit just below 1, where round-off overshoots the last city"""
+
+    def __init__(self, rng: np.random.Generator):
+        self.rng = rng
+
+    def exponential(self, *args):
+        return self.rng.exponential(*args)
+
+    def random(self, n: int) -> np.ndarray:
+        return np.full(n, np.nextafter(1.0, 0.0))
+
+def _share(empty):
+    share = np.ones(len(LOCATIONS))
+    share[empty] = 0
+    return share / share.sum()
+
+@pytest.mark.parametrize("draws", [np.random.default_rng, lambda seed: _HighDraws(np.random.default_rng(seed))])
+def test_steps_never_land_in_cities_without_users(draws):
+    model = TrafficModel.from_dict({"profile": "realistic"}, LOCATIONS)
+    empty = [0, 3, len(LOCATIONS) - 1]
+    share = _share(empty)
+    for hour in range(0, 48, 5):
+        times, cities = model.schedule(draws(hour), hour * HOUR_US, 5000, share)
+        assert len(times) and np.all(np.diff(times) >= 0)
+        assert not np.isin(cities, empty).any()
+
+def test_traffic_runs_with_empty_cities():
+    simulator = simulate(num_users=5, traffic={"profile": "realistic"})
+    table = simulator.user_table
+    assert len(np.unique(table.home_city)) < len(simulator.locations)
+    rows = stored_rows(simulator)
+    assert len(rows) and np.isin(rows.user, np.arange(5)).all()
+
+def test_steps_in_cities_without_users_are_refused(simulator):
+    simulator._reset_users(3)
+    engine = BatchEngine(simulator)
+    empty = np.flatnonzero(engine.city_share == 0)
+    with pytest.raises(ValueError):
+        engine.generate(3, times=np.arange(3), cities=np.full(3, empty[0]))
@@ -0,0 +1,119 @@
+import os
+
+import numpy as np
+import pytest
+
+from batch_engine import BatchEngine, COLUMN_DTYPES, HOUR_US, TransactionBatch, format_timestamp
+from currency import FxRates
+from models import CURRENCIES, FRAUD_PATTERN_CODES, PAYMENT_METHODS, TRANSACTION_CATEGORIES
+from transaction_index import AMOUNT_BIN_EDGES, BLOCK_SEGMENTS, TransactionQuery, amount_bin_edges
+from transaction_store import TransactionStore
+from conftest import digest, simulate, stored_rows
+
+SEGMENT_ROWS = 1000
+
+def fill(simulator, **kwargs) -> TransactionStore:
+    store = TransactionStore(simulator.users.ids, simulator.merchant_ids, simulator.locations,
+                             segment_rows=SEGMENT_ROWS, indexed=True, **kwargs)
+    engine = BatchEngine(simulator)
+    for hour in range(4):
+        store.append_batch(engine.generate(3000, fraud_rate=0.2, start_us=hour * HOUR_US, span_us=HOUR_US))
+    return store
+
+def test_spilled_store_reads_back_like_an_in_memory_one(simulator, tmp_path):
+    memory = fill(simulator)
+    spilled = fill(simulator, memory_budget=3 * SEGMENT_ROWS * 100, spill_dir=str(tmp_path))
+    assert memory.spilled == 0 and spilled.spilled > 0 and spilled.spilled_bytes > 0
+    assert spilled.nbytes < memory.nbytes
+    assert len(spilled) == len(memory)
+    for start, stop in [(0, len(memory)), (0, 10), (995, 1005), (2500, 7300), (len(memory) - 5, len(memory))]:
+        assert digest(spilled.slice(start, stop)) == digest(memory.slice(start, stop))
+    for name in COLUMN_DTYPES:
+        assert np.array_equal(spilled.column(name), memory.column(name))
+
+    query = TransactionQuery.from_params({"fraud_pattern": ["rapid_fire"]}, simulator.locations)
+    cursors = [0, 0]
+    for _ in range(5):
+        (a, cursors[0], _), (b, cursors[1], _) = memory.query(query, cursors[0], 97), spilled.query(query, cursors[1], 97)
+        assert cursors[0] == cursors[1] and digest(a) == digest(b)
+
+    spill_path = spilled._spill_path
+    assert os.listdir(spill_path)
+    spilled.clear()
+    assert len(spilled) == 0 and not os.path.exists(spill_path)
+
+def test_run_with_a_memory_budget_retains_the_same_rows():
+    params = {"duration_hours": 1, "transactions_per_hour": 150_000}
+    reference = simulate(**params)
+    budgeted = simulate(store_memory_budget=1, **params)
+    assert budgeted.transactions.spilled == len(budgeted.transactions.segments) > 0
+    assert digest(stored_rows(budgeted)) == digest(stored_rows(reference))
+
+def _expected(rows, params, locations) -> np.ndarray:
+    """Rows matching request parameters, by a NumPy mask over every row"""
+    vocabularies = {"fraud_pattern": FRAUD_PATTERN_CODES, "payment_method": PAYMENT_METHODS,
+                    "city": [location["city"] for location in locations], "currency": CURRENCIES,
+                    "category": TRANSACTION_CATEGORIES}
+    keep = np.ones(len(rows), dtype=bool)
+    for name, column in [("fraud_pattern", "fraud_pattern"), ("payment_method", "payment_method"),
+                         ("city", "city"), ("currency", "currency"), ("merchant_category", "category")]:
+        if params.get(name):
+            codes = [0 if value == "normal" else vocabularies[column].index(value) for value in params[name]]
+            keep &= np.isin(getattr(rows, column), codes)
+    if "min_amount" in params:
+        keep &= rows.amount_base >= params["min_amount"]
+    if "max_amount" in params:
+        keep &= rows.amount_base <= params["max_amount"]
+    if "start_time" in params:
+        keep &= rows.timestamp_us >= params["start_us"]
+    if "end_time" in params:
+        keep &= rows.timestamp_us < params["end_us"]
+    return np.flatnonzero(keep)
+
+@pytest.mark.parametrize("base", ["USD", "JPY"])
+def test_query_matches_a_scan_of_every_row(simulator, tmp_path, base):
+    simulator._use_fx_rates(FxRates.from_dict({"base": base}))
+    scale = simulator.fx_rates.model_rate
+    edges = amount_bin_edges(scale)
+    assert np.array_equal(edges, AMOUNT_BIN_EDGES * (100 if base == "JPY" else 1))
+    # Small segments and no memory budget: full index blocks and every sealed segment are spilled
+    store = TransactionStore(simulator.users.ids, simulator.merchant_ids, simulator.locations, segment_rows=64,
+                             indexed=True, memory_budget=0, spill_dir=str(tmp_path), amount_bin_edges=edges)
+    engine = BatchEngine(simulator)
+    for hour in range(4):
+        store.append_batch(engine.generate(3000, fraud_rate=0.3, start_us=hour * HOUR_US, span_us=HOUR_US))
+    assert store.index.spilled >= 2 and store.spilled == len(store.segments)
+    # The last block is partly filled and an open tail is scanned
+    assert len(store.segments) % BLOCK_SEGMENTS and len(store) % 64
+    rows = store.slice(0, len(store))
+
+    cities = [location["city"] for location in simulator.locations]
+    start_us, end_us = HOUR_US + 123_456_789, 3 * HOUR_US - 17
+    queries = [
+        {},
+        {"fraud_pattern": ["rapid_fire", "normal"]},
+        {"fraud_pattern": ["velocity_attack", "account_takeover"], "currency": CURRENCIES[:5]},
+        # Accepting most codes, or most amount bins, inverts the rejected bitmaps instead
+        {"payment_method": PAYMENT_METHODS[:4], "city": cities[1:]},
+        {"min_amount": 5 * scale},
+        {"min_amount": 20 * scale, "max_amount": 500 * scale},
+        {"min_amount": 13.37 * scale, "max_amount": 7_000 * scale, "merchant_category": TRANSACTION_CATEGORIES[::2]},
+        {"max_amount": 7.5 * scale, "fraud_pattern": ["normal"]},
+        {"start_time": format_timestamp(start_us), "end_time": format_timestamp(end_us), "city": cities[:3]},
+        {"min_amount": 100 * scale, "max_amount": 10 * scale},
+    ]
+    for params in queries:
+        query = TransactionQuery.from_params(params, simulator.locations)
+        expected = _expected(rows, dict(params, start_us=start_us, end_us=end_us), simulator.locations)
+        for start in [0, 1234, len(store) - 100]:
+            found, cursor, truncated = [], start, True
+            while truncated:
+                batch, cursor, truncated = store.query(query, cursor, limit=37)
+                assert len(batch) == 37 or not truncated
+                found.append(batch)
+            assert cursor == len(store)
+            assert digest(TransactionBatch.concat(found)) == digest(rows.take(expected[expected >= start])), params
+
+def test_runs_bin_amounts_in_their_base_currency():
+    simulator = simulate(duration_hours=1, fx_rates={"base": "JPY"})
+    assert np.array_equal(simulator.transactions.index.amount_edges, AMOUNT_BIN_EDGES * 100)
@@ -0,0 +1,42 @@
+import uuid
+from dataclasses import fields
+
+import numpy as np
+import pytest
+
+from models import LOCATIONS
+from user_table import USER_CHUNK, UserIds, UserTable, load_or_build_users
+from conftest import SEED
+
+def _users(num_users: int, cache_dir=None) -> UserTable:
+    return load_or_build_users(SEED, np.random.SeedSequence(SEED), num_users, 2000, 300, len(LOCATIONS), cache_dir)
+
+def test_cached_users_equal_built_ones(tmp_path):
+    built = _users(500)
+    cached = _users(500, str(tmp_path))
+    for f in fields(UserTable):
+        assert np.array_equal(getattr(cached, f.name), getattr(built, f.name)), f.name
+    assert np.array_equal(_users(500, str(tmp_path)).id_hi, built.id_hi)
+
+def test_smaller_populations_are_prefixes_across_chunks():
+    large = _users(USER_CHUNK + 300)
+    for size in (1000, USER_CHUNK, USER_CHUNK + 1):
+        small = _users(size)
+        for name in ("id_hi", "id_lo", "home_city", "account_age_days", "average_amount", "risk_profile"):
+            assert np.array_equal(getattr(small, name), getattr(large, name)[:size]), name
+        for lists in ("merchant", "device"):
+            offsets = getattr(small, f"{lists}_offsets")
+            assert np.array_equal(offsets, getattr(large, f"{lists}_offsets")[:size + 1])
+            assert np.array_equal(getattr(small, f"{lists}s"), getattr(large, f"{lists}s")[:offsets[-1]])
+
+def test_user_ids_index_round_trips():
+    table = _users(USER_CHUNK + 300)
+    ids = UserIds(table)
+    rows = np.random.default_rng(0).integers(0, len(table), 200).tolist() + [0, USER_CHUNK, len(table) - 1]
+    for row in rows:
+        assert ids.index(ids[row]) == row
+        assert ids[row] in ids
+    assert ids.take(np.array(rows)) == [ids[row] for row in rows]
+    assert str(uuid.UUID(int=0)) not in ids
+    with pytest.raises(ValueError):
+        ids.index("not-a-uuid")
@@ -0,0 +1,174 @@
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Any, Optional, Sequence, Tuple
+from zoneinfo import ZoneInfo
+
+import numpy as np
+
+from batch_engine import EPOCH, HOUR_US
+
+MINUTE_US = 60_000_000
+MINUTES = 60
+
+TRAFFIC_PROFILES = ["flat", "realistic"]
+
+# Relative card traffic by local hour of day: a night trough, a lunchtime
+# plateau and an evening peak
+DIURNAL_WEIGHTS = np.array([
+    0.25, 0.15, 0.10, 0.08, 0.08, 0.12, 0.30, 0.60, 0.95, 1.20, 1.35, 1.45,
+    1.55, 1.50, 1.40, 1.35, 1.35, 1.45, 1.60, 1.65, 1.55, 1.25, 0.85, 0.50,
+])
+DIURNAL_WEIGHTS = DIURNAL_WEIGHTS / DIURNAL_WEIGHTS.mean()
+_DIURNAL_WRAPPED = np.append(DIURNAL_WEIGHTS, DIURNAL_WEIGHTS[0])
+
+# Monday first: busier towards the weekend, quieter on Sunday
+WEEKDAY_WEIGHTS = np.array([0.95, 0.95, 0.97, 1.00, 1.12, 1.08, 0.93])
+WEEKDAY_WEIGHTS = WEEKDAY_WEIGHTS / WEEKDAY_WEIGHTS.mean()
+
+# January first: a post-holiday dip and the November/December shopping season
+MONTH_WEIGHTS = np.array([0.92, 0.88, 0.95, 0.96, 0.98, 0.97, 0.98, 0.99, 0.96, 0.99, 1.10, 1.32])
+MONTH_WEIGHTS = MONTH_WEIGHTS / MONTH_WEIGHTS.mean()
+
+@dataclass
+class Burst:
+    """Traffic multiplied by `multiplier` over [start_us, start_us + duration_us), in one city or all"""
+    start_us: int
+    duration_us: int
+    multiplier: float
+    city: Optional[int] = None
+
+class TrafficModel:
+    """Transaction rate over simulated time, per city.
+
+    The rate of a city at a moment is the run's base rate (transactions per
+    hour, spread over cities by their share of users) times the diurnal,
+    weekday and month weights at that moment in the city's own timezone,
+    times any bursts covering it. Weights average 1, so over a typical week
+    the base rate is the mean rate. The diurnal curve is interpolated
+    between hours and the rate is held constant over each minute.
+    """
+
+    def __init__(self, locations: Sequence[Dict], diurnal: bool = True, weekly: bool = True,
+                 seasonal: bool = True, bursts: Sequence[Burst] = ()):
+        self.timezones = [location["timezone"] for location in locations]
+        self.diurnal = diurnal
+        self.weekly = weekly
+        self.seasonal = seasonal
+        self.bursts = list(bursts)
+        self._zones = [ZoneInfo(name) for name in self.timezones]
+
+    @classmethod
+    def from_dict(cls, spec: Optional[Dict[str, Any]], locations: Sequence[Dict]) -> Optional["TrafficModel"]:
+        """Model for a request's traffic spec; None (evenly spaced steps) for a flat profile without bursts
+
+        e.g. {"profile": "realistic", "bursts": [{"start": "2024-01-01T18:00:00",
+        "duration_minutes": 30, "multiplier": 4, "city": "Lagos"}]}
+        """
+        if not spec:
+            return None
+        profile = spec.get("profile", "realistic")
+        if profile not in TRAFFIC_PROFILES:
+            raise ValueError(f"Unsupported traffic profile: {profile}")
+        city_index = {location["city"]: i for i, location in enumerate(locations)}
+        bursts = []
+        for burst in spec.get("bursts") or []:
+            city = burst.get("city")
+            if city is not None and city not in city_index:
+                raise ValueError(f"Unknown burst city: {city}")
+            duration_us = int(float(burst.get("duration_minutes", 60)) * MINUTE_US)
+            multiplier = float(burst.get("multiplier", 3.0))
+            if duration_us <= 0 or multiplier < 0:
+                raise ValueError("Bursts need a positive duration and a non-negative multiplier")
+            start = datetime.fromisoformat(burst["start"])
+            if start.tzinfo is not None:
+                start = start.astimezone(timezone.utc).replace(tzinfo=None)
+            bursts.append(Burst((start - EPOCH) // timedelta(microseconds=1), duration_us, multiplier,
+                                None if city is None else city_index[city]))
+        if profile == "flat" and not bursts:
+            return None
+        realistic = profile == "realistic"
+        return cls(locations, diurnal=realistic, weekly=realistic, seasonal=realistic, bursts=bursts)
+
+    def __getstate__(self):
+        # ZoneInfo objects are rebuilt from their names in worker processes
+        state = self.__dict__.copy()
+        del state["_zones"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._zones = [ZoneInfo(name) for name in self.timezones]
+
+    def rates(self, hour_start_us: int) -> np.ndarray:
+        """(cities, MINUTES) rate multipliers for each minute of the hour starting at `hour_start_us`"""
+        rates = np.ones((len(self._zones), MINUTES))
+        minutes = np.arange(MINUTES)
+        if self.diurnal or self.weekly or self.seasonal:
+            utc = datetime(1970, 1, 1, tzinfo=timezone.utc) + timedelta(microseconds=hour_start_us)
+            for city, zone in enumerate(self._zones):
+                local = utc.astimezone(zone)
+                minute_of_day = local.hour * 60 + local.minute + minutes
+                if self.diurnal:
+                    # Hourly weights sit at the middle of each hour, wrapping around midnight
+                    position = (minute_of_day / 60 - 0.5) % 24
+                    rates[city] *= np.interp(position, np.arange(25), _DIURNAL_WRAPPED)
+                if self.weekly:
+                    rates[city] *= WEEKDAY_WEIGHTS[(local.weekday() + minute_of_day // 1440) % 7]
+                if self.seasonal:
+                    rates[city] *= MONTH_WEIGHTS[local.month - 1]
+        for burst in self.bursts:
+            # Fraction of each minute the burst covers
+            starts = hour_start_us + minutes * MINUTE_US
+            covered = np.clip(np.minimum(starts + MINUTE_US, burst.start_us + burst.duration_us)
+                              - np.maximum(starts, burst.start_us), 0, MINUTE_US) / MINUTE_US
+            factor = 1 + (burst.multiplier - 1) * covered
+            if burst.city is None:
+                rates *= factor
+            else:
+                rates[burst.city] *= factor
+        return rates
+
+    def expected_steps(self, start_us: int, hours: Sequence[int], steps_per_hour: int,
+                       city_share: Optional[np.ndarray] = None) -> float:
+        """Mean number of steps over `hours`, for progress reporting"""
+        if city_share is None:
+            city_share = np.full(len(self._zones), 1 / max(len(self._zones), 1))
+        return float(sum((city_share @ self.rates(start_us + hour * HOUR_US)).mean() for hour in hours)
+                     * steps_per_hour)
+
+    def schedule(self, rng: np.random.Generator, hour_start_us: int, steps_per_hour: int,
+                 city_share: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Arrival times (sorted) and cities of the steps in one simulated hour.
+
+        Every user is a Poisson process at its city's rate, so the hour's
+        arrivals are one non-homogeneous Poisson process at the summed rate,
+        each arrival belonging to a city in proportion to the cities' rates
+        at that moment. Inter-arrival gaps are drawn as unit exponentials in
+        integrated-rate time and mapped back to simulated time through the
+        inverse of the integrated rate, which yields them already in order.
+        """
+        rate = city_share[:, None] * self.rates(hour_start_us) * (steps_per_hour / MINUTES)
+        per_minute = rate.sum(axis=0)
+        integrated = np.concatenate([[0.0], np.cumsum(per_minute)])
+        total = integrated[-1]
+        if total <= 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int16)
+
+        arrivals = np.cumsum(rng.exponential(1.0, int(total + 6 * np.sqrt(total)) + 16))
+        while arrivals[-1] < total:
+            arrivals = np.concatenate([arrivals, arrivals[-1] + np.cumsum(rng.exponential(1.0, len(arrivals)))])
+        arrivals = arrivals[arrivals < total]
+
+        minute = np.minimum(np.searchsorted(integrated, arrivals, side="right") - 1, MINUTES - 1)
+        within = (arrivals - integrated[minute]) / per_minute[minute]
+        times = hour_start_us + ((minute + within) * MINUTE_US).astype(np.int64)
+
+        # Cumulative city shares of each minute's rate, laid out as minute + share in [0, 1]
+        shares = np.divide(np.cumsum(rate, axis=0), per_minute, out=np.zeros_like(rate), where=per_minute > 0)
+        bounds = (np.arange(MINUTES) + shares).T.ravel()
+        position = minute + rng.random(len(arrivals))
+        cities = np.searchsorted(bounds, position, side="right") - minute * len(city_share)
+        # Round-off can leave a minute's last bound just below 1; positions past it go to the
+        # last city with a positive rate that minute, never to one with no users to draw from
+        last = len(city_share) - 1 - np.argmax(rate[::-1] > 0, axis=0)
+        return times, np.minimum(cities, last[minute]).astype(np.int16)
@@ -0,0 +1,244 @@
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Any, Optional, Sequence, Tuple
+
+import numpy as np
+
+from models import CURRENCIES, TRANSACTION_CATEGORIES, PAYMENT_METHODS, FRAUD_PATTERN_CODES
+from batch_engine import TransactionBatch, EPOCH
+from live_stream import code_mask
+
+# Query field -> (indexed code column, vocabulary); cities are the store's locations
+QUERY_FIELDS = {
+    "fraud_pattern": ("fraud_pattern", FRAUD_PATTERN_CODES),
+    "payment_method": ("payment_method", PAYMENT_METHODS),
+    "city": ("city", None),
+    "currency": ("currency", CURRENCIES),
+    "merchant_category": ("category", TRANSACTION_CATEGORIES),
+}
+INDEXED_COLUMNS = [column for column, _ in QUERY_FIELDS.values()]
+
+# Amount bins of the bitmap index in US dollars, on a 1-2-5 series so round query bounds fall on bin edges;
+# see amount_bin_edges for other base currencies
+AMOUNT_BIN_EDGES = np.array([-np.inf, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, np.inf])
+
+# Sealed segments per bitmap block; blocks are the unit of vectorized matching and of spilling
+BLOCK_SEGMENTS = 64
+
+def amount_bin_edges(scale: float) -> np.ndarray:
+    """AMOUNT_BIN_EDGES for a base currency worth 1/`scale` US dollars
+
+    The edges are shifted by the power of ten nearest `scale`, so they
+    span the amounts actually drawn while staying on the 1-2-5 series.
+    """
+    return AMOUNT_BIN_EDGES * 10.0 ** np.round(np.log10(scale))
+
+def _parse_time(value: str) -> int:
+    """Simulated microseconds of an ISO timestamp (naive ones are UTC)"""
+    moment = datetime.fromisoformat(value)
+    if moment.tzinfo is not None:
+        moment = moment.astimezone(timezone.utc).replace(tzinfo=None)
+    return (moment - EPOCH) // timedelta(microseconds=1)
+
+@dataclass
+class TransactionQuery:
+    """Predicates over stored rows; a row matches when it passes all of them.
+
+    `codes` maps indexed code columns to boolean tables over their codes;
+    amounts are inclusive bounds on the base-currency amount and times a
+    half-open [start_us, end_us) range of simulated microseconds.
+    """
+    codes: Dict[str, np.ndarray] = field(default_factory=dict)
+    min_amount: Optional[float] = None
+    max_amount: Optional[float] = None
+    start_us: Optional[int] = None
+    end_us: Optional[int] = None
+
+    @classmethod
+    def from_params(cls, params: Dict[str, Any], locations: Sequence[Dict]) -> "TransactionQuery":
+        """Query from request parameters: lists of names per QUERY_FIELDS field, "normal" selecting
+        non-fraudulent rows, plus min_amount, max_amount, start_time and end_time"""
+        query = cls()
+        for name, (column, vocabulary) in QUERY_FIELDS.items():
+            if params.get(name):
+                if vocabulary is None:
+                    vocabulary = [location["city"] for location in locations]
+                query.codes[column] = code_mask(params[name], vocabulary, name)
+        for bound in ("min_amount", "max_amount"):
+            if params.get(bound) is not None:
+                setattr(query, bound, float(params[bound]))
+        if params.get("start_time"):
+            query.start_us = _parse_time(params["start_time"])
+        if params.get("end_time"):
+            query.end_us = _parse_time(params["end_time"])
+        return query
+
+    @property
+    def empty(self) -> bool:
+        """Whether no row can match, e.g. for contradictory ranges"""
+        if any(not mask.any() for mask in self.codes.values()):
+            return True
+        if self.min_amount is not None and self.max_amount is not None and self.min_amount > self.max_amount:
+            return True
+        return self.start_us is not None and self.end_us is not None and self.start_us >= self.end_us
+
+    def matches(self, batch: TransactionBatch, rows: np.ndarray) -> np.ndarray:
+        """Which of `rows` of `batch` pass every predicate"""
+        keep = np.ones(len(rows), dtype=bool)
+        for column, mask in self.codes.items():
+            keep &= mask[getattr(batch, column)[rows]]
+        if self.min_amount is not None or self.max_amount is not None:
+            amount = batch.amount_base[rows]
+            if self.min_amount is not None:
+                keep &= amount >= self.min_amount
+            if self.max_amount is not None:
+                keep &= amount <= self.max_amount
+        if self.start_us is not None or self.end_us is not None:
+            timestamp = batch.timestamp_us[rows]
+            if self.start_us is not None:
+                keep &= timestamp >= self.start_us
+            if self.end_us is not None:
+                keep &= timestamp < self.end_us
+        return keep
+
+class _Block:
+    """Bitmaps and zone maps of up to BLOCK_SEGMENTS consecutive sealed segments"""
+
+    def __init__(self, codes: int, segment_bytes: int):
+        # Row r of segment s within the block is bit r of bytes [s * segment_bytes, (s + 1) * segment_bytes)
+        self.bitmaps = np.zeros((codes, BLOCK_SEGMENTS * segment_bytes), dtype=np.uint8)
+        self.timestamps = np.zeros((BLOCK_SEGMENTS, 2), dtype=np.int64)
+        self.amounts = np.zeros((BLOCK_SEGMENTS, 2))
+        self.segments = 0
+
+class BitmapIndex:
+    """Bitmap index over the sealed segments of a TransactionStore.
+
+    Every code of the indexed columns, and every bin of `amount_edges`
+    (base-currency amounts, AMOUNT_BIN_EDGES by default), has one bit per row saying whether the row has it. A query ORs the
+    bitmaps of the codes (or fully or partly covered amount bins) it
+    accepts per column, or inverts those of the ones it rejects, and ANDs
+    the columns, a few vectorized passes over a block of segments at once,
+    so only segments with candidate rows are visited at all. Per-segment minimum and maximum timestamps and amounts
+    clear whole segments outside the query's ranges. Candidates are then
+    checked exactly against the query, which settles partly covered bins
+    and segments.
+
+    Bitmaps live in blocks of BLOCK_SEGMENTS segments; full blocks are
+    moved to memory-mapped files by spill().
+    """
+
+    def __init__(self, cardinalities: Dict[str, int], segment_rows: int,
+                 amount_edges: np.ndarray = AMOUNT_BIN_EDGES):
+        if segment_rows % 8:
+            raise ValueError("Indexed segments must hold a multiple of 8 rows")
+        self.segment_rows = segment_rows
+        self.amount_edges = amount_edges
+        self.segment_bytes = segment_rows // 8
+        # First bitmap of each column; amount bins come last
+        self.offsets: Dict[str, int] = {}
+        codes = 0
+        for column in INDEXED_COLUMNS:
+            self.offsets[column] = codes
+            codes += cardinalities[column]
+        self.offsets["amount"] = codes
+        self.codes = codes + len(amount_edges) - 1
+        self.blocks: List[_Block] = []
+        self.spilled = 0
+
+    def __len__(self) -> int:
+        """Segments indexed"""
+        return sum(block.segments for block in self.blocks)
+
+    @property
+    def nbytes(self) -> int:
+        """Memory held by bitmaps not spilled"""
+        return sum(self.codes * block.segments * self.segment_bytes for block in self.blocks[self.spilled:])
+
+    def add(self, segment: TransactionBatch):
+        """Index the next sealed segment"""
+        if not self.blocks or self.blocks[-1].segments == BLOCK_SEGMENTS:
+            self.blocks.append(_Block(self.codes, self.segment_bytes))
+        block = self.blocks[-1]
+        rows = np.arange(len(segment))
+        bits = np.zeros((self.codes, self.segment_rows), dtype=bool)
+        for column in INDEXED_COLUMNS:
+            bits[self.offsets[column] + getattr(segment, column).astype(np.int64), rows] = True
+        bins = np.searchsorted(self.amount_edges, segment.amount_base, side="right") - 1
+        bits[self.offsets["amount"] + bins, rows] = True
+        position = block.segments * self.segment_bytes
+        block.bitmaps[:, position:position + self.segment_bytes] = np.packbits(bits, axis=1)
+        block.timestamps[block.segments] = segment.timestamp_us.min(), segment.timestamp_us.max()
+        block.amounts[block.segments] = segment.amount_base.min(), segment.amount_base.max()
+        block.segments += 1
+
+    def spill(self, path: str, write, map_array):
+        """Move the oldest full block still in memory to `path`, if there is one; True if one was moved"""
+        if self.spilled >= len(self.blocks) or self.blocks[self.spilled].segments < BLOCK_SEGMENTS:
+            return False
+        block = self.blocks[self.spilled]
+        write(path, [block.bitmaps])
+        block.bitmaps = map_array(path, [(np.uint8, block.bitmaps.size)])[0].reshape(block.bitmaps.shape)
+        self.spilled += 1
+        return True
+
+    def _columns(self, query: TransactionQuery) -> List[Tuple[np.ndarray, bool]]:
+        """Per constrained column, the bitmaps to OR and whether the result must be inverted
+
+        A column accepting most of its codes (or amount bins) ORs the ones
+        it rejects and inverts that instead, so no more than half of its
+        bitmaps are ever read; one rejecting nothing is left out.
+        """
+        masks = [(self.offsets[column], mask) for column, mask in query.codes.items()]
+        if query.min_amount is not None or query.max_amount is not None:
+            low = -np.inf if query.min_amount is None else query.min_amount
+            high = np.inf if query.max_amount is None else query.max_amount
+            # Bins overlapping [low, high]
+            edges = self.amount_edges
+            masks.append((self.offsets["amount"], (edges[1:] > low) & (edges[:-1] <= high)))
+        columns = []
+        for offset, mask in masks:
+            if mask.all():
+                continue
+            if mask.sum() * 2 > len(mask):
+                columns.append((offset + np.flatnonzero(~mask), True))
+            else:
+                columns.append((offset + np.flatnonzero(mask), False))
+        return columns
+
+    def candidates(self, block_index: int, query: TransactionQuery) -> np.ndarray:
+        """(segments, segment_bytes) packed bits of the block's rows that may match `query`"""
+        block = self.blocks[block_index]
+        segments = block.segments
+        candidates = np.zeros((segments, self.segment_bytes), dtype=np.uint8)
+        inside = np.flatnonzero(~self._outside(block, segments, query))
+        if query.empty or not len(inside):
+            return candidates
+        # Only the span of segments the zone maps keep is combined
+        first, stop = inside[0] * self.segment_bytes, (inside[-1] + 1) * self.segment_bytes
+        combined = None
+        for rows, invert in self._columns(query):
+            column = np.bitwise_or.reduce(block.bitmaps[rows, first:stop], axis=0)
+            if invert:
+                column = ~column
+            combined = column if combined is None else combined & column
+        span = candidates.reshape(-1)[first:stop]
+        span[:] = 0xFF if combined is None else combined
+        candidates[:inside[0]] = 0
+        candidates[np.setdiff1d(np.arange(inside[0], inside[-1] + 1), inside)] = 0
+        return candidates
+
+    @staticmethod
+    def _outside(block: _Block, segments: int, query: TransactionQuery) -> np.ndarray:
+        """Which of the block's segments hold no row in the query's time and amount ranges"""
+        timestamps, amounts = block.timestamps[:segments], block.amounts[:segments]
+        outside = np.zeros(segments, dtype=bool)
+        if query.start_us is not None:
+            outside |= timestamps[:, 1] < query.start_us
+        if query.end_us is not None:
+            outside |= timestamps[:, 0] >= query.end_us
+        if query.min_amount is not None:
+            outside |= amounts[:, 1] < query.min_amount
+        if query.max_amount is not None:
+            outside |= amounts[:, 0] > query.max_amount
+        return outside
@@ -0,0 +1,393 @@
+import os
+import shutil
+import tempfile
+import threading
+import weakref
+from typing import Dict, List, Iterator, Optional, Sequence, Tuple
+import numpy as np
+
+from models import Transaction, CURRENCIES, TRANSACTION_CATEGORIES, PAYMENT_METHODS, FRAUD_PATTERN_CODES
+from batch_engine import (
+    TransactionBatch, COLUMN_DTYPES, format_device, format_ips, format_timestamps, format_uuids,
+    take_labels,
+)
+from serialization import TransactionEncoder
+from transaction_index import BitmapIndex, TransactionQuery, AMOUNT_BIN_EDGES, BLOCK_SEGMENTS
+
+# Columns of spilled segments start on this boundary, so every column can be viewed in place
+SPILL_ALIGNMENT = 64
+
+def _columns(batch: TransactionBatch) -> List[np.ndarray]:
+    return [getattr(batch, name) for name in COLUMN_DTYPES] + list((batch.features or {}).values())
+
+def write_segment(path: str, arrays: List[np.ndarray]):
+    """Write arrays back to back, each padded to SPILL_ALIGNMENT bytes, to one file"""
+    with open(path, "wb") as f:
+        for array in arrays:
+            f.write(np.ascontiguousarray(array).tobytes())
+            f.write(b"\0" * (-f.tell() % SPILL_ALIGNMENT))
+
+def map_segment(path: str, specs: List[Tuple[type, int]]) -> List[np.ndarray]:
+    """Read-only views of the (dtype, length) arrays of a file written by write_segment, through one mapping"""
+    data = np.memmap(path, dtype=np.uint8, mode="r")
+    arrays = []
+    offset = 0
+    for dtype, length in specs:
+        arrays.append(data[offset:offset + length * np.dtype(dtype).itemsize].view(dtype))
+        offset += -(-arrays[-1].nbytes // SPILL_ALIGNMENT) * SPILL_ALIGNMENT
+    return arrays
+
+class TransactionStore:
+    """Append-only columnar transaction storage.
+
+    Rows are kept as typed NumPy columns (see TransactionBatch) in fixed-size
+    segments: appends fill an open tail segment, which is sealed once it holds
+    `segment_rows` rows. Transaction objects are only built when rows are read
+    back through indexing, iteration or tail().
+
+    With `feature_dtypes` every appended batch must carry those feature
+    columns, which are stored alongside the rest and decoded into
+    Transaction.features.
+
+    With a `memory_budget` (bytes), sealed segments are spilled to files in
+    a private directory under `spill_dir` (default: the system temporary
+    directory), oldest first, whenever the segments held in memory exceed
+    it, and are read back through memory mappings. The pages of spilled
+    segments belong to the OS page cache, so a run's resident memory stays
+    about the budget however many rows it retains. The files are deleted by
+    clear() or when the store is garbage collected.
+
+    With `indexed`, sealed segments are added to a BitmapIndex, which
+    query() uses to find matching rows without scanning; its full blocks
+    are spilled like segments. `amount_bin_edges` are its base-currency
+    amount bins, see transaction_index.amount_bin_edges.
+    """
+
+    def __init__(self, user_ids: Sequence[str] = (), merchant_ids: Sequence[str] = (),
+                 locations: Sequence[Dict] = (), segment_rows: int = 65536,
+                 feature_dtypes: Optional[Dict[str, type]] = None, memory_budget: Optional[int] = None,
+                 spill_dir: Optional[str] = None, indexed: bool = False,
+                 amount_bin_edges: np.ndarray = AMOUNT_BIN_EDGES):
+        self.user_ids = user_ids
+        self.merchant_ids = merchant_ids
+        self.locations = locations
+        self.segment_rows = segment_rows
+        self.feature_dtypes = feature_dtypes
+        self.memory_budget = memory_budget
+        self.spill_dir = spill_dir
+        self._encoder = None
+        self.segments: List[TransactionBatch] = []
+        self.indexed = indexed
+        self.cardinalities = {"fraud_pattern": len(FRAUD_PATTERN_CODES), "payment_method": len(PAYMENT_METHODS),
+                              "city": len(locations), "currency": len(CURRENCIES),
+                              "category": len(TRANSACTION_CATEGORIES)}
+        self.amount_bin_edges = amount_bin_edges
+        self.index = BitmapIndex(self.cardinalities, segment_rows, amount_bin_edges) if indexed else None
+        # segments[:spilled] are memory-mapped from segment_files, in _spill_path unless mapped by map_sealed
+        self.spilled = 0
+        self.segment_files: List[str] = []
+        self._spill_path: Optional[str] = None
+        self._spill_cleanup = None
+        # Allocated on first append, so empty stores cost nothing
+        self._tail = None
+        self._tail_size = 0
+        self._size = 0
+        # Readers may slice the store while a simulation thread appends to it
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return self._size
+
+    def __bool__(self) -> bool:
+        return self._size > 0
+
+    @property
+    def nbytes(self) -> int:
+        """Memory held by the segments not spilled, including the unfilled part of the tail"""
+        resident = sum(segment.nbytes for segment in self.segments[self.spilled:])
+        resident += self.index.nbytes if self.index is not None else 0
+        return resident + (self._tail.nbytes if self._tail is not None else 0)
+
+    @property
+    def spilled_bytes(self) -> int:
+        """Bytes of rows spilled to disk"""
+        spilled = sum(segment.nbytes for segment in self.segments[:self.spilled])
+        if self.index is not None:
+            spilled += self.index.spilled * self.index.codes * BLOCK_SEGMENTS * self.index.segment_bytes
+        return spilled
+
+    def append_batch(self, batch: TransactionBatch):
+        """Copy a generated batch into the store"""
+        with self._lock:
+            self._append(batch)
+
+    def _append(self, batch: TransactionBatch):
+        start = 0
+        while start < len(batch):
+            if self._tail is None:
+                self._tail = TransactionBatch.allocate(self.segment_rows, self.feature_dtypes)
+            n = min(len(batch) - start, self.segment_rows - self._tail_size)
+            for name in COLUMN_DTYPES:
+                getattr(self._tail, name)[self._tail_size:self._tail_size + n] = getattr(batch, name)[start:start + n]
+            for name in self.feature_dtypes or ():
+                self._tail.features[name][self._tail_size:self._tail_size + n] = batch.features[name][start:start + n]
+            self._tail_size += n
+            self._size += n
+            start += n
+            if self._tail_size == self.segment_rows:
+                if self.index is not None:
+                    self.index.add(self._tail)
+                self.segments.append(self._tail)
+                self._tail = None
+                self._tail_size = 0
+                self._enforce_budget()
+
+    def _enforce_budget(self):
+        """Spill index blocks, then the oldest segments, until the store fits its memory budget (lock held)"""
+        if self.memory_budget is None:
+            return
+        while self.nbytes > self.memory_budget:
+            # Full index blocks go first: they only cover rows older than any resident segment's
+            if self.index is not None and self.index.spill(
+                    self._spill_file(f"index-{self.index.spilled:06d}.bin"), write_segment, map_segment):
+                continue
+            if self.spilled == len(self.segments):
+                break
+            self._spill_next()
+
+    def _spill_file(self, name: str) -> str:
+        """Path of a spill file, creating the private spill directory on first use (lock held)"""
+        if self._spill_path is None:
+            if self.spill_dir:
+                os.makedirs(self.spill_dir, exist_ok=True)
+            self._spill_path = tempfile.mkdtemp(prefix="fraud-sim-store-", dir=self.spill_dir)
+            self._spill_cleanup = weakref.finalize(self, shutil.rmtree, self._spill_path, ignore_errors=True)
+        return os.path.join(self._spill_path, name)
+
+    def _spill_next(self):
+        """Move the oldest segment still in memory to a file and map it back (lock held)"""
+        path = self._spill_file(f"segment-{self.spilled:06d}.bin")
+        write_segment(path, _columns(self.segments[self.spilled]))
+        self.segments[self.spilled] = self._map(path)
+        self.segment_files.append(path)
+        self.spilled += 1
+
+    def _map(self, path: str) -> TransactionBatch:
+        """A full segment mapped from a file written by write_segment"""
+        dtypes = list(COLUMN_DTYPES.values()) + list((self.feature_dtypes or {}).values())
+        views = map_segment(path, [(dtype, self.segment_rows) for dtype in dtypes])
+        return TransactionBatch(
+            **dict(zip(COLUMN_DTYPES, views)),
+            features=dict(zip(self.feature_dtypes, views[len(COLUMN_DTYPES):])) if self.feature_dtypes else None)
+
+    def save_segment(self, segment: int, path: str):
+        """Write sealed segment `segment` to `path` in write_segment's layout, for map_sealed to map back.
+
+        A spilled segment's file is hard-linked rather than copied, so its
+        rows are stored once; it is copied only across file systems.
+        """
+        tmp = path + ".tmp"
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        if segment < self.spilled:
+            try:
+                os.link(self.segment_files[segment], tmp)
+            except OSError:
+                shutil.copyfile(self.segment_files[segment], tmp)
+        else:
+            write_segment(tmp, _columns(self.segments[segment]))
+        os.replace(tmp, path)
+
+    def map_sealed(self, path: str):
+        """Append a full segment saved by save_segment, mapped in place rather than read into memory.
+
+        Mapped segments must come first, so this only works on a store that
+        holds nothing but mapped segments, as when restoring a checkpoint.
+        The file is not deleted with the store.
+        """
+        with self._lock:
+            if self._tail_size or self.spilled != len(self.segments):
+                raise ValueError("Segments can only be mapped ahead of any appended rows")
+            segment = self._map(path)
+            if self.index is not None:
+                self.index.add(segment)
+            self.segments.append(segment)
+            self.segment_files.append(path)
+            self.spilled += 1
+            self._size += self.segment_rows
+            self._enforce_budget()
+
+    def clear(self):
+        """Drop every row, releasing their memory and spill files"""
+        with self._lock:
+            self.segments = []
+            if self.index is not None:
+                self.index = BitmapIndex(self.cardinalities, self.segment_rows, self.amount_bin_edges)
+            self.spilled = 0
+            self.segment_files = []
+            self._tail = None
+            self._tail_size = 0
+            self._size = 0
+            if self._spill_cleanup is not None:
+                # Mapped views still held by readers stay valid after their files are unlinked
+                self._spill_cleanup()
+                self._spill_path = self._spill_cleanup = None
+
+    def iter_segments(self) -> Iterator[TransactionBatch]:
+        """Sealed segments followed by a view of the filled part of the tail"""
+        yield from self.segments
+        if self._tail_size:
+            yield self._tail.take(slice(0, self._tail_size))
+
+    def column(self, name: str) -> np.ndarray:
+        """A whole column as one array (copies when more than one segment exists)"""
+        parts = [getattr(segment, name) for segment in self.iter_segments()]
+        if not parts:
+            return np.empty(0, dtype=COLUMN_DTYPES[name])
+        return parts[0] if len(parts) == 1 else np.concatenate(parts)
+
+    def slice(self, start: int, stop: int) -> TransactionBatch:
+        """Rows [start, stop) as a columnar batch
+
+        Rows within one segment come back as a view of it, with no copy
+        even when the segment is spilled; rows spanning segments are copied
+        into one batch.
+        """
+        with self._lock:
+            start, stop, _ = slice(start, stop).indices(self._size)
+            # Sealed segments are all full, so the first one needed is found by division
+            first = min(start // self.segment_rows, len(self.segments))
+            segments = self.segments[first:]
+            if self._tail_size:
+                segments.append(self._tail)
+            parts = []
+            offset = first * self.segment_rows
+            for segment in segments:
+                size = self._tail_size if segment is self._tail else len(segment)
+                seg_start, seg_stop = max(start - offset, 0), min(stop - offset, size)
+                if seg_start < seg_stop:
+                    parts.append(segment.take(slice(seg_start, seg_stop)))
+                offset += size
+                if offset >= stop:
+                    break
+            if not parts:
+                return TransactionBatch.allocate(0, self.feature_dtypes)
+            return parts[0] if len(parts) == 1 else TransactionBatch.concat(parts)
+
+    def query(self, query: TransactionQuery, cursor: int = 0, limit: int = 100) -> Tuple[TransactionBatch, int, bool]:
+        """Up to `limit` rows matching `query` from row `cursor` on, in store order
+
+        Returns (rows, next cursor, whether the limit cut the result short).
+        Sealed segments are searched through the bitmap index, a block of
+        segments at a time, when the store is indexed; other rows are
+        scanned. Once no more rows match, the next cursor is the store's
+        size, so polling with it picks up rows appended since.
+        """
+        with self._lock:
+            segments = list(self.segments)
+            if self._tail_size:
+                segments.append(self._tail.take(slice(0, self._tail_size)))
+            indexed = len(self.segments) if self.index is not None else 0
+            index = self.index
+            size = self._size
+        cursor = max(cursor, 0)
+        if query.empty:
+            return TransactionBatch.allocate(0, self.feature_dtypes), max(size, cursor), False
+        block_rows = BLOCK_SEGMENTS * self.segment_rows
+        parts = []
+        found = 0
+
+        def collect(i: int, rows: np.ndarray):
+            # Keep the rows of segment i up to the limit; the cursor after the last one once it is reached
+            nonlocal found
+            if found + len(rows) >= limit:
+                rows = rows[:limit - found]
+                parts.append(segments[i].take(rows))
+                return i * self.segment_rows + int(rows[-1]) + 1
+            if len(rows):
+                parts.append(segments[i].take(rows))
+                found += len(rows)
+            return None
+
+        for block in range(cursor // block_rows, -(-indexed // BLOCK_SEGMENTS)):
+            candidates = index.candidates(block, query)
+            first = block * BLOCK_SEGMENTS
+            candidates = candidates[:indexed - first]
+            if cursor > first * self.segment_rows:
+                # Clear the bits of rows before the cursor (packbits puts the first row in the high bit)
+                segment, row = divmod(cursor - first * self.segment_rows, self.segment_rows)
+                candidates[:segment] = 0
+                if segment < len(candidates):
+                    candidates[segment, :row // 8] = 0
+                    candidates[segment, row // 8] &= 0xFF >> (row % 8)
+            for offset in np.flatnonzero(candidates.any(axis=1)).tolist():
+                rows = np.flatnonzero(np.unpackbits(candidates[offset]))
+                rows = rows[query.matches(segments[first + offset], rows)]
+                next_cursor = collect(first + offset, rows)
+                if next_cursor is not None:
+                    return TransactionBatch.concat(parts), next_cursor, True
+
+        for i in range(max(cursor // self.segment_rows, indexed), len(segments)):
+            rows = np.arange(max(cursor - i * self.segment_rows, 0), len(segments[i]))
+            next_cursor = collect(i, rows[query.matches(segments[i], rows)])
+            if next_cursor is not None:
+                return TransactionBatch.concat(parts), next_cursor, True
+        batch = TransactionBatch.concat(parts) if parts else TransactionBatch.allocate(0, self.feature_dtypes)
+        return batch, max(size, cursor), False
+
+    def decode_columns(self, batch: TransactionBatch) -> Dict[str, list]:
+        """Decode a batch into Transaction field name -> list of Python values"""
+        columns = {
+            "transaction_id": format_uuids(batch.id_hi, batch.id_lo),
+            "user_id": take_labels(self.user_ids, batch.user),
+            "amount": batch.amount.tolist(),
+            "currency": [CURRENCIES[code] for code in batch.currency.tolist()],
+            "merchant_id": take_labels(self.merchant_ids, batch.merchant),
+            "merchant_category": [TRANSACTION_CATEGORIES[code] for code in batch.category.tolist()],
+            "timestamp": format_timestamps(batch.timestamp_us),
+            "device_fingerprint": [format_device(device) for device in batch.device.tolist()],
+            "ip_address": format_ips(batch.ip),
+            "location": [self.locations[city] for city in batch.city.tolist()],
+            "payment_method": [PAYMENT_METHODS[code] for code in batch.payment_method.tolist()],
+            "is_synthetic": [True] * len(batch),
+            "fraud_pattern": [FRAUD_PATTERN_CODES[code] for code in batch.fraud_pattern.tolist()],
+            "risk_score": batch.risk_score.tolist(),
+            "amount_base": batch.amount_base.tolist(),
+        }
+        if batch.features:
+            names = list(batch.features)
+            values = zip(*(batch.features[name].tolist() for name in names))
+            columns["features"] = [dict(zip(names, row)) for row in values]
+        return columns
+
+    @property
+    def encoder(self) -> TransactionEncoder:
+        """Encoder serializing rows of this store without building Transaction objects"""
+        if self._encoder is None:
+            self._encoder = TransactionEncoder(self)
+        return self._encoder
+
+    def to_transactions(self, batch: TransactionBatch) -> List[Transaction]:
+        """Materialize a batch as Transaction views"""
+        columns = self.decode_columns(batch)
+        return [Transaction(*row) for row in zip(*columns.values())]
+
+    def tail(self, n: int) -> List[Transaction]:
+        """The last `n` transactions"""
+        return self.to_transactions(self.slice(max(self._size - n, 0), self._size))
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(self._size)
+            if step == 1:
+                return self.to_transactions(self.slice(start, stop))
+            return [self[i] for i in range(start, stop, step)]
+        if index < 0:
+            index += self._size
+        if not 0 <= index < self._size:
+            raise IndexError("transaction index out of range")
+        return self.to_transactions(self.slice(index, index + 1))[0]
+
+    def __iter__(self) -> Iterator[Transaction]:
+        for segment in self.iter_segments():
+            yield from self.to_transactions(segment)
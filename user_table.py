@@ -0,0 +1,230 @@
+import logging
+import os
+import uuid
+from collections.abc import Mapping, Sequence
+from dataclasses import dataclass
+from typing import Dict, List, Any, Optional
+
+import numpy as np
+from faker import Faker
+
+from models import merchant_id, payment_methods_for_location
+from batch_engine import format_device, format_uuid, format_uuids, random_uuids, sample_distinct
+from data_pools import DataPools, RISK_LEVELS, save_arrays, load_arrays
+from seeding import derive, numpy_stream, USERS
+
+logger = logging.getLogger(__name__)
+
+# Bump when the table layout or the way users are drawn changes, to orphan old caches
+USER_CACHE_VERSION = 1
+
+# Users are drawn in chunks of this many, each from its own stream below USERS,
+# so building a population never holds more than one chunk of scratch arrays
+USER_CHUNK = 1 << 16
+
+# Sub-streams of USERS: the table's attributes and the per-user Faker profiles
+ATTRIBUTES = 0
+PROFILES = 1
+
+MIN_MERCHANTS, MAX_MERCHANTS = 5, 20
+MIN_DEVICES, MAX_DEVICES = 1, 5
+
+def _ragged(rng: np.random.Generator, rows: int, low: int, high: int, population: int):
+    """(counts, values): `low`..`high` distinct values from range(population) per row, concatenated"""
+    high = min(high, population)
+    counts = rng.integers(min(low, high), high + 1, rows)
+    sample = sample_distinct(rng, rows, high, population)
+    return counts, sample[np.arange(high) < counts[:, None]].astype(np.int32)
+
+def _offsets(counts: List[np.ndarray]) -> np.ndarray:
+    return np.concatenate([[0], np.cumsum(np.concatenate(counts))]).astype(np.int64)
+
+@dataclass
+class UserTable:
+    """The user population as flat arrays, one entry per user.
+
+    User i has the version-4 UUID (`id_hi[i]`, `id_lo[i]`), home location
+    index `home_city[i]` and risk level index `risk_profile[i]`. Preferred
+    merchants and devices are ragged lists stored CSR-style: user i's
+    merchants are `merchants[merchant_offsets[i]:merchant_offsets[i + 1]]`
+    (merchant pool indexes) and its devices likewise index the device pool.
+    Names, emails and phone numbers are not stored; see UserDirectory.
+    """
+    id_hi: np.ndarray
+    id_lo: np.ndarray
+    home_city: np.ndarray
+    account_age_days: np.ndarray
+    average_amount: np.ndarray
+    risk_profile: np.ndarray
+    merchant_offsets: np.ndarray
+    merchants: np.ndarray
+    device_offsets: np.ndarray
+    devices: np.ndarray
+
+    def __len__(self) -> int:
+        return len(self.id_hi)
+
+    @property
+    def nbytes(self) -> int:
+        return sum(getattr(self, name).nbytes for name in self.__dataclass_fields__)
+
+    @classmethod
+    def build(cls, seed_sequence: np.random.SeedSequence, num_users: int, num_merchants: int, num_devices: int,
+              num_cities: int) -> "UserTable":
+        """Draw `num_users` users from the simulator's user stream, a chunk at a time"""
+        if not num_users:
+            return cls.empty()
+        parts: Dict[str, List[np.ndarray]] = {name: [] for name in cls.__dataclass_fields__}
+        for chunk, first in enumerate(range(0, num_users, USER_CHUNK)):
+            rows = min(USER_CHUNK, num_users - first)
+            # Whole chunks are drawn and cut short, so smaller populations are prefixes of larger ones
+            rng = numpy_stream(seed_sequence, USERS, ATTRIBUTES, chunk)
+            hi, lo = random_uuids(rng, USER_CHUNK)
+            drawn = {
+                "id_hi": hi,
+                "id_lo": lo,
+                "home_city": rng.integers(0, num_cities, USER_CHUNK, dtype=np.int16),
+                "account_age_days": rng.integers(30, 1095, USER_CHUNK, dtype=np.int16, endpoint=True),
+                "average_amount": rng.uniform(10, 1000, USER_CHUNK),
+                "risk_profile": rng.integers(0, len(RISK_LEVELS), USER_CHUNK, dtype=np.int8),
+            }
+            for name, values in drawn.items():
+                parts[name].append(values[:rows])
+            for lists, low, high, population in (("merchant", MIN_MERCHANTS, MAX_MERCHANTS, num_merchants),
+                                                 ("device", MIN_DEVICES, MAX_DEVICES, num_devices)):
+                counts, values = _ragged(rng, USER_CHUNK, low, high, population)
+                parts[f"{lists}_offsets"].append(counts[:rows])
+                parts[f"{lists}s"].append(values[:int(counts[:rows].sum())])
+
+        columns = {name: np.concatenate(values) for name, values in parts.items()}
+        columns["merchant_offsets"] = _offsets(parts["merchant_offsets"])
+        columns["device_offsets"] = _offsets(parts["device_offsets"])
+        return cls(**columns)
+
+    @classmethod
+    def empty(cls) -> "UserTable":
+        return cls(np.empty(0, np.uint64), np.empty(0, np.uint64), np.empty(0, np.int16), np.empty(0, np.int16),
+                   np.empty(0), np.empty(0, np.int8), np.zeros(1, np.int64), np.empty(0, np.int32),
+                   np.zeros(1, np.int64), np.empty(0, np.int32))
+
+    def save(self, path: str):
+        save_arrays(self, path)
+
+    @classmethod
+    def load(cls, path: str) -> "UserTable":
+        return load_arrays(cls, path)
+
+def user_cache_path(cache_dir: str, seed: int, num_users: int, num_devices: int, num_merchants: int,
+                    num_cities: int) -> str:
+    return os.path.join(cache_dir, f"users-v{USER_CACHE_VERSION}-{seed}-{num_users}-{num_devices}-"
+                                   f"{num_merchants}-{num_cities}")
+
+def load_or_build_users(seed: int, seed_sequence: np.random.SeedSequence, num_users: int, num_devices: int,
+                        num_merchants: int, num_cities: int, cache_dir: Optional[str] = None) -> UserTable:
+    """The user table for a seed and sizes, from `cache_dir` when it already holds it"""
+    if not cache_dir:
+        return UserTable.build(seed_sequence, num_users, num_merchants, num_devices, num_cities)
+
+    path = user_cache_path(cache_dir, seed, num_users, num_devices, num_merchants, num_cities)
+    if not os.path.isdir(path):
+        logger.info(f"Building user table into {path}")
+        UserTable.build(seed_sequence, num_users, num_merchants, num_devices, num_cities).save(path)
+    return UserTable.load(path)
+
+class UserIds(Sequence):
+    """The users' id strings, formatted on access"""
+
+    def __init__(self, table: UserTable):
+        self.table = table
+        self._order: Optional[np.ndarray] = None
+        self._sorted_hi: Optional[np.ndarray] = None
+
+    def __len__(self) -> int:
+        return len(self.table)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return self.take(np.arange(len(self))[index])
+        return format_uuid(int(self.table.id_hi[index]), int(self.table.id_lo[index]))
+
+    def take(self, indices: np.ndarray) -> List[str]:
+        return format_uuids(self.table.id_hi[indices], self.table.id_lo[indices])
+
+    def index(self, user_id: str) -> int:
+        """Row of `user_id` in the table, found by binary search over the ids sorted on first use"""
+        try:
+            value = uuid.UUID(user_id).int
+        except (AttributeError, TypeError, ValueError):
+            raise ValueError(f"{user_id!r} is not a user id")
+        if self._order is None:
+            self._order = np.argsort(self.table.id_hi, kind="stable")
+            self._sorted_hi = self.table.id_hi[self._order]
+        hi, lo = np.uint64(value >> 64), np.uint64(value & 0xFFFFFFFFFFFFFFFF)
+        left = np.searchsorted(self._sorted_hi, hi, side="left")
+        right = np.searchsorted(self._sorted_hi, hi, side="right")
+        for row in self._order[left:right].tolist():
+            if self.table.id_lo[row] == lo:
+                return row
+        raise ValueError(f"{user_id!r} is not a user id")
+
+    def __contains__(self, user_id) -> bool:
+        try:
+            self.index(user_id)
+        except ValueError:
+            return False
+        return True
+
+class UserDirectory(Mapping):
+    """user_id -> user dict, built on first access.
+
+    Attributes come from the UserTable; name, email and phone come from a
+    Faker seeded per user, so they are only generated for users that are
+    looked up and do not depend on which users were looked up before.
+    """
+
+    def __init__(self, table: UserTable, pools: DataPools, locations: List[Dict],
+                 seed_sequence: np.random.SeedSequence):
+        self.table = table
+        self.pools = pools
+        self.locations = locations
+        self.seed_sequence = seed_sequence
+        self.ids = UserIds(table)
+        self._faker = Faker()
+        self._cache: Dict[str, Dict[str, Any]] = {}
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def __iter__(self):
+        return iter(self.ids)
+
+    def __contains__(self, key) -> bool:
+        return key in self.ids
+
+    def __getitem__(self, key: str) -> Dict[str, Any]:
+        user = self._cache.get(key)
+        if user is None:
+            try:
+                i = self.ids.index(key)
+            except ValueError:
+                raise KeyError(key)
+            table = self.table
+            self._faker.seed_instance(int(derive(self.seed_sequence, USERS, PROFILES, i).generate_state(1)[0]))
+            home_location = self.locations[table.home_city[i]]
+            merchants = table.merchants[table.merchant_offsets[i]:table.merchant_offsets[i + 1]]
+            devices = table.devices[table.device_offsets[i]:table.device_offsets[i + 1]]
+            user = {
+                "user_id": key,
+                "name": self._faker.name(),
+                "email": self._faker.email(),
+                "phone": self._faker.phone_number(),
+                "home_location": home_location,
+                "account_age_days": int(table.account_age_days[i]),
+                "average_transaction_amount": float(table.average_amount[i]),
+                "preferred_merchants": [merchant_id(m) for m in merchants.tolist()],
+                "risk_profile": RISK_LEVELS[table.risk_profile[i]],
+                "devices": [format_device(int(self.pools.device_codes[d])) for d in devices.tolist()],
+                "preferred_payment_methods": payment_methods_for_location(home_location)
+            }
+            self._cache[key] = user
+        return user